@@ -1,87 +1,131 @@
-from agno.agent import Agent
-from agno.models.groq import Groq
+"""
+Agent definitions.
+
+Nothing heavy is built at import time: the agno Agent class, the Groq client and
+each agent are created on first use (get_agent() or attribute access such as
+agents_config.main_router_agent), then cached for the life of the process. A
+worker that only ever uses the coordinator never builds the specialist agents.
+Build times are reported through instrumentation.record_startup().
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+import instrumentation
 from tools import (
     validate_user_id, log_cgm_reading, record_food_and_estimate_macros, 
-    log_user_mood, generate_adaptive_meal_plan
+    log_user_mood, generate_adaptive_meal_plan, analyze_cgm_trends, summarize_mood_trends
 )
-import os
-from dotenv import load_dotenv
 
 load_dotenv()
 
 
-# GROQ_API_KEY 
-LLM = Groq(
-    id="llama-3.1-8b-instant",  # Using a smaller, faster model to avoid rate limits
-    api_key=os.getenv("GROQ_API_KEY"),  # Load from environment
-    temperature=0.3
-)
+# LLM_BACKEND=stub swaps in an offline scripted model (stub_llm.py) for tests and benchmarks
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq").lower()
+
+_build_lock = threading.RLock()
+_llm = None
+
+
+def get_llm():
+    """The shared model client, created on first use."""
+    global _llm
+    with _build_lock:
+        if _llm is None:
+            start = time.perf_counter()
+            if LLM_BACKEND == "stub":
+                from stub_llm import StubModel
+                _llm = StubModel()
+            else:
+                from agno.models.groq import Groq
+                # GROQ_API_KEY 
+                _llm = Groq(
+                    id="llama-3.1-8b-instant",  # Using a smaller, faster model to avoid rate limits
+                    api_key=os.getenv("GROQ_API_KEY"),  # Load from environment
+                    temperature=0.3
+                )
+            instrumentation.record_startup("llm", time.perf_counter() - start)
+        return _llm
+
 
 # --- Agents ---
+# Constructor arguments per agent; see get_agent()
+AGENT_SPECS: Dict[str, Dict[str, Any]] = {}
+
+# Specialists are also run directly by intent_router (ROUTING_MODE=specialist), with the same
+# "[User ID: n]" request context the coordinator gets
+USER_CONTEXT_RULE = (
+    "\nIf the request starts with [User ID: n], use that user_id for every tool call "
+    "and do not ask for the ID again."
+)
 
 # 1. Greeting Agent - Validates user ID and greets personally
-greeting_agent = Agent(
+AGENT_SPECS["greeting_agent"] = dict(
     name="GreetingAgent",
-    model=LLM,
     instructions=(
         "You are the Greeting Agent. Your role is to:\n"
         "1. Validate user ID against the dataset using validate_user_id tool\n"
         "2. If invalid, prompt user to re-enter a valid ID (1-100)\n"
         "3. If valid, retrieve name/city and greet personally\n"
         "4. Always call validate_user_id tool first before greeting"
+        + USER_CONTEXT_RULE
     ),
     tools=[validate_user_id]
 )
 
 # 2. Mood Tracker Agent - Captures and stores user mood
-mood_tracker_agent = Agent(
+AGENT_SPECS["mood_tracker_agent"] = dict(
     name="MoodTrackerAgent",
-    model=LLM,
     instructions=(
         "You are the Mood Tracker Agent. Your role is to:\n"
         "1. Capture user mood labels (happy, sad, excited, tired, etc.)\n"
         "2. Store mood in memory using log_user_mood tool\n"
-        "3. Compute rolling average of mood scores\n"
+        "3. Report rolling averages and trends of mood scores using summarize_mood_trends tool\n"
         "4. Provide mood insights and trends\n"
         "5. MUST use log_user_mood tool for all mood logging"
+        + USER_CONTEXT_RULE
     ),
-    tools=[log_user_mood]
+    tools=[log_user_mood, summarize_mood_trends]
 )
 
 # 3. CGM Agent - Logs glucose readings with alerts
-cgm_agent = Agent(
+AGENT_SPECS["cgm_agent"] = dict(
     name="CGMAgent",
-    model=LLM,
     instructions=(
         "You are the CGM Agent. Your role is to:\n"
         "1. Log Continuous Glucose Monitor readings using log_cgm_reading tool\n"
         "2. Validate range: 80-300 mg/dL\n"
         "3. Flag alerts if outside safe range\n"
-        "4. Provide glucose trend analysis\n"
+        "4. Provide glucose trend analysis using analyze_cgm_trends tool\n"
         "5. MUST use log_cgm_reading tool and strictly enforce the 80-300 mg/dL range"
+        + USER_CONTEXT_RULE
     ),
-    tools=[log_cgm_reading]
+    tools=[log_cgm_reading, analyze_cgm_trends]
 )
 
 # 4. Food Intake Agent - Records meals with nutrient estimation
-food_intake_agent = Agent(
+AGENT_SPECS["food_intake_agent"] = dict(
     name="FoodIntakeAgent",
-    model=LLM,
     instructions=(
         "You are the Food Intake Agent. Your role is to:\n"
         "1. Record meals/snacks with timestamps using record_food_and_estimate_macros tool\n"
-        "2. Categorize nutrients (carbs/protein/fat) via LLM analysis\n"
-        "3. Provide macro estimates for logged meals\n"
+        "2. Report the nutrients (carbs/protein/fat/kcal) the tool returns from the nutrient database\n"
+        "3. Estimate macros yourself only for items the tool lists as not in the nutrient database\n"
         "4. Track eating patterns and timing\n"
         "5. MUST call record_food_and_estimate_macros tool for all food logging"
+        + USER_CONTEXT_RULE
     ),
     tools=[record_food_and_estimate_macros]
 )
 
 # 5. Meal Planner Agent - Generates adaptive meal plans
-meal_planner_agent = Agent(
+AGENT_SPECS["meal_planner_agent"] = dict(
     name="MealPlannerAgent",
-    model=LLM,
     instructions=(
         "You are the Meal Planner Agent. Your role is to:\n"
         "1. Generate adaptive 3-meal plans per day using generate_adaptive_meal_plan tool\n"
@@ -90,14 +134,14 @@ meal_planner_agent = Agent(
         "4. If glucose readings are off, provide meals to get it under control\n"
         "5. Include macro content (Carbs, Protein, Fat) for each meal\n"
         "6. MUST use generate_adaptive_meal_plan tool for all meal planning"
+        + USER_CONTEXT_RULE
     ),
     tools=[generate_adaptive_meal_plan]
 )
 
 # 6. Interrupt Agent - General Q&A Assistant (Always listening)
-interrupt_agent = Agent(
+AGENT_SPECS["interrupt_agent"] = dict(
     name="InterruptAgent",
-    model=LLM,
     instructions=(
         "You are the Interrupt Agent - a General Q&A Assistant. Your role is to:\n"
         "1. Always listen for general queries from users\n"
@@ -111,15 +155,16 @@ interrupt_agent = Agent(
 
 # --- Multi-Agent Orchestration ---
 # Main Router Agent that coordinates all 6 specialized agents
-main_router_agent = Agent(
+AGENT_SPECS["main_router_agent"] = dict(
     name="HealthcareCoordinator",
-    model=LLM,
     tools=[
         validate_user_id,
         log_cgm_reading, 
         record_food_and_estimate_macros,
         log_user_mood,
-        generate_adaptive_meal_plan
+        generate_adaptive_meal_plan,
+        analyze_cgm_trends,
+        summarize_mood_trends
     ],
     instructions=(
         "You are the Healthcare Coordinator - the central orchestrator for a multi-agent healthcare system. "
@@ -138,8 +183,11 @@ main_router_agent = Agent(
         "ROUTING LOGIC:\n"
         "- User ID validation → Greeting Agent (use validate_user_id tool)\n"
         "- Mood mentions (tired, happy, sad, etc.) → Mood Tracker Agent (use log_user_mood tool with correct user_id)\n"
+        "- Mood history/trends → Mood Tracker Agent (use summarize_mood_trends tool with correct user_id)\n"
         "- Glucose readings → CGM Agent (use log_cgm_reading tool with correct user_id)\n"
-        "- Food/meals → Food Intake Agent (use record_food_and_estimate_macros tool with correct user_id)\n"
+        "- Glucose history/trends (time in range, averages, A1C) → CGM Agent (use analyze_cgm_trends tool with correct user_id)\n"
+        "- Food/meals → Food Intake Agent (use record_food_and_estimate_macros tool with correct user_id; "
+        "it returns the macros, estimate only items it reports as not found)\n"
         "- Meal planning → Meal Planner Agent (use generate_adaptive_meal_plan tool with correct user_id)\n"
         "- General questions → Interrupt Agent\n\n"
         "CONVERSATION FLOW:\n"
@@ -150,3 +198,36 @@ main_router_agent = Agent(
         "Provide friendly, conversational responses like a healthcare assistant who remembers the conversation context."
     )
 )
+
+
+def get_agent(attr: str):
+    """Builds (once) and returns the agent registered under `attr` in AGENT_SPECS."""
+    agent = globals().get(attr)
+    if agent is not None:
+        return agent
+    with _build_lock:
+        agent = globals().get(attr)
+        if agent is None:
+            start = time.perf_counter()
+            from agno.agent import Agent
+            agent = Agent(model=get_llm(), **AGENT_SPECS[attr])
+            # later attribute lookups hit the module dict directly, bypassing __getattr__
+            globals()[attr] = agent
+            instrumentation.record_startup(f"agent.{attr}", time.perf_counter() - start)
+    return agent
+
+
+async def aget_agent(attr: str):
+    """get_agent() for the event loop: a first-time build runs in a worker thread."""
+    agent = globals().get(attr)
+    if agent is None:
+        agent = await asyncio.get_running_loop().run_in_executor(None, get_agent, attr)
+    return agent
+
+
+def __getattr__(name: str):
+    if name in AGENT_SPECS:
+        return get_agent(name)
+    if name == "LLM":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
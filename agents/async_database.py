@@ -0,0 +1,82 @@
+"""
+Async data-access layer for the FastAPI endpoints and agent tools.
+
+sqlite3 is blocking, so every call is dispatched to a small dedicated thread
+pool instead of running on the event loop. Each pool thread keeps its own
+long-lived connection from database.get_connection(), and the pool size bounds
+how many queries can be in flight at once.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import database
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_in_db_thread(func: Callable, *args, **kwargs) -> Any:
+    """Runs a blocking database function on the DB executor and awaits its result."""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context (the current trace span) into the pool thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def get_user_profile(user_id: int) -> Optional[Dict[str, Any]]:
+    """Async wrapper for database.get_user_profile."""
+    return await run_in_db_thread(database.get_user_profile, user_id)
+
+
+async def log_data(user_id: int, log_type: str, value: str, meal_timestamp: Optional[str] = None):
+    """Async wrapper for database.log_data."""
+    await run_in_db_thread(database.log_data, user_id, log_type, value, meal_timestamp)
+
+
+async def log_data_batch(entries: List[Dict[str, Any]]) -> int:
+    """Async wrapper for database.log_data_batch."""
+    return await run_in_db_thread(database.log_data_batch, entries)
+
+
+async def get_user_logs(user_id: int, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Async wrapper for database.get_user_logs."""
+    return await run_in_db_thread(database.get_user_logs, user_id, **filters)
+
+
+async def get_mood_summary(user_id: int) -> Dict[str, Any]:
+    """Async wrapper for database.get_mood_summary."""
+    return await run_in_db_thread(database.get_mood_summary, user_id)
+
+
+async def stream_user_logs(user_id: int, chunk_size: int = 1000, **filters) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yields a user's logs lazily, newest first, fetching chunk_size rows at a time.
+    Uses its own connection so a slow client never ties up a pooled one; under WAL
+    the open read does not block writers.
+    """
+    await run_in_db_thread(database.flush_logs)
+    sql, params = database.build_user_logs_query(user_id, **filters)
+    conn = await run_in_db_thread(database._open_connection)
+    try:
+        cursor = await run_in_db_thread(conn.execute, sql, params)
+        while True:
+            rows = await run_in_db_thread(cursor.fetchmany, chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(database.LOG_COLUMNS, row))
+    finally:
+        await run_in_db_thread(conn.close)
+
+
+def shutdown():
+    """Drains the DB executor, flushes queued logs and closes pooled connections."""
+    _executor.shutdown(wait=True)
+    database.stop_log_writer()
+    database.close_connections()
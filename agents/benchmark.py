@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+End-to-end load/latency benchmark for the healthcare API.
+
+Drives run_server.app concurrently, in-process through httpx's ASGI transport,
+or against a running server with --url. It uses the offline stub model
+(LLM_BACKEND=stub) so the numbers measure the server's own overhead, not Groq.
+The database is a throwaway copy seeded by datagen.py with realistic volumes:
+the synthetic users plus weeks of 5-minute CGM readings and daily mood/food logs.
+
+    python benchmark.py                                  # all endpoints, defaults
+    python benchmark.py --requests 5000 --concurrency 64 --endpoints logs user_logs
+    python benchmark.py --url http://localhost:8000 --json results.json
+    python benchmark.py --endpoints agent --routing-mode specialist   # compare with coordinator
+
+Reports throughput and p50/p95/p99 latency per endpoint, plus model runs, tokens
+and latency per routing path for in-process runs. The exit status is
+non-zero when any request failed.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+AGENT_MESSAGES = [
+    "my glucose is {glucose}",
+    "I'm tired",
+    "I had oatmeal with berries for breakfast",
+    "can you make me a meal plan for today?",
+    "what should I do if my sugar is high?",
+    "how has my glucose looked this week?",
+    "how has my mood been lately?",
+    "what's the capital of France?",
+]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def request_factories(user_count: int) -> Dict[str, Callable[[int], Tuple[str, str, dict]]]:
+    """Endpoint name -> function(i) returning (method, path, httpx request kwargs)."""
+    def agent(i: int):
+        user_id = random.randint(1, user_count)
+        message = random.choice(AGENT_MESSAGES).format(glucose=random.randint(70, 250))
+        body = {"message": message, "user_id": user_id, "session_id": f"bench-{i % 500}"}
+        return "POST", "/ag-ui-agent", {"json": body}
+
+    def logs(i: int):
+        params = {"user_id": random.randint(1, user_count), "log_type": "cgm", "value": str(random.randint(70, 250))}
+        return "POST", "/logs", {"params": params}
+
+    def profile(i: int):
+        return "GET", f"/users/{random.randint(1, user_count)}", {}
+
+    def user_logs(i: int):
+        return "GET", f"/users/{random.randint(1, user_count)}/logs", {"params": {"limit": 100}}
+
+    return {"agent": agent, "logs": logs, "profile": profile, "user_logs": user_logs}
+
+
+async def run_endpoint(client, name: str, factory, requests: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, path, kwargs = factory(i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    return {
+        "endpoint": name,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+async def run_benchmark(args) -> List[Dict]:
+    import httpx
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        app = None
+    else:
+        import run_server
+        app = run_server.app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+    results = []
+    factories = request_factories(args.users)
+    if app is not None:
+        import intent_router
+        intent_router.PATH_STATS.clear()
+    async with client, (app.router.lifespan_context(app) if app is not None else contextlib.nullcontext()):
+        for name in args.endpoints:
+            # Warm up caches and lazy initialisation before measuring
+            await run_endpoint(client, name, factories[name], min(50, args.requests), args.concurrency)
+            if name == "agent" and app is not None:
+                intent_router.PATH_STATS.clear()   # measure routing paths without the warm-up
+            results.append(await run_endpoint(client, name, factories[name], args.requests, args.concurrency))
+            if name == "agent" and app is not None:
+                results[-1]["routing_paths"] = intent_router.path_stats()
+    return results
+
+
+def print_table(results: List[Dict]):
+    columns = ["endpoint", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms"]
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load/latency benchmark for the healthcare API")
+    parser.add_argument("--endpoints", nargs="+", default=["agent", "logs", "profile", "user_logs"],
+                        choices=["agent", "logs", "profile", "user_logs"])
+    parser.add_argument("--requests", type=int, default=1000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=100, help="user IDs to spread requests over")
+    parser.add_argument("--days", type=int, default=14, help="days of seeded log history per user (in-process only)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--routing-mode", choices=["coordinator", "specialist"],
+                        help="ROUTING_MODE for the in-process app (default: the environment's)")
+    parser.add_argument("--json", help="also write results to this JSON file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # The throwaway database directory is removed on exit, however the run ends
+    with contextlib.ExitStack() as stack:
+        if not args.url:
+            # Configure a throwaway database and the offline model before the app is imported
+            workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="healthcare-bench-"))
+            os.environ["DB_PATH"] = os.path.join(workdir, "users.db")
+            os.environ.setdefault("LLM_BACKEND", "stub")
+            os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "0")
+            os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "0")
+            if args.routing_mode:
+                os.environ["ROUTING_MODE"] = args.routing_mode
+
+            import datagen
+            start = time.perf_counter()
+            rows = datagen.generate(args.users, args.days, args.seed)
+            print(f"Seeded {rows} log rows in {time.perf_counter() - start:.1f}s ({os.environ['DB_PATH']})")
+
+        results = asyncio.run(run_benchmark(args))
+        print_table(results)
+        for row in results:
+            for path, stats in row.get("routing_paths", {}).items():
+                print(f"{row['endpoint']} via {path}: {stats['runs']} model runs, "
+                      f"avg {stats['avg_input_tokens']} input / {stats['avg_output_tokens']} output tokens, "
+                      f"avg {stats['avg_seconds'] * 1000:.1f} ms")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    sys.exit(1 if any(r["errors"] for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
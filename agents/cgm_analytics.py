@@ -0,0 +1,259 @@
+"""
+Vectorised CGM analytics.
+
+A user's CGM history is loaded from the logs table straight into NumPy arrays:
+epoch seconds from SQLite's strftime and readings from the typed glucose_mg_dl
+column, plus any older readings from the memory-mapped archive (retention.py).
+Every metric is then computed with array operations:
+- time below, in and above range (consensus thresholds by default)
+- mean, standard deviation, coefficient of variation and GMI
+- rate of change between consecutive readings
+- rolling time-window means
+
+The cohort summary streams the whole table, then the archive, in fixed-size
+chunks and accumulates per-user sums with bincount, so its memory use does not
+grow with history length.
+"""
+
+import datetime
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+import database
+
+# International consensus CGM targets (mg/dL)
+TARGET_LOW = 70
+TARGET_HIGH = 180
+VERY_LOW = 54
+VERY_HIGH = 250
+# The app's own alert range, as enforced by log_cgm_reading
+ALERT_LOW = 80
+ALERT_HIGH = 300
+# Readings further apart than this are treated as a sensor gap for rate of change
+MAX_GAP_MINUTES = 15
+ROLLING_WINDOWS_MINUTES = {"1h": 60, "24h": 1440, "7d": 10080}
+COHORT_CHUNK_ROWS = 1_000_000
+
+
+def _since(days: Optional[float]) -> Optional[str]:
+    if not days:
+        return None
+    start = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    return start.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def load_cgm_series(user_id: int, days: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (epoch_seconds int64[], glucose float64[]) for a user, oldest first."""
+    database.flush_logs()
+    sql = """
+        SELECT CAST(strftime('%s', timestamp) AS INTEGER), glucose_mg_dl
+        FROM logs
+        WHERE user_id = ? AND log_type = 'cgm' AND glucose_mg_dl IS NOT NULL
+    """
+    params: list = [user_id]
+    since = _since(days)
+    if since:
+        sql += " AND timestamp >= ?"
+        params.append(since)
+    sql += " ORDER BY timestamp"
+
+    # Readings older than the retention window live in the archive (retention.py). Both
+    # are read in one transaction, so rows compacted meanwhile are counted exactly once
+    import retention  # imported here: retention builds on this module
+    conn = database._open_connection()
+    try:
+        conn.execute("BEGIN")
+        rows = np.fromiter(conn.execute(sql, params), dtype=[("t", "i8"), ("g", "f8")])
+        archived_t, archived_g = retention.archived_series(user_id, "cgm", since, conn=conn)
+    finally:
+        conn.rollback()
+        conn.close()
+    if not len(archived_t):
+        return rows["t"], rows["g"]
+    t = np.concatenate((archived_t, rows["t"]))
+    order = np.argsort(t, kind="stable")
+    return t[order], np.concatenate((archived_g, rows["g"]))[order]
+
+
+def rolling_mean(t: np.ndarray, g: np.ndarray, window_minutes: float) -> np.ndarray:
+    """Mean of the readings in the trailing time window ending at each reading."""
+    cumulative = np.concatenate(([0.0], np.cumsum(g)))
+    right = np.arange(1, len(g) + 1)
+    left = np.searchsorted(t, t - window_minutes * 60, side="right")
+    return (cumulative[right] - cumulative[left]) / (right - left)
+
+
+def rate_of_change(t: np.ndarray, g: np.ndarray) -> np.ndarray:
+    """mg/dL per minute between consecutive readings, excluding sensor gaps."""
+    minutes = np.diff(t) / 60
+    valid = (minutes > 0) & (minutes <= MAX_GAP_MINUTES)
+    return np.diff(g)[valid] / minutes[valid]
+
+
+def _round(value: float, digits: int = 1) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def compute_cgm_metrics(t: np.ndarray, g: np.ndarray, low: float = TARGET_LOW, high: float = TARGET_HIGH,
+                        windows: Dict[str, float] = ROLLING_WINDOWS_MINUTES) -> Dict[str, Any]:
+    """Summary metrics for one CGM series (arrays as returned by load_cgm_series)."""
+    n = len(g)
+    if n == 0:
+        return {"readings": 0}
+
+    mean = g.mean()
+    std = g.std()
+    roc = rate_of_change(t, g)
+
+    metrics = {
+        "readings": n,
+        "first_reading": datetime.datetime.utcfromtimestamp(int(t[0])).isoformat(),
+        "last_reading": datetime.datetime.utcfromtimestamp(int(t[-1])).isoformat(),
+        "latest_mg_dl": _round(g[-1]),
+        "mean_mg_dl": _round(mean),
+        "std_mg_dl": _round(std),
+        "cv_percent": _round(100 * std / mean),
+        "gmi_percent": _round(3.31 + 0.02392 * mean, 2),
+        "min_mg_dl": _round(g.min()),
+        "max_mg_dl": _round(g.max()),
+        "time_in_range": {
+            "target_range": [low, high],
+            "very_low_percent": _round(100 * np.mean(g < VERY_LOW)),
+            "below_percent": _round(100 * np.mean(g < low)),
+            "in_range_percent": _round(100 * np.mean((g >= low) & (g <= high))),
+            "above_percent": _round(100 * np.mean(g > high)),
+            "very_high_percent": _round(100 * np.mean(g > VERY_HIGH)),
+        },
+        "alert_readings": int(np.count_nonzero((g < ALERT_LOW) | (g > ALERT_HIGH))),
+        "rate_of_change": {
+            "latest_mg_dl_per_min": _round(roc[-1], 2) if len(roc) else None,
+            "mean_abs_mg_dl_per_min": _round(np.abs(roc).mean(), 2) if len(roc) else None,
+            "max_rise_mg_dl_per_min": _round(roc.max(), 2) if len(roc) else None,
+            "max_fall_mg_dl_per_min": _round(roc.min(), 2) if len(roc) else None,
+        },
+        "rolling_mean_mg_dl": {},
+    }
+    for name, minutes in windows.items():
+        rolled = rolling_mean(t, g, minutes)
+        metrics["rolling_mean_mg_dl"][name] = {
+            "latest": _round(rolled[-1]), "min": _round(rolled.min()), "max": _round(rolled.max()),
+        }
+    return metrics
+
+
+def user_cgm_metrics(user_id: int, days: Optional[float] = 14) -> Dict[str, Any]:
+    """Loads a user's CGM history (last `days`, or all when None) and summarises it."""
+    t, g = load_cgm_series(user_id, days)
+    metrics = compute_cgm_metrics(t, g)
+    metrics.update(user_id=user_id, days=days)
+    return metrics
+
+
+def cohort_cgm_metrics(days: Optional[float] = 14, low: float = TARGET_LOW, high: float = TARGET_HIGH,
+                       user_ids: Optional[Sequence[int]] = None) -> Dict[str, Any]:
+    """
+    Per-user CGM summaries across the cohort, reduced to distribution statistics.
+    Rows are read COHORT_CHUNK_ROWS at a time, from logs and then from the archive
+    for windows reaching past the retention cutoff, and folded into per-user
+    count / sum / sum-of-squares / in-range accumulators indexed by user_id.
+    """
+    import retention  # imported here: retention builds on this module
+    database.flush_logs()
+    sql = "SELECT user_id, glucose_mg_dl FROM logs WHERE log_type = 'cgm' AND glucose_mg_dl IS NOT NULL"
+    params: list = []
+    since = _since(days)
+    if since:
+        sql += " AND timestamp >= ?"
+        params.append(since)
+    if user_ids:
+        sql += f" AND user_id IN ({','.join('?' * len(user_ids))})"
+        params.extend(user_ids)
+
+    size = 0
+    count = total = total_sq = in_range = below = above = np.zeros(0)
+
+    def grow(arr: np.ndarray, n: int) -> np.ndarray:
+        return np.concatenate((arr, np.zeros(n - len(arr)))) if len(arr) < n else arr
+
+    def add(u: np.ndarray, g: np.ndarray):
+        nonlocal size, count, total, total_sq, in_range, below, above
+        size = max(size, int(u.max()) + 1)
+        count, total, total_sq, in_range, below, above = (
+            grow(a, size) for a in (count, total, total_sq, in_range, below, above)
+        )
+        count += np.bincount(u, minlength=size)
+        total += np.bincount(u, weights=g, minlength=size)
+        total_sq += np.bincount(u, weights=g * g, minlength=size)
+        in_range += np.bincount(u, weights=(g >= low) & (g <= high), minlength=size)
+        below += np.bincount(u, weights=g < low, minlength=size)
+        above += np.bincount(u, weights=g > high, minlength=size)
+
+    # One read transaction for logs and the archive catalogue, so rows compacted
+    # meanwhile are counted exactly once
+    conn = database._open_connection()
+    try:
+        conn.execute("BEGIN")
+        cursor = conn.execute(sql, params)
+        while True:
+            chunk = np.fromiter(cursor.fetchmany(COHORT_CHUNK_ROWS), dtype=[("u", "i8"), ("g", "f8")])
+            if len(chunk) == 0:
+                break
+            add(chunk["u"], chunk["g"])
+        wanted = np.array(sorted(set(user_ids)), dtype=np.int64) if user_ids else None
+        for u, _, g in retention.iter_archived_readings("cgm", since, COHORT_CHUNK_ROWS, conn):
+            if wanted is not None:
+                keep = np.isin(u, wanted)
+                u, g = u[keep], g[keep]
+            if len(u):
+                add(u, g)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    users = count > 0
+    if not users.any():
+        return {"users": 0, "readings": 0, "days": days}
+
+    n = count[users]
+    mean = total[users] / n
+    std = np.sqrt(np.maximum(total_sq[users] / n - mean ** 2, 0))
+    tir = 100 * in_range[users] / n
+
+    def distribution(values: np.ndarray, digits: int = 1) -> Dict[str, Optional[float]]:
+        p10, p50, p90 = np.percentile(values, [10, 50, 90])
+        return {"mean": _round(values.mean(), digits), "p10": _round(p10, digits),
+                "median": _round(p50, digits), "p90": _round(p90, digits)}
+
+    return {
+        "days": days,
+        "users": int(users.sum()),
+        "readings": int(n.sum()),
+        "target_range": [low, high],
+        "mean_mg_dl": distribution(mean),
+        "cv_percent": distribution(100 * std / mean),
+        "gmi_percent": distribution(3.31 + 0.02392 * mean, 2),
+        "time_in_range_percent": distribution(tir),
+        "time_below_percent": distribution(100 * below[users] / n),
+        "time_above_percent": distribution(100 * above[users] / n),
+        "users_meeting_tir_target": int(np.count_nonzero(tir >= 70)),  # consensus goal: >70% in range
+    }
+
+
+def format_cgm_summary(metrics: Dict[str, Any]) -> str:
+    """Human-readable trend summary for the agent tool."""
+    if not metrics.get("readings"):
+        return f"No CGM readings found for user {metrics.get('user_id')} in the last {metrics.get('days')} days."
+    tir = metrics["time_in_range"]
+    roc = metrics["rate_of_change"]
+    rolling = metrics["rolling_mean_mg_dl"]
+    return (
+        f"CGM trends for user {metrics['user_id']} ({metrics['readings']} readings, last {metrics['days']} days):\n"
+        f"• Latest: {metrics['latest_mg_dl']} mg/dL, trend {roc['latest_mg_dl_per_min']} mg/dL/min\n"
+        f"• Average: {metrics['mean_mg_dl']} mg/dL (SD {metrics['std_mg_dl']}, CV {metrics['cv_percent']}%)\n"
+        f"• GMI (estimated A1C): {metrics['gmi_percent']}%\n"
+        f"• Time in range {tir['target_range'][0]}-{tir['target_range'][1]}: {tir['in_range_percent']}% "
+        f"(below {tir['below_percent']}%, above {tir['above_percent']}%)\n"
+        f"• Rolling averages: 1h {rolling['1h']['latest']}, 24h {rolling['24h']['latest']}, 7d {rolling['7d']['latest']} mg/dL\n"
+        f"• Readings outside the 80-300 alert range: {metrics['alert_readings']}"
+    )
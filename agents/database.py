@@ -1,17 +1,358 @@
 import sqlite3
-import random
-from faker import Faker
-from typing import List, Dict, Any
+import atexit
+import datetime
+import base64
+import binascii
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Any, Optional, Sequence, Tuple
 
-# Define the DB path (will be mounted by Docker)
+import instrumentation
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Define the DB path (will be mounted by Docker); DB_PATH overrides it
 import os
-DB_PATH = os.path.join(os.path.dirname(__file__), "users.db") 
+DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "users.db"))
+
+# --- Connection Management ---
+# Connections are opened once per thread and reused, so request handlers no longer
+# pay for connect() + pragma setup on every query. WAL lets readers run alongside
+# the writer, and synchronous=NORMAL only fsyncs the WAL at checkpoints.
+SQLITE_BUSY_TIMEOUT = 5.0  # seconds to wait on a locked database
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256 MB memory-mapped I/O
+    "PRAGMA cache_size=-65536",    # 64 MB page cache (negative = KiB)
+    "PRAGMA temp_store=MEMORY",
+)
+
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_generation = 0  # bumped by close_connections() so threads reopen lazily
+
+
+def _open_connection() -> sqlite3.Connection:
+    """Opens a new connection to DB_PATH with the standard pragmas applied."""
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+                           factory=instrumentation.connection_factory())  # times every query
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """Returns this thread's long-lived connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "generation", None) != _generation:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.generation = _generation
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+@contextmanager
+def init_lock(path: Optional[str] = None):
+    """
+    Exclusive lock on a file next to the database, held across processes (flock
+    on POSIX, msvcrt on Windows). Serialises one-time setup when several server
+    workers start at once.
+    """
+    path = path or f"{DB_PATH}.init.lock"
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # retries for ~10s, then raises
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def close_connections():
+    """Closes every pooled connection (called on server shutdown)."""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        while _connections:
+            _connections.pop().close()
+
+
+# --- Schema Migrations ---
+# The base tables below are schema version 0. Each migration is applied once, in
+# order, inside its own transaction, and records itself in PRAGMA user_version so
+# existing users.db files are upgraded in place on the next startup.
+
+def _migration_1_typed_log_columns(conn: sqlite3.Connection):
+    """Adds a composite lookup index and typed CGM/meal columns to logs."""
+    conn.execute("ALTER TABLE logs ADD COLUMN glucose_mg_dl REAL")
+    conn.execute("ALTER TABLE logs ADD COLUMN meal_timestamp TEXT")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_logs_user_type_ts
+        ON logs (user_id, log_type, timestamp)
+    """)
+
+    # Backfill: CGM readings were stored as str(glucose_reading)
+    conn.execute("""
+        UPDATE logs SET glucose_mg_dl = CAST(value AS REAL)
+        WHERE log_type = 'cgm' AND value <> '' AND value NOT GLOB '*[^0-9.]*'
+    """)
+    # Backfill: food entries were stored as "<timestamp>: <meal description>". Only split
+    # when the prefix is shaped like an ISO timestamp, so "Lunch: rice and dal" stays whole
+    conn.execute("""
+        UPDATE logs
+        SET meal_timestamp = substr(value, 1, instr(value, ': ') - 1),
+            value = substr(value, instr(value, ': ') + 2)
+        WHERE log_type = 'food' AND instr(value, ': ') > 0
+          AND substr(value, 1, instr(value, ': ') - 1) GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+          AND substr(value, 1, instr(value, ': ') - 1) NOT GLOB '*[^0-9T:. +Z-]*'
+    """)
+
+
+def _migration_2_user_timeline_index(conn: sqlite3.Connection):
+    """Adds a (user_id, timestamp) index for unfiltered, paginated log timelines."""
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_logs_user_ts
+        ON logs (user_id, timestamp)
+    """)
+
+
+def _migration_3_agent_sessions(conn: sqlite3.Connection):
+    """Adds the agent_sessions table for persisted conversation state."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS agent_sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            summary TEXT,
+            turns TEXT,        -- JSON list of [user message, reply] pairs
+            updated_at REAL    -- unix time of the last turn
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_sessions_updated ON agent_sessions (updated_at)")
+
+
+def _migration_4_mood_aggregates(conn: sqlite3.Connection):
+    """Adds mood scores to logs and the incrementally maintained mood aggregate tables."""
+    conn.execute("ALTER TABLE logs ADD COLUMN mood_score REAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mood_daily (
+            user_id INTEGER,
+            day TEXT,              -- UTC date, YYYY-MM-DD
+            entries INTEGER,
+            score_sum REAL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mood_aggregates (
+            user_id INTEGER PRIMARY KEY,
+            entries INTEGER,
+            score_sum REAL,
+            ema_7 REAL,            -- exponential moving averages over ~7 / ~30 entries
+            ema_30 REAL,
+            last_label TEXT,
+            last_score REAL,
+            last_timestamp TEXT
+        )
+    """)
+    # Backfill in one pass over the table
+    cases = " ".join(f"WHEN '{label}' THEN {score}" for label, score in MOOD_SCORES.items())
+    conn.execute(f"""
+        UPDATE logs SET mood_score = CASE lower(trim(value)) {cases} ELSE {DEFAULT_MOOD_SCORE} END
+        WHERE log_type = 'mood'
+    """)
+    rebuild_mood_aggregates(conn)
+
+
+def _migration_5_nutrition(conn: sqlite3.Connection):
+    """Adds the foods nutrient table and typed macro columns on food logs."""
+    import nutrition  # imported here: nutrition builds on this module
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS foods (
+            food_id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE,
+            aliases TEXT,          -- '|'-separated alternative names
+            serving_g REAL,        -- grams in one serving_unit
+            serving_unit TEXT,
+            carbs_g REAL,          -- nutrients per 100 g
+            protein_g REAL,
+            fat_g REAL,
+            kcal REAL
+        )
+    """)
+    nutrition.seed_foods(conn)
+    for column in LOG_MACRO_COLUMNS:
+        conn.execute(f"ALTER TABLE logs ADD COLUMN {column} REAL")
+
+    # Backfill: estimate every existing food log once per distinct description
+    index = nutrition.load_index(conn)
+    totals = {}
+    rows = conn.execute("SELECT log_id, value FROM logs WHERE log_type = 'food'").fetchall()
+    for _, value in rows:
+        if value not in totals:
+            totals[value] = nutrition.estimate(value or "", index).totals()
+    conn.executemany(
+        "UPDATE logs SET carbs_g = ?, protein_g = ?, fat_g = ?, kcal = ? WHERE log_id = ?",
+        ((*totals[value], log_id) for log_id, value in rows if totals[value] is not None),
+    )
+
+
+def _migration_6_retention(conn: sqlite3.Connection):
+    """Adds hourly/daily log rollup tables and the catalogue of archived log segments."""
+    for resolution in ("hourly", "daily"):
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS log_rollups_{resolution} (
+                user_id INTEGER,
+                log_type TEXT,         -- 'cgm' (glucose_mg_dl) or 'mood' (mood_score)
+                bucket TEXT,           -- UTC hour 'YYYY-MM-DD HH:00:00' or day 'YYYY-MM-DD'
+                readings INTEGER,
+                min_value REAL,
+                max_value REAL,
+                mean_value REAL,
+                below_range INTEGER,   -- CGM readings below / in / above the target range
+                in_range INTEGER,
+                above_range INTEGER,
+                PRIMARY KEY (user_id, log_type, bucket)
+            ) WITHOUT ROWID
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            segment_id TEXT PRIMARY KEY,   -- directory under the archive root
+            log_type TEXT,
+            rows INTEGER,
+            user_min INTEGER,
+            user_max INTEGER,
+            ts_min TEXT,
+            ts_max TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_segments_users ON archive_segments (user_min, user_max)")
+
 
+def _migration_7_cohorts(conn: sqlite3.Connection):
+    """Adds the user_conditions index table and the incrementally maintained cohort aggregates."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_conditions (
+            user_id INTEGER,
+            condition TEXT COLLATE NOCASE,   -- one medical condition, as written in users.medical_conditions
+            PRIMARY KEY (user_id, condition)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_conditions_condition ON user_conditions (condition, user_id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cohort_users (
+            city TEXT COLLATE NOCASE,
+            diet TEXT COLLATE NOCASE,
+            condition TEXT COLLATE NOCASE,   -- '' = every user of the city and diet
+            users INTEGER,
+            PRIMARY KEY (city, diet, condition)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cohort_daily (
+            day TEXT,                        -- UTC date, YYYY-MM-DD
+            city TEXT COLLATE NOCASE,
+            diet TEXT COLLATE NOCASE,
+            condition TEXT COLLATE NOCASE,   -- '' = every user of the city and diet
+            log_type TEXT,
+            readings INTEGER,                -- of the COHORT_VALUE_COLUMNS value
+            value_sum REAL,
+            value_sq_sum REAL,
+            min_value REAL,
+            max_value REAL,
+            below_range INTEGER,             -- CGM readings below / in / above the target range
+            in_range INTEGER,
+            above_range INTEGER,
+            PRIMARY KEY (day, city, diet, condition, log_type)
+        ) WITHOUT ROWID
+    """)
+    users = conn.execute("SELECT user_id, city, dietary_preference, medical_conditions FROM users").fetchall()
+    add_users_to_cohorts(conn, users)
+    rebuild_cohort_stats(conn)
+
+
+SCHEMA_MIGRATIONS = [
+    (1, _migration_1_typed_log_columns),
+    (2, _migration_2_user_timeline_index),
+    (3, _migration_3_agent_sessions),
+    (4, _migration_4_mood_aggregates),
+    (5, _migration_5_nutrition),
+    (6, _migration_6_retention),
+    (7, _migration_7_cohorts),
+]
+
+
+def migrate_schema(conn: sqlite3.Connection) -> int:
+    """Applies pending schema migrations and returns the resulting schema version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in SCHEMA_MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock in case another process migrated first
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if target <= version:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+        print(f"Applied schema migration {target}: {migration.__doc__}")
+    return version
+
+
+def _parse_glucose(value: str) -> Optional[float]:
+    """Returns the numeric glucose reading in a CGM log value, or None."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Mood labels on the same 1-10 scale the dashboard charts use
+MOOD_SCORES = {
+    "excited": 9, "happy": 8, "energetic": 8, "content": 7, "relaxed": 7, "calm": 6,
+    "okay": 5, "tired": 4, "fatigued": 4, "bored": 4, "anxious": 3, "stressed": 3,
+    "sad": 2, "angry": 2,
+}
+DEFAULT_MOOD_SCORE = 5
 
 
-def create_and_populate_db():
-    """Initializes the SQLite DB and populates 100 synthetic user records."""
-    conn = sqlite3.connect(DB_PATH)
+def mood_score(label: str) -> float:
+    """Maps a free-text mood label to its 1-10 score (unknown labels are neutral)."""
+    return MOOD_SCORES.get((label or "").strip().lower(), DEFAULT_MOOD_SCORE)
+
+
+def init_schema(conn: Optional[sqlite3.Connection] = None) -> sqlite3.Connection:
+    """Creates the base tables if needed and applies pending schema migrations."""
+    conn = conn or get_connection()
     cursor = conn.cursor()
 
     # 1. User Profile Table
@@ -39,69 +380,819 @@ def create_and_populate_db():
         )
     """)
     conn.commit()
+    migrate_schema(conn)
+    return conn
+
+
+def create_and_populate_db(users: int = 100, seed: Optional[int] = None):
+    """
+    Initializes the SQLite DB and populates synthetic user records when it is empty.
+    Runs under init_lock(), so concurrently starting workers do it exactly once.
+    Larger datasets with log history are built with datagen.py.
+    """
+    with init_lock():
+        conn = init_schema()
+
+        # Check if users already exist
+        user_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        if user_count == 0:
+            import datagen  # imported here: datagen builds on this module
+            created = datagen.insert_users(conn, users, seed=seed)
+            invalidate_user_profile()
+            print(f"Database created and populated with {created} users.")
+        else:
+            print(f"Database already exists with {user_count} users.")
+
+# --- User Profile Cache ---
+# Profiles are read on nearly every request (validation, meal plans, dashboard)
+# but rarely change, so they are kept in a bounded in-process LRU cache with a
+# TTL. Anything that writes to the users table must call invalidate_user_profile().
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))
+
+
+class ProfileCache:
+    """Thread-safe LRU cache of user profiles with per-entry expiry."""
+
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires_at, profile = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return dict(profile)
+                del self._entries[user_id]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, user_id: int, profile: Dict[str, Any]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, dict(profile))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: Optional[int] = None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_profile_cache = ProfileCache()
+
+
+def invalidate_user_profile(user_id: Optional[int] = None):
+    """Drops one cached profile, or every cached profile when user_id is None."""
+    _profile_cache.invalidate(user_id)
+
+
+def profile_cache_stats() -> Dict[str, Any]:
+    """Returns hit/miss/eviction counters for the profile cache."""
+    return _profile_cache.stats()
 
-    # Check if users already exist
-    cursor.execute("SELECT COUNT(*) FROM users")
-    user_count = cursor.fetchone()[0]
-    
-    if user_count == 0:
-        # --- Generate Synthetic Data ---
-        fake = Faker()
-        CITIES = ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix']
-        DIETS = ['vegetarian', 'non-vegetarian', 'vegan']
-        CONDITIONS = ['Type 2 Diabetes', 'Hypertension', 'Arthritis', 'Asthma', 'None']
-        
-        users_data = []
-        for i in range(1, 101):
-            conditions = random.sample(CONDITIONS, random.randint(1, 3))
-            # Ensure Type 2 Diabetes users get a CGM range
-            if 'Type 2 Diabetes' not in conditions:
-                if random.random() < 0.2: # 20% chance of diabetes 
-                    conditions.append('Type 2 Diabetes')
-
-            user = (
-                i,
-                fake.first_name(),
-                fake.last_name(),
-                random.choice(CITIES),
-                random.choice(DIETS),
-                ", ".join(list(set(conditions))), # Use list(set) to remove duplicates
-                random.choice(['None', 'Mobility Issues', 'Swallowing Difficulties'])
-            )
-            users_data.append(user)
-
-        cursor.executemany("""
-            INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, users_data)
-        conn.commit()
-        print(f"Database created and populated with {len(users_data)} users.")
-    else:
-        print(f"Database already exists with {user_count} users.")
-    
-    conn.close()
 
 def get_user_profile(user_id: int) -> Dict[str, Any] or None:
-    """Retrieves user profile data from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    """Retrieves user profile data, from the cache when possible."""
+    profile = _profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    conn = get_connection()
+    user = conn.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
     if user:
         # Map to dict for easier use
         keys = ["user_id", "first_name", "last_name", "city", "dietary_preference", "medical_conditions", "physical_limitations"]
-        return dict(zip(keys, user))
+        profile = dict(zip(keys, user))
+        _profile_cache.put(user_id, profile)
+        return profile
     return None
 
-def log_data(user_id: int, log_type: str, value: str):
-    """Logs mood, CGM, or food intake data."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO logs (user_id, log_type, value) VALUES (?, ?, ?)",
-        (user_id, log_type, value)
-    )
-    conn.commit()
-    conn.close()
+
+def iter_user_id_chunks(user_ids: Optional[List[int]] = None, chunk_size: int = 500) -> Iterator[List[int]]:
+    """Yields user IDs in chunks: the given IDs, or every user in the table when None."""
+    if user_ids is not None:
+        for start in range(0, len(user_ids), chunk_size):
+            yield list(user_ids[start:start + chunk_size])
+        return
+
+    conn = get_connection()
+    last_id = -1
+    while True:
+        rows = conn.execute(
+            "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (last_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            return
+        chunk = [row[0] for row in rows]
+        last_id = chunk[-1]
+        yield chunk
+
+
+def get_user_profiles(user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Fetches many profiles in one query (bypasses the cache to avoid churning it)."""
+    placeholders = ",".join("?" * len(user_ids))
+    rows = get_connection().execute(
+        f"SELECT * FROM users WHERE user_id IN ({placeholders})", user_ids
+    ).fetchall()
+    keys = ["user_id", "first_name", "last_name", "city", "dietary_preference", "medical_conditions", "physical_limitations"]
+    return {row[0]: dict(zip(keys, row)) for row in rows}
+
+
+def get_existing_user_ids(user_ids: List[int]) -> set:
+    """The subset of user_ids that exist in the users table."""
+    existing = set()
+    for chunk in iter_user_id_chunks(user_ids):
+        placeholders = ",".join("?" * len(chunk))
+        existing.update(row[0] for row in get_connection().execute(
+            f"SELECT user_id FROM users WHERE user_id IN ({placeholders})", chunk))
+    return existing
+
+
+def get_latest_readings(user_ids: List[int]) -> Dict[int, Tuple[Optional[float], Optional[str]]]:
+    """Returns {user_id: (latest glucose, latest mood label)} for the given users."""
+    flush_logs()
+    placeholders = ",".join("?" * len(user_ids))
+    # SQLite returns the bare columns from the row that holds MAX(timestamp)
+    rows = get_connection().execute(f"""
+        SELECT user_id, log_type, glucose_mg_dl, value, MAX(timestamp)
+        FROM logs
+        WHERE user_id IN ({placeholders}) AND log_type IN ('cgm', 'mood')
+        GROUP BY user_id, log_type
+    """, user_ids).fetchall()
+
+    latest: Dict[int, list] = {}
+    for user_id, log_type, glucose, value, _ in rows:
+        readings = latest.setdefault(user_id, [None, None])
+        if log_type == "cgm":
+            readings[0] = glucose
+        else:
+            readings[1] = value
+    return {user_id: tuple(readings) for user_id, readings in latest.items()}
+
+
+# --- Log Ingestion ---
+# Single-log writes go through a write-behind queue: log_data() enqueues the row
+# and a background thread commits everything queued every LOG_FLUSH_INTERVAL_MS,
+# or as soon as LOG_BATCH_SIZE rows are waiting, in one executemany transaction.
+# One fsync then covers a whole batch instead of one reading. Reads flush first,
+# so a client always sees its own writes. Set LOG_WRITE_BEHIND=0 to commit inline.
+LOG_WRITE_BEHIND = os.getenv("LOG_WRITE_BEHIND", "1") != "0"
+LOG_FLUSH_INTERVAL_MS = float(os.getenv("LOG_FLUSH_INTERVAL_MS", "50"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+
+_INSERT_LOG_SQL = """
+    INSERT INTO logs (user_id, log_type, value, glucose_mg_dl, meal_timestamp, mood_score,
+                      carbs_g, protein_g, fat_g, kcal, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+"""
+# Food logs: totals over the items found in the local nutrient database (nutrition.py);
+# NULL when no item of the description was found
+LOG_MACRO_COLUMNS = ("carbs_g", "protein_g", "fat_g", "kcal")
+_NO_MACROS = (None, None, None, None)
+
+
+def food_macros(description: str) -> tuple:
+    """(carbs_g, protein_g, fat_g, kcal) for a meal description, or all None if nothing matched."""
+    import nutrition  # imported here: nutrition builds on this module
+    return nutrition.estimate_macros(description or "").totals() or _NO_MACROS
+
+
+def _log_row(user_id: int, log_type: str, value: str, meal_timestamp: Optional[str] = None,
+             timestamp: Optional[str] = None) -> tuple:
+    """Builds the parameter tuple for _INSERT_LOG_SQL, deriving the typed columns."""
+    glucose = _parse_glucose(value) if log_type == "cgm" else None
+    score = mood_score(value) if log_type == "mood" else None
+    macros = food_macros(value) if log_type == "food" else _NO_MACROS
+    if timestamp:
+        timestamp = _normalize_timestamp(timestamp)
+    return (user_id, log_type, value, glucose, meal_timestamp, score, *macros, timestamp)
+
+
+def _insert_log_rows(rows: List[tuple]):
+    """Inserts log rows in a single transaction, updating the mood and cohort aggregates with them."""
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")   # so the rows inserted below are exactly those after last_log_id
+        last_log_id = conn.execute("SELECT COALESCE(MAX(log_id), 0) FROM logs").fetchone()[0]
+        conn.executemany(_INSERT_LOG_SQL, rows)
+        mood_rows = [(row[0], row[5], row[2], row[-1]) for row in rows if row[1] == "mood"]
+        if mood_rows:
+            update_mood_aggregates(conn, mood_rows)
+        update_cohort_stats(conn, last_log_id)
+
+
+class LogWriter:
+    """Background group-commit writer for the logs table."""
+
+    def __init__(self, flush_interval_ms: float = LOG_FLUSH_INTERVAL_MS, batch_size: int = LOG_BATCH_SIZE):
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self._pending: List[tuple] = []
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()  # held while a batch is being committed
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def submit(self, row: tuple):
+        """Queues one row for the next group commit."""
+        with self._cond:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Commits everything queued so far; returns once it is durable in the DB."""
+        with self._write_lock:
+            with self._cond:
+                rows, self._pending = self._pending, []
+            self._write(rows)
+
+    def stop(self):
+        """Stops the background thread after a final flush."""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            self.flush()
+
+    def _write(self, rows: List[tuple]):
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            try:
+                _insert_log_rows(batch)
+            except sqlite3.Error as e:
+                # Retry row by row so one bad row does not drop the whole batch
+                print(f"Log batch of {len(batch)} failed ({e}); retrying individually.")
+                for row in batch:
+                    try:
+                        _insert_log_rows([row])
+                    except sqlite3.Error as row_error:
+                        print(f"Dropping log row {row}: {row_error}")
+
+
+_log_writer = LogWriter()
+
+
+def _reset_after_fork():
+    """
+    Drops state a forked worker inherits from its parent. SQLite connections must
+    not be used across fork(), and the parent's writer thread and queued logs
+    belong to the parent, so the child starts with none of them.
+    """
+    global _local, _connections_lock, _log_writer
+    _local = threading.local()
+    _connections_lock = threading.Lock()
+    _connections.clear()  # forgotten, not closed: closing would release the parent's locks
+    _log_writer = LogWriter()
+
+
+if hasattr(os, "register_at_fork"):  # POSIX; spawned workers (uvicorn, Windows) start clean anyway
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def flush_logs():
+    """Commits any logs still waiting in the write-behind queue."""
+    _log_writer.flush()
+
+
+def stop_log_writer():
+    """Flushes pending logs and stops the background writer (server shutdown)."""
+    _log_writer.stop()
+
+
+atexit.register(stop_log_writer)
+
+
+def log_data(user_id: int, log_type: str, value: str, meal_timestamp: Optional[str] = None):
+    """Logs mood, CGM, or food intake data, filling the typed columns where they apply."""
+    # Stamp the row now so queued logs keep their arrival time, not their flush time
+    row = _log_row(user_id, log_type, value, meal_timestamp,
+                   datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+    if LOG_WRITE_BEHIND:
+        _log_writer.submit(row)
+    else:
+        _insert_log_rows([row])
+
+
+def log_data_batch(entries: List[Dict[str, Any]]) -> int:
+    """
+    Inserts many logs in one transaction and returns how many were written.
+    Each entry has user_id, log_type and value, plus an optional reading
+    timestamp and meal_timestamp.
+    """
+    rows = [
+        _log_row(e["user_id"], e["log_type"], e["value"], e.get("meal_timestamp"), e.get("timestamp"))
+        for e in entries
+    ]
+    _insert_log_rows(rows)
+    return len(rows)
+
+
+# --- Mood Aggregates ---
+# Every mood insert updates two small tables in the same transaction as the log
+# row, at constant cost: mood_daily keeps per-user, per-day entry counts and score
+# sums, and mood_aggregates keeps per-user totals, EMAs and the latest mood.
+# Rolling 7/30-day averages then read at most 30 day rows per user, instead of
+# rescanning and re-parsing the user's whole mood history.
+MOOD_EMA_SPANS = {"ema_7": 7, "ema_30": 30}
+MOOD_TREND_THRESHOLD = 0.5  # ema_7 - ema_30 gap (score points) reported as a trend
+
+_UPSERT_MOOD_DAILY_SQL = """
+    INSERT INTO mood_daily (user_id, day, entries, score_sum)
+    VALUES (?, date(COALESCE(?, CURRENT_TIMESTAMP)), 1, ?)
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        entries = entries + 1,
+        score_sum = score_sum + excluded.score_sum
+"""
+_UPSERT_MOOD_AGGREGATE_SQL = f"""
+    INSERT INTO mood_aggregates (user_id, entries, score_sum, ema_7, ema_30, last_label, last_score, last_timestamp)
+    VALUES (:user_id, 1, :score, :score, :score, :label, :score, COALESCE(:timestamp, CURRENT_TIMESTAMP))
+    ON CONFLICT (user_id) DO UPDATE SET
+        entries = entries + 1,
+        score_sum = score_sum + excluded.score_sum,
+        ema_7 = ema_7 + {2 / (MOOD_EMA_SPANS["ema_7"] + 1)} * (excluded.last_score - ema_7),
+        ema_30 = ema_30 + {2 / (MOOD_EMA_SPANS["ema_30"] + 1)} * (excluded.last_score - ema_30),
+        last_label = CASE WHEN excluded.last_timestamp >= last_timestamp THEN excluded.last_label ELSE last_label END,
+        last_score = CASE WHEN excluded.last_timestamp >= last_timestamp THEN excluded.last_score ELSE last_score END,
+        last_timestamp = max(last_timestamp, excluded.last_timestamp)
+"""
+
+
+def update_mood_aggregates(conn: sqlite3.Connection, entries: List[tuple]):
+    """
+    Folds (user_id, score, label, timestamp) mood entries into the aggregate tables.
+    The EMAs are folded in timestamp order: a user whose entries include one older
+    than the latest already folded (a backfill) has them refolded from the history.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    latest: Dict[int, Optional[str]] = {}
+    out_of_order = set()
+    for uid, _, _, ts in entries:
+        if uid not in latest:
+            row = conn.execute("SELECT last_timestamp FROM mood_aggregates WHERE user_id = ?", (uid,)).fetchone()
+            latest[uid] = row[0] if row else None
+        ts = ts or now  # stored as CURRENT_TIMESTAMP
+        if latest[uid] is not None and ts < latest[uid]:
+            out_of_order.add(uid)
+        else:
+            latest[uid] = ts
+    conn.executemany(_UPSERT_MOOD_DAILY_SQL, [(uid, ts, score) for uid, score, _, ts in entries])
+    conn.executemany(_UPSERT_MOOD_AGGREGATE_SQL, [
+        {"user_id": uid, "score": score, "label": label, "timestamp": ts} for uid, score, label, ts in entries
+    ])
+    for uid in out_of_order:
+        _refold_mood_emas(conn, uid)
+
+
+def _refold_mood_emas(conn: sqlite3.Connection, user_id: int):
+    """Recomputes a user's mood EMAs over their whole history (logs and archive) in timestamp order."""
+    import retention  # imported here: retention builds on this module
+    archived_t, archived_scores = retention.archived_series(user_id, "mood", conn=conn)
+    history = sorted([*zip(archived_t.tolist(), archived_scores.tolist()), *conn.execute("""
+        SELECT CAST(strftime('%s', timestamp) AS INTEGER), mood_score FROM logs
+        WHERE user_id = ? AND log_type = 'mood' AND mood_score IS NOT NULL
+        ORDER BY timestamp, log_id
+    """, (user_id,))], key=lambda entry: entry[0])
+    if not history:
+        return
+    emas = dict.fromkeys(MOOD_EMA_SPANS, history[0][1])
+    for _, score in history[1:]:
+        for name, span in MOOD_EMA_SPANS.items():
+            emas[name] += 2 / (span + 1) * (score - emas[name])
+    conn.execute("UPDATE mood_aggregates SET ema_7 = :ema_7, ema_30 = :ema_30 WHERE user_id = :user_id",
+                 {**emas, "user_id": user_id})
+
+
+def rebuild_mood_aggregates(conn: Optional[sqlite3.Connection] = None):
+    """
+    Recomputes the mood aggregate tables from the mood logs (migration backfill / repair).
+    Mood rows already compacted into the archive by retention.py are not in logs, so
+    their days drop out of the rebuilt tables.
+    """
+    conn = conn or get_connection()
+    conn.execute("DELETE FROM mood_daily")
+    conn.execute("DELETE FROM mood_aggregates")
+    rows = conn.execute("""
+        SELECT user_id, mood_score, value, timestamp FROM logs
+        WHERE log_type = 'mood' AND mood_score IS NOT NULL
+        ORDER BY timestamp, log_id
+    """)
+    while True:
+        entries = rows.fetchmany(LOG_BATCH_SIZE)
+        if not entries:
+            break
+        update_mood_aggregates(conn, entries)
+
+
+def get_mood_summary(user_id: int) -> Dict[str, Any]:
+    """Returns a user's precomputed mood averages, EMAs, trend and latest mood."""
+    flush_logs()
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT entries, score_sum, ema_7, ema_30, last_label, last_score, last_timestamp "
+        "FROM mood_aggregates WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if not row:
+        return {"user_id": user_id, "entries": 0}
+    entries, score_sum, ema_7, ema_30, last_label, last_score, last_timestamp = row
+
+    windows = {}
+    for days in (7, 30):
+        count, total = conn.execute(
+            "SELECT COALESCE(SUM(entries), 0), SUM(score_sum) FROM mood_daily "
+            "WHERE user_id = ? AND day >= date('now', ?)", (user_id, f"-{days - 1} days")
+        ).fetchone()
+        windows[f"rolling_{days}d"] = {"entries": count, "average": round(total / count, 2) if count else None}
+
+    gap = ema_7 - ema_30
+    trend = "improving" if gap > MOOD_TREND_THRESHOLD else "declining" if gap < -MOOD_TREND_THRESHOLD else "steady"
+    return {
+        "user_id": user_id,
+        "entries": entries,
+        "average": round(score_sum / entries, 2),
+        **windows,
+        "ema_7": round(ema_7, 2),
+        "ema_30": round(ema_30, 2),
+        "trend": trend,
+        "latest": {"mood": last_label, "score": last_score, "timestamp": last_timestamp},
+    }
+
+
+# --- Cohort Aggregates ---
+# users.medical_conditions stays the display string; user_conditions indexes it
+# with one row per user and condition. cohort_users counts users and
+# cohort_daily keeps per-day reading counts, sums, sums of squares, min/max and
+# CGM time in range for every (city, diet, condition) cohort, with condition ''
+# standing for all of a city and diet's users. Both are updated in the same
+# transaction as the users or logs they count, so a population query sums a few
+# hundred aggregate rows however many users and logs there are. Logs count
+# toward the cohort their user belonged to when they arrived.
+COHORT_VALUE_COLUMNS = {"cgm": "glucose_mg_dl", "mood": "mood_score", "food": "carbs_g"}
+COHORT_TARGET_RANGE = (70, 180)    # consensus CGM target range, as in cgm_analytics
+ANY_CONDITION = ""
+COHORT_GROUPS = {"city": "city", "diet": "diet", "condition": "condition"}
+_NO_CONDITION = {"", "none"}
+
+_COHORT_MERGE_SQL = """
+    ON CONFLICT (day, city, diet, condition, log_type) DO UPDATE SET
+        readings = readings + excluded.readings,
+        value_sum = value_sum + excluded.value_sum,
+        value_sq_sum = value_sq_sum + excluded.value_sq_sum,
+        min_value = min(min_value, excluded.min_value),
+        max_value = max(max_value, excluded.max_value),
+        below_range = below_range + excluded.below_range,
+        in_range = in_range + excluded.in_range,
+        above_range = above_range + excluded.above_range
+"""
+_INSERT_COHORT_DAILY_SQL = """
+    INSERT INTO cohort_daily (day, city, diet, condition, log_type, readings, value_sum, value_sq_sum,
+                              min_value, max_value, below_range, in_range, above_range)
+"""
+_COHORT_VALUE_SQL = "CASE log_type " + " ".join(
+    f"WHEN '{log_type}' THEN {column}" for log_type, column in COHORT_VALUE_COLUMNS.items()) + " END"
+_UPSERT_COHORT_DAILY_SQL = _INSERT_COHORT_DAILY_SQL + f"""
+    SELECT date(l.timestamp), COALESCE(u.city, ''), COALESCE(u.dietary_preference, ''), {{condition}}, l.log_type,
+           COUNT(*), SUM(l.v), SUM(l.v * l.v), MIN(l.v), MAX(l.v),
+           SUM(CASE WHEN l.log_type = 'cgm' THEN l.v < {COHORT_TARGET_RANGE[0]} END),
+           SUM(CASE WHEN l.log_type = 'cgm' THEN l.v BETWEEN {COHORT_TARGET_RANGE[0]} AND {COHORT_TARGET_RANGE[1]} END),
+           SUM(CASE WHEN l.log_type = 'cgm' THEN l.v > {COHORT_TARGET_RANGE[1]} END)
+    FROM (SELECT user_id, timestamp, log_type, {_COHORT_VALUE_SQL} AS v FROM logs WHERE log_id > ?) AS l
+    JOIN users AS u ON u.user_id = l.user_id
+    {{join}}
+    WHERE l.v IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+""" + _COHORT_MERGE_SQL
+_UPSERT_COHORT_SQLS = (
+    _UPSERT_COHORT_DAILY_SQL.format(condition="''", join=""),
+    _UPSERT_COHORT_DAILY_SQL.format(condition="c.condition",
+                                    join="JOIN user_conditions AS c ON c.user_id = l.user_id"),
+)
+# For a full rebuild, logs are first reduced to per-user days, which leaves far
+# fewer rows to join to users and conditions and to group by cohort
+_USER_DAY_STATS_SQL = f"""
+    SELECT user_id, date(timestamp) AS day, log_type,
+           COUNT(*) AS n, SUM(v) AS s, SUM(v * v) AS sq, MIN(v) AS lo, MAX(v) AS hi,
+           SUM(CASE WHEN log_type = 'cgm' THEN v < {COHORT_TARGET_RANGE[0]} END) AS below,
+           SUM(CASE WHEN log_type = 'cgm' THEN v BETWEEN {COHORT_TARGET_RANGE[0]} AND {COHORT_TARGET_RANGE[1]} END) AS within,
+           SUM(CASE WHEN log_type = 'cgm' THEN v > {COHORT_TARGET_RANGE[1]} END) AS above
+    FROM (SELECT user_id, timestamp, log_type, {_COHORT_VALUE_SQL} AS v FROM logs)
+    WHERE v IS NOT NULL
+    GROUP BY user_id, day, log_type
+"""
+_REBUILD_COHORT_DAILY_SQL = _INSERT_COHORT_DAILY_SQL + """
+    SELECT d.day, COALESCE(u.city, ''), COALESCE(u.dietary_preference, ''), {condition}, d.log_type,
+           SUM(d.n), SUM(d.s), SUM(d.sq), MIN(d.lo), MAX(d.hi), SUM(d.below), SUM(d.within), SUM(d.above)
+    FROM user_day_stats AS d
+    JOIN users AS u ON u.user_id = d.user_id
+    {join}
+    GROUP BY 1, 2, 3, 4, 5
+"""
+_UPSERT_COHORT_ROW_SQL = _INSERT_COHORT_DAILY_SQL + " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)" + _COHORT_MERGE_SQL
+
+
+def parse_conditions(medical_conditions: Optional[str]) -> List[str]:
+    """The distinct conditions in a comma-separated medical_conditions string ('None' means none)."""
+    conditions: Dict[str, str] = {}
+    for part in (medical_conditions or "").split(","):
+        name = " ".join(part.split())
+        if name.lower() not in _NO_CONDITION:
+            conditions.setdefault(name.lower(), name)
+    return list(conditions.values())
+
+
+def cohort_keys(city: Optional[str], diet: Optional[str], medical_conditions: Optional[str]) -> List[Tuple[str, str, str]]:
+    """The (city, diet, condition) cohorts a user counts toward, starting with the all-conditions one."""
+    return [(city or "", diet or "", condition)
+            for condition in (ANY_CONDITION, *parse_conditions(medical_conditions))]
+
+
+def add_users_to_cohorts(conn: sqlite3.Connection, users: Sequence[tuple]):
+    """Indexes newly inserted (user_id, city, diet, medical_conditions) users' conditions and counts them in."""
+    counts: Dict[Tuple[str, str, str], int] = {}
+    condition_rows = []
+    for user_id, city, diet, medical_conditions in users:
+        for key in cohort_keys(city, diet, medical_conditions):
+            counts[key] = counts.get(key, 0) + 1
+            if key[2] != ANY_CONDITION:
+                condition_rows.append((user_id, key[2]))
+    conn.executemany("INSERT OR IGNORE INTO user_conditions (user_id, condition) VALUES (?, ?)", condition_rows)
+    conn.executemany("""
+        INSERT INTO cohort_users (city, diet, condition, users) VALUES (?, ?, ?, ?)
+        ON CONFLICT (city, diet, condition) DO UPDATE SET users = users + excluded.users
+    """, [(*key, count) for key, count in counts.items()])
+
+
+def update_cohort_stats(conn: sqlite3.Connection, after_log_id: int):
+    """Folds the logs with log_id > after_log_id (those just inserted) into cohort_daily."""
+    for sql in _UPSERT_COHORT_SQLS:
+        conn.execute(sql, (after_log_id,))
+
+
+def rebuild_cohort_stats(conn: Optional[sqlite3.Connection] = None):
+    """
+    Recomputes cohort_daily from the logs (migration backfill / repair), counting
+    each log toward its user's current cohorts. Rows already compacted into the
+    archive by retention.py are not in logs, so their days drop out.
+    """
+    conn = conn or get_connection()
+    conn.execute("DELETE FROM cohort_daily")
+    conn.execute(f"CREATE TEMP TABLE user_day_stats AS {_USER_DAY_STATS_SQL}")
+    try:
+        conn.execute(_REBUILD_COHORT_DAILY_SQL.format(condition="''", join=""))
+        conn.execute(_REBUILD_COHORT_DAILY_SQL.format(
+            condition="c.condition", join="JOIN user_conditions AS c ON c.user_id = d.user_id"))
+    finally:
+        conn.execute("DROP TABLE temp.user_day_stats")
+
+
+def upsert_cohort_daily(conn: sqlite3.Connection, rows: List[tuple]):
+    """
+    Merges precomputed (day, city, diet, condition, log_type, readings, value_sum,
+    value_sq_sum, min, max, below, in_range, above) rows into cohort_daily (bulk loads).
+    """
+    conn.executemany(_UPSERT_COHORT_ROW_SQL, rows)
+
+
+def get_cohort_stats(city: Optional[str] = None, diet: Optional[str] = None, condition: Optional[str] = None,
+                     log_type: str = "cgm", days: Optional[int] = 30,
+                     group_by: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Population stats of a log type's value (see COHORT_VALUE_COLUMNS) over the last
+    `days` days (all time when None) for the users matching the filters, overall
+    or per city, diet or condition.
+    """
+    if log_type not in COHORT_VALUE_COLUMNS:
+        raise ValueError(f"Unknown log type: {log_type!r}")
+    if group_by is not None and group_by not in COHORT_GROUPS:
+        raise ValueError(f"Unknown cohort grouping: {group_by!r}")
+    flush_logs()
+    clauses, params = [], []
+    for column, value in (("city", city), ("diet", diet)):
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value.strip())
+    if group_by == "condition" and not condition:
+        clauses.append("condition <> ''")
+    else:
+        clauses.append("condition = ?")
+        params.append(condition.strip() if condition else ANY_CONDITION)
+    group = COHORT_GROUPS.get(group_by, "NULL")
+    where = " AND ".join(clauses)
+
+    conn = get_connection()
+    users = dict(conn.execute(
+        f"SELECT {group}, SUM(users) FROM cohort_users WHERE {where} GROUP BY 1", params).fetchall())
+    day_clause, day_params = "", []
+    if days:
+        day_clause, day_params = " AND day >= date('now', ?)", [f"-{days - 1} days"]
+    rows = conn.execute(f"""
+        SELECT {group}, SUM(readings), SUM(value_sum), SUM(value_sq_sum), MIN(min_value), MAX(max_value),
+               SUM(below_range), SUM(in_range), SUM(above_range)
+        FROM cohort_daily
+        WHERE log_type = ? AND {where}{day_clause}
+        GROUP BY 1
+    """, [log_type, *params, *day_params]).fetchall()
+
+    stats = {}
+    for key, readings, total, squares, low, high, below, in_range, above in rows:
+        mean = total / readings
+        entry = {
+            "users": users.get(key, 0),
+            "readings": readings,
+            "mean": round(mean, 2),
+            "std": round(max(squares / readings - mean * mean, 0.0) ** 0.5, 2),
+            "min": low,
+            "max": high,
+        }
+        if log_type == "cgm":
+            entry["time_in_range"] = {
+                "target_range": list(COHORT_TARGET_RANGE),
+                "below_percent": round(100 * below / readings, 1),
+                "in_range_percent": round(100 * in_range / readings, 1),
+                "above_percent": round(100 * above / readings, 1),
+            }
+        stats[key] = entry
+    for key, count in users.items():
+        stats.setdefault(key, {"users": count, "readings": 0})
+
+    result: Dict[str, Any] = {
+        "filters": {"city": city, "diet": diet, "condition": condition},
+        "log_type": log_type,
+        "value": COHORT_VALUE_COLUMNS[log_type],
+        "days": days,
+    }
+    if group_by is None:
+        result["stats"] = stats.get(None, {"users": 0, "readings": 0})
+    else:
+        result["group_by"] = group_by
+        result["groups"] = [{group_by: key, **stats[key]} for key in sorted(stats)]
+    return result
+
+
+# --- Log Retrieval ---
+# Logs are paged newest-first with keyset pagination on (timestamp, log_id): the
+# cursor is the position of the last row returned, so each page is an index range
+# scan no matter how deep into a user's history the client has scrolled.
+DEFAULT_LOG_PAGE_SIZE = 500
+LOG_COLUMNS = ["log_id", "user_id", "timestamp", "log_type", "value", "glucose_mg_dl", "meal_timestamp", "mood_score",
+               *LOG_MACRO_COLUMNS]
+
+
+def _normalize_timestamp(value: str) -> str:
+    """Converts ISO-8601 input ('2024-01-01T10:00:00+05:30') to SQLite's stored UTC format."""
+    try:
+        parsed = datetime.datetime.fromisoformat(value.strip())
+    except ValueError:
+        return value.strip().replace("T", " ", 1).rstrip("Z")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def encode_log_cursor(log: Dict[str, Any]) -> str:
+    """Builds the opaque 'before' cursor pointing just past the given log row."""
+    raw = f"{log['timestamp']}|{log['log_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_log_cursor(cursor: str) -> Tuple[str, int]:
+    """Decodes a cursor from encode_log_cursor(). Raises ValueError if malformed."""
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return timestamp, int(log_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError(f"Invalid log cursor: {cursor!r}")
+
+
+def build_user_logs_query(user_id: int, limit: Optional[int] = None, before: Optional[str] = None,
+                          log_type: Optional[str] = None, start: Optional[str] = None,
+                          end: Optional[str] = None) -> Tuple[str, list]:
+    """Returns (sql, params) selecting a user's logs newest-first with optional filters."""
+    clauses = ["user_id = ?"]
+    params: list = [user_id]
+    if log_type:
+        clauses.append("log_type = ?")
+        params.append(log_type)
+    if start:
+        clauses.append("timestamp >= ?")
+        params.append(_normalize_timestamp(start))
+    if end:
+        clauses.append("timestamp < ?")
+        params.append(_normalize_timestamp(end))
+    if before:
+        cursor_ts, cursor_id = decode_log_cursor(before)
+        # Written as a range plus tie-break so SQLite can use the index for the range
+        clauses.append("timestamp <= ? AND (timestamp < ? OR log_id < ?)")
+        params.extend([cursor_ts, cursor_ts, cursor_id])
+
+    sql = f"""
+        SELECT {", ".join(LOG_COLUMNS)}
+        FROM logs
+        WHERE {" AND ".join(clauses)}
+        ORDER BY timestamp DESC, log_id DESC
+    """
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def get_user_logs(user_id: int, limit: int = DEFAULT_LOG_PAGE_SIZE, before: Optional[str] = None,
+                  log_type: Optional[str] = None, start: Optional[str] = None,
+                  end: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Returns one page of a user's logs (newest first) and the cursor for the next
+    page, or None when this is the last page.
+    """
+    flush_logs()
+    sql, params = build_user_logs_query(user_id, limit, before, log_type, start, end)
+    rows = get_connection().execute(sql, params).fetchall()
+    logs = [dict(zip(LOG_COLUMNS, row)) for row in rows]
+    next_cursor = encode_log_cursor(logs[-1]) if len(logs) == limit else None
+    return logs, next_cursor
+
+
+# --- Agent Sessions ---
+
+def load_session(session_id: str, max_age_seconds: float) -> Optional[Dict[str, Any]]:
+    """Returns a persisted session, or None if it is missing or idle longer than max_age_seconds."""
+    row = get_connection().execute(
+        "SELECT session_id, user_id, summary, turns, updated_at FROM agent_sessions WHERE session_id = ? AND updated_at >= ?",
+        (session_id, time.time() - max_age_seconds)
+    ).fetchone()
+    if row:
+        return dict(zip(["session_id", "user_id", "summary", "turns", "updated_at"], row))
+    return None
+
+
+def save_session(session_id: str, user_id: Optional[int], summary: str, turns: str) -> float:
+    """Inserts or replaces a persisted session and returns its new updated_at."""
+    updated_at = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO agent_sessions (session_id, user_id, summary, turns, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, user_id, summary, turns, updated_at)
+        )
+    return updated_at
+
+
+def session_updated_at(session_id: str) -> Optional[float]:
+    """Returns when a persisted session was last saved (by any process), or None."""
+    row = get_connection().execute(
+        "SELECT updated_at FROM agent_sessions WHERE session_id = ?", (session_id,)
+    ).fetchone()
+    return row[0] if row else None
 
 
+def delete_expired_sessions(max_age_seconds: float) -> int:
+    """Deletes persisted sessions idle longer than max_age_seconds; returns how many."""
+    conn = get_connection()
+    with conn:
+        return conn.execute(
+            "DELETE FROM agent_sessions WHERE updated_at < ?", (time.time() - max_age_seconds,)
+        ).rowcount
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator for development and scale testing.
+
+    python datagen.py --users 100                              # the demo cohort, no history
+    python datagen.py --users 4000 --days 90 --workers 8       # ~100M log rows
+    python datagen.py --db /tmp/scale.db --users 1000000       # a million profiles
+
+Users get Faker names and the same profile mix as the original demo data. Each
+user's log stream covers the `days` days before --end (exclusive; default: today, midnight UTC):
+- a CGM reading every 5 minutes, built from a per-user baseline, a daily rhythm,
+  meal responses and correlated noise, with occasional sensor gaps,
+- three meals a day from the user's diet (plus snacks); their carbs drive the
+  glucose response,
+- one to three mood entries a day, tracking how the user's glucose is doing.
+
+Output depends only on --seed, not on --workers or chunk sizes: users are
+generated in fixed seeded blocks, and each log stream is seeded from
+(seed, user_id). Rows are written with chunked executemany under bulk-load
+pragmas (no journal, no fsync). On an empty logs table the log indexes are
+dropped for the load and rebuilt once at the end. With --workers > 1, user
+ranges are generated in parallel into temporary shard databases, which are
+merged in user order with INSERT ... SELECT.
+"""
+
+import argparse
+import datetime
+import itertools
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import database
+import nutrition
+from meal_plans import DIET_MEALS, SNACKS, diet_bucket
+
+CITIES = ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix']
+DIETS = ['vegetarian', 'non-vegetarian', 'vegan']
+CONDITIONS = ['Type 2 Diabetes', 'Hypertension', 'Arthritis', 'Asthma', 'None']
+LIMITATIONS = ['None', 'Mobility Issues', 'Swallowing Difficulties']
+
+NAME_POOL_SIZE = 1000          # Faker names drawn once, then sampled per user
+USER_BLOCK = 10_000            # users generated per seeded block
+DEFAULT_CHUNK_ROWS = 250_000   # rows per executemany / transaction
+CGM_INTERVAL_MINUTES = 5
+MEAL_HOURS = ((7.0, 9.0), (12.0, 14.0), (18.5, 20.5))  # breakfast, lunch, dinner windows (UTC)
+SNACK_CARBS = 15
+
+BULK_PRAGMAS = (
+    "PRAGMA journal_mode=OFF",       # an interrupted load leaves a partial file; just regenerate
+    "PRAGMA synchronous=OFF",
+    "PRAGMA locking_mode=EXCLUSIVE",
+    "PRAGMA cache_size=-262144",     # 256 MB page cache
+    "PRAGMA temp_store=MEMORY",
+)
+
+_INSERT_USER_SQL = "INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)"
+# Timestamps are passed as epoch seconds and CGM values as integers, and SQLite
+# formats them, which keeps per-row Python work to building a tuple.
+_INSERT_CGM_SQL = """
+    INSERT INTO logs (user_id, timestamp, log_type, value, glucose_mg_dl)
+    VALUES (?1, datetime(?2, 'unixepoch'), 'cgm', CAST(?3 AS TEXT), ?3)
+"""
+_INSERT_EVENT_SQL = """
+    INSERT INTO logs (user_id, timestamp, log_type, value, meal_timestamp, mood_score, carbs_g, protein_g, fat_g, kcal)
+    VALUES (?, datetime(?, 'unixepoch'), ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_LOG_COLUMNS = ("user_id, timestamp, log_type, value, glucose_mg_dl, meal_timestamp, mood_score, "
+                "carbs_g, protein_g, fat_g, kcal")
+
+
+# --- Users ---
+
+def _name_pool(seed: Optional[int]) -> Tuple[List[str], List[str]]:
+    from faker import Faker  # only needed when users are created
+
+    fake = Faker()
+    fake.seed_instance(seed)
+    return ([fake.first_name() for _ in range(NAME_POOL_SIZE)],
+            [fake.last_name() for _ in range(NAME_POOL_SIZE)])
+
+
+def iter_users(count: int, seed: Optional[int] = None) -> Iterator[tuple]:
+    """Yields user rows 1..count in the column order of the users table."""
+    first_names, last_names = _name_pool(seed)
+    for block_start in range(1, count + 1, USER_BLOCK):
+        rng = random.Random(None if seed is None else f"{seed}:users:{block_start}")
+        for user_id in range(block_start, min(block_start + USER_BLOCK, count + 1)):
+            conditions = rng.sample(CONDITIONS, rng.randint(1, 3))
+            if 'Type 2 Diabetes' not in conditions and rng.random() < 0.2:  # 20% chance of diabetes
+                conditions.append('Type 2 Diabetes')
+            yield (
+                user_id,
+                rng.choice(first_names),
+                rng.choice(last_names),
+                rng.choice(CITIES),
+                rng.choice(DIETS),
+                ", ".join(conditions),
+                rng.choice(LIMITATIONS),
+            )
+
+
+def insert_users(conn: sqlite3.Connection, count: int, seed: Optional[int] = None,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    """
+    Creates users 1..count (existing IDs are kept) and returns how many were added.
+    New users' conditions are indexed and counted into the cohort aggregates.
+    """
+    created = 0
+    users = iter_users(count, seed)
+    while True:
+        chunk = list(itertools.islice(users, chunk_rows))
+        if not chunk:
+            break
+        existing = {row[0] for row in conn.execute(
+            "SELECT user_id FROM users WHERE user_id BETWEEN ? AND ?", (chunk[0][0], chunk[-1][0]))}
+        new_users = [user for user in chunk if user[0] not in existing]
+        with conn:
+            conn.executemany(_INSERT_USER_SQL, new_users)
+            database.add_users_to_cohorts(conn, [(u[0], u[3], u[4], u[5]) for u in new_users])
+        created += len(new_users)
+    return created
+
+
+# --- Log Streams ---
+
+def _carbs(macros: str) -> float:
+    return float(re.search(r"Carbs: (\d+)g", macros).group(1))
+
+
+# Typed macro columns for every dish the generator logs, estimated once from the built-in foods
+_NO_MACROS = (None, None, None, None)
+_FOOD_INDEX = nutrition.builtin_index()
+_DISH_MACROS = {
+    dish: nutrition.estimate(dish, _FOOD_INDEX).totals() or _NO_MACROS
+    for dish in itertools.chain((d for meals in DIET_MEALS.values() for d, _ in meals), SNACKS)
+}
+
+_MOOD_LABELS_BY_SCORE = {}
+for _label, _score in database.MOOD_SCORES.items():
+    _MOOD_LABELS_BY_SCORE.setdefault(_score, []).append(_label)
+_MOOD_SCORE_LEVELS = np.array(sorted(_MOOD_LABELS_BY_SCORE))
+
+
+def user_log_rows(user_id: int, diet: str, diabetic: bool, start: int, days: int, seed: int,
+                  interval_minutes: int = CGM_INTERVAL_MINUTES) -> Tuple[list, list]:
+    """
+    Generates one user's history from epoch `start`. Returns (cgm_rows, event_rows):
+    (user_id, epoch, glucose) for _INSERT_CGM_SQL and
+    (user_id, epoch, log_type, value, meal_timestamp, mood_score, carbs_g, protein_g, fat_g, kcal)
+    for _INSERT_EVENT_SQL.
+    """
+    rng = np.random.default_rng([seed, user_id])
+    step = interval_minutes * 60
+    n = days * 86400 // step
+    t = start + np.arange(n, dtype=np.int64) * step
+    hours = (t % 86400) / 3600
+
+    # Baseline plus a daily rhythm peaking in the early morning (dawn phenomenon)
+    baseline = rng.normal(150, 20) if diabetic else rng.normal(105, 8)
+    glucose = baseline + (12 if diabetic else 6) * np.sin(2 * np.pi * (hours - 4) / 24)
+
+    # Meals: carb impulses convolved with a response curve peaking ~45 minutes later
+    meals = DIET_MEALS[diet_bucket(diet)]
+    gain = 2.0 if diabetic else 0.9   # mg/dL peak per gram of carbs
+    impulses = np.zeros(n)
+    events = []
+    for day in range(days):
+        day_start = start + day * 86400
+        for (dish, macros), (low, high) in zip(meals, MEAL_HOURS):
+            if rng.random() < 0.05:       # skipped meal
+                continue
+            eaten = day_start + int(rng.uniform(low, high) * 3600)
+            impulses[(eaten - start) // step] += _carbs(macros) * rng.uniform(0.7, 1.3) * gain
+            meal_timestamp = datetime.datetime.utcfromtimestamp(eaten).isoformat()
+            events.append((user_id, eaten + int(rng.uniform(0, 1800)), "food", dish, meal_timestamp, None,
+                           *_DISH_MACROS[dish]))
+        if rng.random() < 0.4:
+            eaten = day_start + int(rng.uniform(15, 17) * 3600)
+            impulses[(eaten - start) // step] += SNACK_CARBS * gain
+            meal_timestamp = datetime.datetime.utcfromtimestamp(eaten).isoformat()
+            snack = SNACKS[rng.integers(len(SNACKS))]
+            events.append((user_id, eaten, "food", snack, meal_timestamp, None, *_DISH_MACROS[snack]))
+    tau = np.arange(0, 240, interval_minutes) / 45
+    glucose += np.convolve(impulses, tau * np.exp(1 - tau))[:n]
+
+    # Slow physiological drift (AR(1)-like, via an exponential kernel) plus sensor noise
+    kernel = 0.97 ** np.arange(120)
+    drift = np.convolve(rng.normal(0, 1, n), kernel)[:n] / np.sqrt((kernel ** 2).sum())
+    glucose += drift * (15 if diabetic else 7) + rng.normal(0, 2, n)
+    glucose = np.clip(np.rint(glucose), 40, 400).astype(np.int64)
+
+    # Sensor gaps: about one day in twenty loses one to three hours of readings
+    keep = np.ones(n, dtype=bool)
+    per_day = 86400 // step
+    for day in np.flatnonzero(rng.random(days) < 0.05):
+        gap_start = day * per_day + rng.integers(per_day)
+        keep[gap_start:gap_start + rng.integers(60, 181) // interval_minutes] = False
+
+    # Moods: 1-3 a day, better when glucose is near target
+    for day in range(days):
+        for _ in range(rng.integers(1, 4)):
+            at = day * 86400 + int(rng.uniform(8, 22) * 3600)
+            current = glucose[min(n - 1, at // step)]
+            target = 7.5 - abs(current - 110) / 30 + rng.normal(0, 1.2)
+            score = int(_MOOD_SCORE_LEVELS[np.abs(_MOOD_SCORE_LEVELS - target).argmin()])
+            labels = _MOOD_LABELS_BY_SCORE[score]
+            events.append((user_id, start + at, "mood", labels[rng.integers(len(labels))], None, score, *_NO_MACROS))
+
+    events.sort(key=lambda row: row[1])
+    cgm_rows = list(zip(itertools.repeat(user_id), t[keep].tolist(), glucose[keep].tolist()))
+    return cgm_rows, events
+
+
+# --- Cohort Aggregates ---
+
+# Where each cohort log type's value sits in an event row (see user_log_rows)
+_EVENT_VALUE_INDEX = {"mood": 5, "food": 6}   # mood_score, carbs_g
+
+
+def _add_daily_stats(stats: Dict[tuple, list], cohorts: Sequence[Tuple[str, str, str]], log_type: str,
+                     epochs: np.ndarray, values: np.ndarray):
+    """Folds one user's time-ordered readings into stats per UTC day, for each of the user's cohorts."""
+    if not len(values):
+        return
+    days = epochs // 86400
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    columns = [
+        np.diff(np.r_[starts, len(values)]),
+        np.add.reduceat(values, starts),
+        np.add.reduceat(values * values, starts),
+        np.minimum.reduceat(values, starts),
+        np.maximum.reduceat(values, starts),
+    ]
+    if log_type == "cgm":
+        low, high = database.COHORT_TARGET_RANGE
+        for in_band in (values < low, (values >= low) & (values <= high), values > high):
+            columns.append(np.add.reduceat(in_band.astype(np.int64), starts))
+    else:
+        columns.extend([[None] * len(starts)] * 3)
+    labels = [datetime.datetime.utcfromtimestamp(day * 86400).strftime("%Y-%m-%d") for day in days[starts].tolist()]
+    for label, partial in zip(labels, zip(*(c.tolist() if isinstance(c, np.ndarray) else c for c in columns))):
+        for city, diet, condition in cohorts:
+            key = (label, city, diet, condition, log_type)
+            current = stats.get(key)
+            if current is None:
+                stats[key] = list(partial)
+                continue
+            current[0] += partial[0]
+            current[1] += partial[1]
+            current[2] += partial[2]
+            current[3] = min(current[3], partial[3])
+            current[4] = max(current[4], partial[4])
+            if log_type == "cgm":
+                current[5] += partial[5]
+                current[6] += partial[6]
+                current[7] += partial[7]
+
+
+def _add_cohort_stats(stats: Dict[tuple, list], cohorts: Sequence[Tuple[str, str, str]],
+                      cgm_rows: list, event_rows: list):
+    """
+    Adds one user's generated rows to stats, keyed like cohort_daily: the same
+    per-day sums database.update_cohort_stats computes in SQL, but from the
+    arrays at hand instead of re-reading the rows just written.
+    """
+    if cgm_rows:
+        readings = np.array(cgm_rows, dtype=np.int64)
+        _add_daily_stats(stats, cohorts, "cgm", readings[:, 1], readings[:, 2].astype(np.float64))
+    for log_type, index in _EVENT_VALUE_INDEX.items():
+        events = [(row[1], row[index]) for row in event_rows if row[2] == log_type and row[index] is not None]
+        if events:
+            epochs, values = zip(*events)
+            _add_daily_stats(stats, cohorts, log_type, np.array(epochs, dtype=np.int64),
+                             np.array(values, dtype=np.float64))
+
+
+def _cohort_rows(stats: Dict[tuple, list]) -> List[tuple]:
+    return [(*key, *values) for key, values in stats.items()]
+
+
+def write_logs(conn: sqlite3.Connection, users: Sequence[tuple], start: int, days: int,
+               seed: int, chunk_rows: int = DEFAULT_CHUNK_ROWS, update_aggregates: bool = True,
+               cohort_stats: Optional[Dict[tuple, list]] = None) -> int:
+    """
+    Generates and inserts the log streams for (user_id, diet, diabetic, cohorts)
+    users, committing every ~chunk_rows rows. Returns the number of rows written.
+    With update_aggregates the mood and cohort aggregates are updated in the same
+    transactions; otherwise the cohort sums can be collected in cohort_stats.
+    """
+    collect_stats = update_aggregates or cohort_stats is not None
+    stats = {} if cohort_stats is None else cohort_stats
+    total = 0
+    pending: List[Tuple[list, list]] = []   # per-user (cgm_rows, event_rows), in user order
+    pending_rows = 0
+
+    def flush():
+        with conn:
+            for cgm_rows, event_rows in pending:
+                conn.executemany(_INSERT_CGM_SQL, cgm_rows)
+                conn.executemany(_INSERT_EVENT_SQL, event_rows)
+                if update_aggregates:
+                    database.update_mood_aggregates(conn, [
+                        (uid, score, label, _iso(epoch)) for uid, epoch, kind, label, _, score, *_ in event_rows
+                        if kind == "mood"
+                    ])
+            if update_aggregates:
+                database.upsert_cohort_daily(conn, _cohort_rows(stats))
+                stats.clear()
+        pending.clear()
+
+    for user_id, diet, diabetic, cohorts in users:
+        rows = user_log_rows(user_id, diet, diabetic, start, days, seed)
+        if collect_stats:
+            _add_cohort_stats(stats, cohorts, *rows)
+        pending.append(rows)
+        pending_rows += len(rows[0]) + len(rows[1])
+        if pending_rows >= chunk_rows:
+            flush()
+            total, pending_rows = total + pending_rows, 0
+    if pending:
+        flush()
+    return total + pending_rows
+
+
+def _iso(epoch: int) -> str:
+    return datetime.datetime.utcfromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _generate_shard(task: tuple) -> Tuple[str, int, List[tuple]]:
+    """
+    Pool worker: writes a user range's logs into its own shard database and
+    returns it with the row count and the range's cohort_daily rows.
+    """
+    path, users, start, days, seed, chunk_rows = task
+    conn = sqlite3.connect(path)
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute("""
+        CREATE TABLE logs (
+            log_id INTEGER PRIMARY KEY, user_id INTEGER, timestamp TEXT, log_type TEXT, value TEXT,
+            glucose_mg_dl REAL, meal_timestamp TEXT, mood_score REAL,
+            carbs_g REAL, protein_g REAL, fat_g REAL, kcal REAL
+        )
+    """)
+    stats: Dict[tuple, list] = {}
+    rows = write_logs(conn, users, start, days, seed, chunk_rows, update_aggregates=False, cohort_stats=stats)
+    conn.close()
+    return path, rows, _cohort_rows(stats)
+
+
+def _merge_shard(conn: sqlite3.Connection, path: str, cohort_rows: List[tuple]):
+    conn.execute("ATTACH DATABASE ? AS shard", (path,))
+    try:
+        with conn:
+            conn.execute(f"INSERT INTO main.logs ({_LOG_COLUMNS}) SELECT {_LOG_COLUMNS} FROM shard.logs ORDER BY log_id")
+            moods = conn.execute(
+                "SELECT user_id, mood_score, value, timestamp FROM shard.logs WHERE log_type = 'mood' ORDER BY log_id"
+            ).fetchall()
+            database.update_mood_aggregates(conn, moods)
+            database.upsert_cohort_daily(conn, cohort_rows)
+    finally:
+        conn.execute("DETACH DATABASE shard")
+        os.remove(path)
+
+
+# --- Driver ---
+
+_CREATE_INDEX_IF_NOT_EXISTS = re.compile(r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+
+
+def _bulk_connection() -> sqlite3.Connection:
+    # Pooled connections are closed first so this one can take the database exclusively
+    database.close_connections()
+    conn = sqlite3.connect(database.DB_PATH, timeout=database.SQLITE_BUSY_TIMEOUT)
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def generate(users: int = 100, days: int = 0, seed: int = 42, end: Optional[datetime.date] = None,
+             workers: int = 1, chunk_rows: int = DEFAULT_CHUNK_ROWS, verbose: bool = False) -> int:
+    """
+    Ensures users 1..users exist in database.DB_PATH and appends `days` days of log
+    history for each of them. Returns the number of log rows written.
+    """
+    log = print if verbose else (lambda *args, **kwargs: None)
+    database.init_schema()
+    conn = _bulk_connection()
+    indexes: List[Tuple[str, str]] = []   # log indexes dropped for the load
+    shard_dir = None
+
+    def restore_indexes():
+        started = time.perf_counter()
+        for _, sql in indexes:
+            conn.execute(_CREATE_INDEX_IF_NOT_EXISTS.sub(r"CREATE \1INDEX IF NOT EXISTS ", sql, count=1))
+        log(f"Rebuilt {len(indexes)} log indexes ({time.perf_counter() - started:.1f}s)")
+        indexes.clear()
+
+    try:
+        started = time.perf_counter()
+        created = insert_users(conn, users, seed, chunk_rows)
+        log(f"Users: {created} created ({time.perf_counter() - started:.1f}s)")
+        if days <= 0:
+            return 0
+
+        end = end or datetime.datetime.utcnow().date()
+        start = int(datetime.datetime(end.year, end.month, end.day, tzinfo=datetime.timezone.utc).timestamp()) - days * 86400
+        profiles = [
+            (user_id, diet, "Type 2 Diabetes" in (conditions or ""), database.cohort_keys(city, diet, conditions))
+            for user_id, diet, conditions, city in conn.execute(
+                "SELECT user_id, dietary_preference, medical_conditions, city FROM users WHERE user_id <= ? "
+                "ORDER BY user_id",
+                (users,)
+            )
+        ]
+
+        # Index maintenance dominates inserts into an indexed table; on a fresh
+        # table it is far cheaper to build the indexes once, after the load.
+        if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM logs)").fetchone()[0]:
+            indexes.extend(conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'logs' AND sql IS NOT NULL"
+            ))
+            for name, _ in indexes:
+                conn.execute(f"DROP INDEX {name}")
+
+        started = time.perf_counter()
+        rows = 0
+        if workers <= 1:
+            rows = write_logs(conn, profiles, start, days, seed, chunk_rows)
+        else:
+            shard_dir = tempfile.mkdtemp(prefix="datagen-", dir=os.path.dirname(os.path.abspath(database.DB_PATH)))
+            per_task = max(1, -(-len(profiles) // (workers * 4)))
+            tasks = [
+                (os.path.join(shard_dir, f"shard-{i:05d}.db"), profiles[offset:offset + per_task],
+                 start, days, seed, chunk_rows)
+                for i, offset in enumerate(range(0, len(profiles), per_task))
+            ]
+            with Pool(workers) as pool:
+                # imap keeps user order, so log_ids come out the same as a single-process run
+                for path, shard_rows, cohort_rows in pool.imap(_generate_shard, tasks):
+                    _merge_shard(conn, path, cohort_rows)
+                    rows += shard_rows
+                    log(f"  {rows:,} rows ({rows / (time.perf_counter() - started):,.0f} rows/s)")
+        log(f"Logs: {rows:,} rows for {len(profiles)} users over {days} days ({time.perf_counter() - started:.1f}s)")
+        if indexes:
+            restore_indexes()
+        conn.execute("ANALYZE")
+        return rows
+    finally:
+        # Also after a failed or interrupted load: logs must never be left unindexed
+        if conn.in_transaction:
+            conn.rollback()
+        if indexes:
+            restore_indexes()
+        if shard_dir is not None:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        conn.execute("PRAGMA locking_mode=NORMAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+        database.invalidate_user_profile()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic users and log history")
+    parser.add_argument("--db", help="database file (default: DB_PATH or agents/users.db)")
+    parser.add_argument("--users", type=int, default=100, help="users 1..N to create (existing IDs are kept)")
+    parser.add_argument("--days", type=int, default=0, help="days of CGM/mood/food history per user")
+    parser.add_argument("--end", type=datetime.date.fromisoformat, help="history ends at the start of this UTC day, YYYY-MM-DD (default today)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1, help="processes generating log streams")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="rows per insert transaction")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    started = time.perf_counter()
+    rows = generate(args.users, args.days, args.seed, args.end, args.workers, args.chunk_rows, verbose=True)
+    elapsed = time.perf_counter() - started
+    print(f"Done: {rows:,} log rows in {elapsed:.1f}s ({database.DB_PATH})")
+
+
+if __name__ == "__main__":
+    main()
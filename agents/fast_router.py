@@ -0,0 +1,108 @@
+"""
+Deterministic fast-path router for structured chat messages.
+
+Most chat traffic is simple logging: "my glucose is 140", "I'm tired", "my id is
+35". These are matched with anchored regular expressions and dispatched straight
+to the tools in tools.py, skipping the Groq round trip. A message is only
+handled here when a pattern matches the *whole* message and every argument the
+tool needs is known. Anything else returns None and goes to the LLM.
+"""
+
+import inspect
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from async_database import get_user_profile
+from tools import log_cgm_reading, log_user_mood, validate_user_id
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ROUTER", "1") != "0"
+
+MOOD_LABELS = (
+    "happy", "sad", "tired", "excited", "stressed", "anxious", "calm",
+    "energetic", "content", "fatigued", "angry", "bored", "relaxed", "okay",
+)
+
+_END = r"\s*(?:today|now|right now|this morning|tonight)?\s*[.!]*\s*$"
+
+USER_ID_PATTERN = re.compile(
+    r"^\s*(?:(?:hi|hello|hey)[,!.\s]+)?"
+    r"(?:my\s+(?:user\s+)?id\s+is|i\s*(?:am|['’]m)\s+(?:user\s+)?id|i\s*(?:am|['’]m)\s+user|user\s+id\s*(?:is|:)?|id\s*(?:is|:))"
+    r"\s*(?:#|number\s+)?(\d{1,9})\s*[.!]*\s*$",
+    re.IGNORECASE,
+)
+
+GLUCOSE_PATTERN = re.compile(
+    r"^\s*(?:my\s+)?(?:blood\s+)?(?:glucose|sugar|cgm|bg)(?:\s+(?:reading|level))?"
+    r"\s*(?:is|was|=|:|of|at|reads)?\s*(?:now\s+)?(\d{2,3})\s*(?:mg\s*/?\s*dl)?" + _END,
+    re.IGNORECASE,
+)
+
+MOOD_PATTERN = re.compile(
+    r"^\s*(?:i\s*(?:am|['’]m)(?:\s+feeling)?|i\s+feel|feeling|my\s+mood\s+is|mood\s*:)"
+    r"\s*(?:so\s+|very\s+|really\s+|a\s+bit\s+|kind\s+of\s+|pretty\s+)?"
+    r"(" + "|".join(MOOD_LABELS) + r")" + _END,
+    re.IGNORECASE,
+)
+
+# How many requests each path served, e.g. {"fast_path": 812, "llm": 95}
+ROUTE_COUNTS: Counter = Counter()
+
+
+@dataclass
+class FastPathResult:
+    intent: str
+    response: str
+    user_id: Optional[int] = None   # None when a user ID failed validation
+
+
+def classify(message: str, user_id: Optional[int] = None) -> Optional[tuple]:
+    """
+    Returns (intent, tool, kwargs) when the message confidently maps to a single
+    tool call, or None when it should go to the LLM.
+    """
+    match = USER_ID_PATTERN.match(message)
+    if match:
+        return "validate_user", validate_user_id, {"user_id": int(match.group(1))}
+
+    # Logging needs a known user; without one the LLM asks for it
+    if user_id is None:
+        return None
+
+    match = GLUCOSE_PATTERN.match(message)
+    if match:
+        return "log_cgm", log_cgm_reading, {"user_id": user_id, "glucose_reading": int(match.group(1))}
+
+    match = MOOD_PATTERN.match(message)
+    if match:
+        return "log_mood", log_user_mood, {"user_id": user_id, "mood_label": match.group(1).lower()}
+
+    return None
+
+
+async def _call_tool(tool, **kwargs) -> str:
+    """Calls an agno @tool's underlying function directly."""
+    result = getattr(tool, "entrypoint", tool)(**kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def try_fast_path(message: str, user_id: Optional[int] = None) -> Optional[FastPathResult]:
+    """Serves the message without the LLM if possible; returns None to fall back."""
+    if not FAST_PATH_ENABLED:
+        return None
+    classified = classify(message, user_id)
+    if classified is None:
+        return None
+
+    intent, tool, kwargs = classified
+    # The user is checked before any tool runs: an unknown ID gets validate_user_id's
+    # "not found" reply, nothing is logged, and the session never adopts the ID
+    if not await get_user_profile(kwargs["user_id"]):
+        response = await _call_tool(validate_user_id, user_id=kwargs["user_id"])
+        return FastPathResult(intent=intent, response=response, user_id=None)
+    response = await _call_tool(tool, **kwargs)
+    return FastPathResult(intent=intent, response=response, user_id=kwargs["user_id"])
@@ -0,0 +1,549 @@
+"""
+Metrics and tracing for agent runs, tool calls and database queries.
+
+- Metrics: in-process counters and histograms, rendered in the Prometheus text
+  format by GET /metrics. Under multi-worker mode, each worker periodically
+  writes a snapshot to METRICS_MULTIPROC_DIR, and a scrape sums all of them.
+  Snapshots of exited workers are removed and stale ones skipped, so a
+  restarted worker's old pid does not keep counting.
+- Spans: span() times a block and nests through a contextvar, so one request
+  carries a trace ID through the agent run, its tool calls and DB queries
+  (run_in_db_thread copies the context into the executor thread). Each root
+  span keeps a breakdown of where its time went: agent run, tools, DB, tokens.
+- Database: connections opened with TimedConnection time every statement,
+  labelled by statement kind and table.
+- Cold start: record_startup() keeps how long each startup phase took (module
+  imports, database setup, first agent/model builds) for /stats and /metrics.
+- Logging: the "healthcare" logger writes plain text, or one JSON object per
+  line with LOG_FORMAT=json. In JSON mode every finished request is logged with
+  its breakdown (LOG_SPANS=0 turns that off).
+"""
+
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_SNAPSHOT_SECONDS = float(os.getenv("METRICS_SNAPSHOT_SECONDS", "5"))
+# Other workers' snapshots older than this are left out of scrapes (their worker is gone or hung)
+METRICS_STALE_SECONDS = float(os.getenv("METRICS_STALE_SECONDS", str(5 * METRICS_SNAPSHOT_SECONDS)))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()      # text | json
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SPANS = os.getenv("LOG_SPANS", "1" if LOG_FORMAT == "json" else "0") != "0"
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("healthcare")
+
+
+# --- Metrics ---
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = {json.dumps(key): (list(v) if isinstance(v, list) else v) for key, v in self._values.items()}
+        return {"kind": self.kind, "help": self.help, "labelnames": list(self.labelnames), "values": values}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (last one is +Inf), then sum and count
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        snap = super().snapshot()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+
+REGISTRY: List[Metric] = []
+# Functions returning [(name, kind, help, labels, value)] read at scrape time,
+# for state other modules already count (caches, scheduler, sessions)
+COLLECTORS: List[Callable[[], List[Tuple[str, str, str, Dict[str, Any], float]]]] = []
+
+HTTP_REQUESTS = Counter("healthcare_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_SECONDS = Histogram("healthcare_http_request_seconds", "HTTP request latency", ("method", "route"))
+SPAN_SECONDS = Histogram("healthcare_span_seconds", "Duration of traced spans", ("span", "status"))
+AGENT_RUN_SECONDS = Histogram("healthcare_agent_run_seconds", "Agent run latency (model calls and tools)", ("agent", "status"))
+TOOL_CALLS = Counter("healthcare_tool_calls_total", "Agent tool calls by outcome", ("tool", "status"))
+TOOL_SECONDS = Histogram("healthcare_tool_call_seconds", "Agent tool call latency", ("tool",))
+DB_QUERIES = Counter("healthcare_db_queries_total", "SQLite statements executed", ("statement", "table", "status"))
+DB_SECONDS = Histogram("healthcare_db_query_seconds", "SQLite statement execution time", ("statement", "table"))
+LLM_TOKENS = Counter("healthcare_llm_tokens_total", "Model tokens reported by agent runs", ("agent", "type"))
+
+
+def register_collector(collector: Callable[[], List[Tuple[str, str, str, Dict[str, Any], float]]]):
+    COLLECTORS.append(collector)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """This process's metrics, including collector values, as a JSON-serialisable dict."""
+    snap = {metric.name: metric.snapshot() for metric in REGISTRY}
+    for collector in COLLECTORS:
+        for name, kind, help, labels, value in collector():
+            entry = snap.setdefault(name, {"kind": kind, "help": help, "labelnames": sorted(labels), "values": {}})
+            key = json.dumps([str(labels[label]) for label in entry["labelnames"]])
+            entry["values"][key] = entry["values"].get(key, 0) + value
+    return snap
+
+
+def _merge(total: Dict[str, Dict[str, Any]], snap: Dict[str, Dict[str, Any]]):
+    for name, entry in snap.items():
+        target = total.setdefault(name, {**entry, "values": {}})
+        for key, value in entry["values"].items():
+            current = target["values"].get(key)
+            if current is None:
+                target["values"][key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                target["values"][key] = [a + b for a, b in zip(current, value)]
+            else:
+                target["values"][key] = current + value
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_MULTIPROC_DIR, f"{pid}.json")
+
+
+def write_snapshot():
+    """Publishes this worker's metrics for the other workers' scrapes (multi-worker mode)."""
+    if not METRICS_MULTIPROC_DIR:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name != "posix":
+        return True   # no cheap liveness probe (os.kill would signal the process); staleness still applies
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect() -> Dict[str, Dict[str, Any]]:
+    """
+    Metrics of this process plus the latest snapshots of the other live workers.
+    Snapshots of exited processes are deleted; ones older than METRICS_STALE_SECONDS are skipped.
+    """
+    total: Dict[str, Dict[str, Any]] = {}
+    _merge(total, snapshot())
+    if METRICS_MULTIPROC_DIR and os.path.isdir(METRICS_MULTIPROC_DIR):
+        own = _snapshot_path(os.getpid())
+        now = time.time()
+        for entry in os.scandir(METRICS_MULTIPROC_DIR):
+            if entry.name.endswith(".json") and entry.path != own:
+                pid = entry.name[:-len(".json")]
+                try:
+                    if pid.isdigit() and not _pid_alive(int(pid)):
+                        os.remove(entry.path)
+                        continue
+                    if now - entry.stat().st_mtime > METRICS_STALE_SECONDS:
+                        continue
+                except OSError:
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        _merge(total, json.load(f))
+                except (OSError, ValueError):
+                    continue  # being replaced right now; picked up on the next scrape
+    return total
+
+
+def _labels(names: List[str], key: str, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, json.loads(key))]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, entry in sorted(collect().items()):
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        names = entry["labelnames"]
+        for key, value in sorted(entry["values"].items()):
+            if entry["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(entry["buckets"]) + ["+Inf"], value[:-2]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(names, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, key)} {value[-2]}")
+            lines.append(f"{name}_count{_labels(names, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Spans ---
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed block. Root spans also aggregate their descendants' time by category."""
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.root: "Span" = parent.root if parent else self
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attrs = attrs
+        self.status = "ok"
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.breakdown: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, category: str, amount: float):
+        """Adds time (seconds) or a count to the root span's breakdown."""
+        root = self.root
+        with root._lock:
+            root.breakdown[category] = root.breakdown.get(category, 0) + amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        entry = {
+            "span": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 3),
+            **self.attrs,
+        }
+        if self.breakdown:
+            entry["breakdown"] = {
+                (k[:-len("_seconds")] + "_ms" if k.endswith("_seconds") else k):
+                    (round(v * 1000, 3) if k.endswith("_seconds") else v)
+                for k, v in self.breakdown.items()
+            }
+        return entry
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """Times a block as a child of the current span (or a new trace). Usable in sync and async code."""
+    current = Span(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+        if METRICS_ENABLED:
+            SPAN_SECONDS.observe(current.duration, span=name, status=current.status)
+        if current.parent is not None:
+            current.add(f"{name}_seconds", current.duration)
+        if LOG_SPANS:
+            level = logging.INFO if current.parent is None else logging.DEBUG
+            logger.log(level, "span %s finished", name, extra={"fields": current.to_dict()})
+
+
+# --- Agent, tool, token and DB recording ---
+
+def record_tokens(agent: str, input_tokens: int, output_tokens: int):
+    if METRICS_ENABLED:
+        LLM_TOKENS.inc(input_tokens, agent=agent, type="input")
+        LLM_TOKENS.inc(output_tokens, agent=agent, type="output")
+    current = _current_span.get()
+    if current is not None:
+        current.add("input_tokens", input_tokens)
+        current.add("output_tokens", output_tokens)
+
+
+@contextmanager
+def agent_run_span(agent: str, **attrs) -> Iterator[Span]:
+    """Span around one agent run, also recorded in healthcare_agent_run_seconds."""
+    with span("agent.run", agent=agent, **attrs) as current:
+        try:
+            yield current
+        finally:
+            if METRICS_ENABLED:
+                AGENT_RUN_SECONDS.observe(time.perf_counter() - current.start, agent=agent,
+                                          status="ok" if current.status == "ok" else "error")
+
+
+# Names of the tool calls finished inside the innermost count_tool_calls() block
+_tool_calls: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("tool_calls", default=None)
+
+
+@contextmanager
+def count_tool_calls() -> Iterator[List[str]]:
+    """Collects the names of the instrumented tools that finish (ok or not) inside the block."""
+    calls: List[str] = []
+    token = _tool_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _tool_calls.reset(token)
+
+
+def instrumented_tool(func: Callable) -> Callable:
+    """
+    Records latency and outcome of an agent tool function. The tools in tools.py are
+    plain functions wrapped only by this decorator; agno wraps the result when an
+    agent is built, so calls from agents and direct calls (fast_router) are both
+    covered. A tool counts as failed if it raises.
+    """
+    name = func.__name__
+
+    def finish(current: Span, status: str):
+        calls = _tool_calls.get()
+        if calls is not None:
+            calls.append(name)
+        if METRICS_ENABLED:
+            TOOL_CALLS.inc(tool=name, status=status)
+            TOOL_SECONDS.observe(time.perf_counter() - current.start, tool=name)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span("tool", tool=name) as current:
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    finish(current, "error")
+                    raise
+                finish(current, "ok")
+                return result
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span("tool", tool=name) as current:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:
+                    finish(current, "error")
+                    raise
+                finish(current, "ok")
+                return result
+    return wrapper
+
+
+# First table a statement reads or writes; CREATE INDEX ... ON <table> reports the indexed table
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|ON|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+([\w.]+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_labels(sql: str) -> Tuple[str, str]:
+    """(statement kind, main table) for a SQL string, e.g. ("select", "logs")."""
+    words = sql.split(None, 2)
+    if not words:
+        return "", ""
+    kind = words[0].lower()
+    if kind == "update" and len(words) > 1:
+        return kind, words[1]
+    match = _SQL_TABLE.search(sql)
+    return kind, match.group(1) if match else ""
+
+
+def record_db_query(sql: str, seconds: float, status: str = "ok"):
+    kind, table = statement_labels(sql)
+    DB_QUERIES.inc(statement=kind, table=table, status=status)
+    DB_SECONDS.observe(seconds, statement=kind, table=table)
+    current = _current_span.get()
+    if current is not None:
+        current.add("db_seconds", seconds)
+        current.add("db_queries", 1)
+
+
+def _timed(method: Callable) -> Callable:
+    @functools.wraps(method)
+    def wrapper(self, sql, *args):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return method(self, sql, *args)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            record_db_query(sql, time.perf_counter() - start, status)
+    return wrapper
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records every statement's execution time (not row fetching)."""
+    execute = _timed(sqlite3.Cursor.execute)
+    executemany = _timed(sqlite3.Cursor.executemany)
+    executescript = _timed(sqlite3.Cursor.executescript)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection factory whose statements are all timed (see TimedCursor)."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql):
+        return self.cursor().executescript(sql)
+
+
+def connection_factory() -> type:
+    """The sqlite3 connection class to use: timed unless METRICS_ENABLED=0."""
+    return TimedConnection if METRICS_ENABLED else sqlite3.Connection
+
+
+# --- Cold start ---
+
+STARTUP: Dict[str, float] = {}
+
+
+def record_startup(phase: str, seconds: float):
+    """Records the duration of one cold-start phase, e.g. "imports" or "agent.main_router_agent"."""
+    STARTUP[phase] = round(seconds, 4)
+    logger.debug("startup phase %s took %.3fs", phase, seconds, extra={"fields": {"phase": phase, "seconds": STARTUP[phase]}})
+
+
+def _startup_metrics() -> List[Tuple[str, str, str, Dict[str, Any], float]]:
+    pid = os.getpid()
+    return [("healthcare_startup_seconds", "gauge", "Cold-start time by phase, per worker process",
+             {"phase": phase, "pid": pid}, seconds) for phase, seconds in STARTUP.items()]
+
+
+register_collector(_startup_metrics)
+
+
+# --- HTTP middleware and logging ---
+
+class MetricsMiddleware:
+    """
+    ASGI middleware opening the root span of each HTTP request. Unlike a
+    BaseHTTPMiddleware it wraps the whole response, streamed bodies included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        with span("http.request", method=method, path=scope["path"]) as current:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = getattr(scope.get("route"), "path", "unmatched")
+                current.attrs.update(route=route, status_code=status)
+                if METRICS_ENABLED:
+                    HTTP_REQUESTS.inc(method=method, route=route, status=status)
+                    HTTP_SECONDS.observe(time.perf_counter() - current.start, method=method, route=route)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the active trace/span IDs and any structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        current = _current_span.get()
+        if current is not None:
+            entry["trace_id"] = current.trace_id
+            entry["span_id"] = current.span_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """Sets up the "healthcare" logger for LOG_FORMAT / LOG_LEVEL."""
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.handlers[:] = [handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
@@ -0,0 +1,129 @@
+"""
+Two-stage routing: a local intent classifier, then one specialist agent.
+
+With ROUTING_MODE=specialist, messages that reach the LLM (after fast_router)
+are classified here with keyword patterns, with no model call. The message is
+then run by the one lean specialist agent for that intent from agents_config
+(cgm_agent, mood_tracker_agent, ...). That agent has a short prompt and only
+its own tools, instead of the coordinator's long prompt and every tool schema.
+Messages that match several intents go to the coordinator (main_router_agent).
+Messages that match none go to interrupt_agent, and back to the coordinator if
+it hands off with ROUTETO_HEALTH_FLOW.
+
+ROUTING_MODE=coordinator (the default) keeps the single coordinator for
+everything. Both modes record runs, tokens and latency per path, so the two can
+be compared on the same traffic (GET /stats, /metrics, benchmark.py).
+"""
+
+import os
+import re
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import agents_config
+from fast_router import MOOD_LABELS
+
+ROUTING_MODE = os.getenv("ROUTING_MODE", "coordinator").lower()   # coordinator | specialist
+
+COORDINATOR = "main_router_agent"
+GENERAL_INTENT = "general"
+# interrupt_agent replies with this when a "general" message is about health after all
+HANDOFF_MARKER = "ROUTETO_HEALTH_FLOW"
+
+# Intent -> specialist agent attribute in agents_config
+INTENT_AGENTS = {
+    "greeting": "greeting_agent",
+    "mood": "mood_tracker_agent",
+    "cgm": "cgm_agent",
+    "food": "food_intake_agent",
+    "meal_plan": "meal_planner_agent",
+    GENERAL_INTENT: "interrupt_agent",
+}
+
+INTENT_PATTERNS = {
+    "greeting": re.compile(
+        r"^\s*(?:hi|hello|hey|good\s+(?:morning|afternoon|evening))\b|\b(?:user\s+)?id\s*(?:is|:|#)?\s*\d", re.IGNORECASE),
+    "mood": re.compile(
+        r"\b(?:mood|moods|feel|feeling|felt|" + "|".join(MOOD_LABELS) + r")\b", re.IGNORECASE),
+    "cgm": re.compile(
+        r"\b(?:glucose|sugar|sugars|cgm|bg|a1c|gmi|mg\s*/?\s*dl|time\s+in\s+range|hypo\w*|hyper\w*|insulin)\b", re.IGNORECASE),
+    "food": re.compile(
+        r"\b(?:i\s+(?:just\s+)?(?:ate|had|eaten)|for\s+(?:breakfast|lunch|dinner)|snack\w*|calories|macros?|carbs)\b",
+        re.IGNORECASE),
+    "meal_plan": re.compile(
+        r"\b(?:meal\s*plans?|plan\s+(?:my|a|the|some)\s+meals?|what\s+should\s+i\s+(?:eat|cook)|menu|recipes?)\b",
+        re.IGNORECASE),
+}
+
+
+def classify_intent(message: str) -> Optional[str]:
+    """
+    Returns the single intent the message is about, GENERAL_INTENT when it matches
+    none, or None when it matches several and needs the coordinator.
+    """
+    intents = {intent for intent, pattern in INTENT_PATTERNS.items() if pattern.search(message)}
+    if "meal_plan" in intents:
+        intents.discard("food")          # "what should I eat for lunch" is planning, not logging
+    if len(intents) > 1:
+        intents.discard("greeting")      # "hi, my glucose is 150" is about glucose
+    if not intents:
+        return GENERAL_INTENT
+    return intents.pop() if len(intents) == 1 else None
+
+
+def select_route(message: str, mode: Optional[str] = None) -> Tuple[str, Optional[str], str]:
+    """Returns (path, intent, agent attribute) for a message that goes to the LLM."""
+    if (mode or ROUTING_MODE) != "specialist":
+        return "coordinator", None, COORDINATOR
+    intent = classify_intent(message)
+    if intent is None:
+        return "coordinator", None, COORDINATOR
+    return "specialist", intent, INTENT_AGENTS[intent]
+
+
+async def route_agent(message: str, mode: Optional[str] = None) -> Tuple[Any, str, Optional[str]]:
+    """The agent (built on first use) to run the message with, plus its path and intent."""
+    path, intent, attr = select_route(message, mode)
+    return await agents_config.aget_agent(attr), path, intent
+
+
+def is_handoff(content: str) -> bool:
+    """True when interrupt_agent declined a message as health-related."""
+    return HANDOFF_MARKER in (content or "")
+
+
+async def coordinator_route() -> Tuple[Any, str, Optional[str]]:
+    """route_agent() result for a message handed back to the coordinator."""
+    return await agents_config.aget_agent(COORDINATOR), "coordinator", None
+
+
+# --- Per-path accounting ---
+
+_stats_lock = threading.Lock()
+PATH_STATS: Dict[str, Dict[str, float]] = {}
+
+
+def record_run(path: str, input_tokens: int, output_tokens: int, seconds: float):
+    """Adds one agent run to the totals for its path ("coordinator" or "specialist")."""
+    with _stats_lock:
+        stats = PATH_STATS.setdefault(path, {"runs": 0, "input_tokens": 0, "output_tokens": 0, "seconds": 0.0})
+        stats["runs"] += 1
+        stats["input_tokens"] += input_tokens
+        stats["output_tokens"] += output_tokens
+        stats["seconds"] += seconds
+
+
+def path_stats() -> Dict[str, Dict[str, float]]:
+    """Totals and per-run averages of tokens and latency for each path."""
+    with _stats_lock:
+        report = {}
+        for path, stats in PATH_STATS.items():
+            runs = stats["runs"] or 1
+            report[path] = {
+                **stats,
+                "seconds": round(stats["seconds"], 3),
+                "avg_input_tokens": round(stats["input_tokens"] / runs, 1),
+                "avg_output_tokens": round(stats["output_tokens"] / runs, 1),
+                "avg_seconds": round(stats["seconds"] / runs, 4),
+            }
+        return report
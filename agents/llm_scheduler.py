@@ -0,0 +1,263 @@
+"""
+Scheduling layer for model calls.
+
+Every agent run goes through the shared LLMScheduler, which:
+1. caps concurrent runs with a semaphore (LLM_MAX_CONCURRENCY),
+2. spends from token buckets for requests and tokens per minute, so bursts queue
+   here instead of turning into provider 429s,
+3. retries rate-limit errors with jittered exponential backoff, honouring
+   Retry-After when the provider sends it, unless a tool call already finished
+   in the failed attempt (a rerun would repeat its writes, e.g. log a reading
+   twice); the Groq client's own retries cover single model requests. A retry
+   gives up its slot while it backs off and is admitted again like a new request,
+4. coalesces identical in-flight prompts, so a double-submitted message runs once
+   and both callers get the same result. Runs of one session are serialized by
+   its lock, so only concurrent requests from different sessions can coalesce.
+
+Queue depth, wait times and outcome counters are exposed via stats().
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import instrumentation
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))   # 0 disables the budget
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "6000"))     # 0 disables the budget
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1.0"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "60"))
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") != "0"
+# Rough per-run token cost on top of the message itself: system prompt, tool
+# schemas and the reply. Used until the run reports its real usage.
+LLM_ESTIMATED_OVERHEAD_TOKENS = int(os.getenv("LLM_ESTIMATED_OVERHEAD_TOKENS", "1500"))
+
+
+class LLMOverloadedError(Exception):
+    """Raised when a call could not be scheduled or kept hitting rate limits."""
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Cheap token estimate (~4 characters per token) plus the fixed per-run overhead."""
+    return len(prompt) // 4 + LLM_ESTIMATED_OVERHEAD_TOKENS
+
+
+def usage_tokens(response: Any) -> Tuple[int, int]:
+    """
+    Returns (input_tokens, output_tokens) reported by an agno run response, or
+    (0, 0) if unavailable. agno 1.x reports per-call lists in a metrics dict;
+    2.x reports totals on a metrics object.
+    """
+    metrics = getattr(response, "metrics", None)
+    if not metrics:
+        return 0, 0
+
+    def total(key: str) -> int:
+        value = metrics.get(key) if isinstance(metrics, dict) else getattr(metrics, key, None)
+        if isinstance(value, (list, tuple)):
+            return int(sum(v or 0 for v in value))
+        return int(value or 0)
+
+    return total("input_tokens"), total("output_tokens")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    text = str(error).lower()
+    return "429" in text or "rate limit" in text or "rate_limit" in text
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at per_minute / 60 per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()  # waiters are served in arrival order
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        """Charges (positive) or refunds (negative) tokens after the real cost is known."""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+                 max_retries: int = LLM_MAX_RETRIES, queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+                 coalesce: bool = LLM_COALESCE):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.coalesce = coalesce
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._waits = deque(maxlen=1000)  # recent queue wait times, seconds
+        self.queued = self.running = 0
+        self.completed = self.failed = self.retries = self.rate_limited = self.coalesced = self.rejected = 0
+
+    async def _admit(self, estimated_tokens: int):
+        """Waits for a concurrency slot and the per-minute budgets, then holds the slot."""
+        start = time.monotonic()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            try:
+                remaining = max(0.0, self.queue_timeout - (time.monotonic() - start))
+                await asyncio.wait_for(self._requests.acquire(1), remaining)
+                await asyncio.wait_for(self._tokens.acquire(estimated_tokens), remaining)
+            except BaseException:
+                self._semaphore.release()
+                raise
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LLMOverloadedError(f"LLM queue wait exceeded {self.queue_timeout:.0f}s")
+        finally:
+            self.queued -= 1
+        self._waits.append(time.monotonic() - start)
+        self.running += 1
+
+    def _release(self):
+        self.running -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self, prompt: str):
+        """Holds a scheduled slot around a call that cannot be retried (e.g. a token stream)."""
+        await self._admit(estimate_tokens(prompt))
+        try:
+            yield
+            self.completed += 1
+        except BaseException as e:
+            self.failed += 1
+            if isinstance(e, Exception) and is_rate_limit_error(e):
+                self.rate_limited += 1
+            raise
+        finally:
+            self._release()
+
+    async def run(self, call: Callable[[], Awaitable[Any]], prompt: str, key: Optional[Hashable] = None) -> Any:
+        """
+        Runs call() under the concurrency limit and budgets, retrying rate-limit
+        errors that happen before any tool call has finished. Calls sharing a key
+        while one is in flight share its result.
+        """
+        if self.coalesce and key is not None:
+            existing = self._inflight.get(key)
+            if existing is not None:
+                self.coalesced += 1
+                return await asyncio.shield(existing)
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                result = await self._run(call, prompt)
+                future.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()  # mark retrieved when nobody else was waiting
+                raise
+            finally:
+                del self._inflight[key]
+        return await self._run(call, prompt)
+
+    async def _run(self, call: Callable[[], Awaitable[Any]], prompt: str) -> Any:
+        estimated = estimate_tokens(prompt)
+        for attempt in range(self.max_retries + 1):
+            # Each attempt is admitted on its own: retries spend from the budgets like
+            # any other request, and the slot is free for other callers during backoff
+            await self._admit(estimated)
+            try:
+                with instrumentation.count_tool_calls() as tool_calls:
+                    result = await call()
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    self.failed += 1
+                    raise
+                self.rate_limited += 1
+                if tool_calls:
+                    self.failed += 1
+                    raise LLMOverloadedError(
+                        f"LLM rate limited after tool calls ({', '.join(tool_calls)}); not retried: {e}") from e
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise LLMOverloadedError(f"LLM rate limited after {attempt + 1} attempts: {e}") from e
+                # Full jitter, so callers throttled together do not retry together
+                backoff = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+                delay = retry_after_seconds(e) or random.uniform(0, backoff)
+                self.retries += 1
+            else:
+                input_tokens, output_tokens = usage_tokens(result)
+                if input_tokens or output_tokens:
+                    self._tokens.adjust(input_tokens + output_tokens - estimated)
+                self.completed += 1
+                return result
+            finally:
+                self._release()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "coalesced": self.coalesced,
+            "wait_seconds": {
+                "avg": round(sum(waits) / len(waits), 4) if waits else 0.0,
+                "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4) if waits else 0.0,
+                "max": round(waits[-1], 4) if waits else 0.0,
+            },
+        }
+
+
+scheduler = LLMScheduler()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Bulk export of user logs.
+
+Streams every matching log, for all users or a filtered set (explicit IDs, or
+users with a medical condition via the user_conditions index), optionally
+narrowed by log type and time range, in one of three formats:
+- csv: gzip-compressed CSV with a header row
+- ndjson: one JSON object per line
+- npz: columnar; a deflated ZIP of .npy arrays, one per column and chunk, named
+  <column>/<chunk>.npy. load_npz_export() concatenates them back into columns.
+
+Rows are read user by user through the (user_id, timestamp) index on a
+dedicated connection, fetched EXPORT_CHUNK_ROWS at a time and encoded chunk by
+chunk, so memory use stays flat however large the table is. The export runs in
+one read transaction: it sees a single consistent WAL snapshot and never takes
+a write lock, so log_data() and batch ingestion carry on while it runs. (While
+it is open the WAL cannot be reset, so the -wal file grows with what is
+ingested meanwhile until the next checkpoint after the export.) Rows compacted
+into the archive by retention.py come first for each user, unless
+include_archive is off; the segment catalogue is read in the same snapshot, so
+a compaction committing mid-export neither duplicates nor drops rows.
+
+    python log_export.py --format csv --out logs.csv.gz
+    python log_export.py --format npz --log-type cgm --start 2024-01-01 --condition "Type 2 Diabetes" --out cgm.npz
+    python log_export.py --format ndjson --user-id 1 --user-id 2 --out -
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+import zlib
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+import database
+import retention
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+# format -> (media type, file suffix)
+FORMATS = {
+    "csv": ("application/gzip", ".csv.gz"),
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "npz": ("application/zip", ".npz"),
+}
+ARCHIVED_LOG_TYPES = ("cgm", "mood")   # the log types retention.py compacts
+
+_INTEGER_COLUMNS = ("log_id", "user_id")
+_FLOAT_COLUMNS = ("glucose_mg_dl", "mood_score", *database.LOG_MACRO_COLUMNS)
+
+
+def _user_ids(conn, user_ids: Optional[Sequence[int]], condition: Optional[str],
+              page_size: int = 1000) -> Iterator[int]:
+    """The users to export, in ID order, paged with a keyset so the list is never held."""
+    if condition is None:
+        if user_ids is not None:
+            yield from sorted(set(user_ids))
+            return
+        sql, filter_params = "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", []
+    else:
+        # the user_conditions index lists a condition's users in ID order
+        sql = ("SELECT user_id FROM user_conditions WHERE condition = ? AND user_id > ? "
+               "ORDER BY user_id LIMIT ?")
+        filter_params = [condition.strip()]
+    wanted = set(user_ids) if user_ids is not None else None
+    last_id = -1
+    while True:
+        page = [row[0] for row in conn.execute(sql, [*filter_params, last_id, page_size])]
+        if not page:
+            return
+        yield from (user_id for user_id in page if wanted is None or user_id in wanted)
+        last_id = page[-1]
+
+
+def _logs_query(log_types: Optional[Sequence[str]], start: Optional[str], end: Optional[str]) -> tuple:
+    """(sql, params after user_id) selecting one user's logs oldest first, in index order."""
+    clauses = ["user_id = ?"]
+    params: list = []
+    if log_types:
+        clauses.append(f"log_type IN ({', '.join('?' * len(log_types))})")
+        params.extend(log_types)
+    if start:
+        clauses.append("timestamp >= ?")
+        params.append(database._normalize_timestamp(start))
+    if end:
+        clauses.append("timestamp < ?")
+        params.append(database._normalize_timestamp(end))
+    sql = f"""
+        SELECT {", ".join(database.LOG_COLUMNS)}
+        FROM logs
+        WHERE {" AND ".join(clauses)}
+        ORDER BY timestamp, log_id
+    """
+    return sql, params
+
+
+def iter_log_chunks(user_ids: Optional[Sequence[int]] = None, log_types: Optional[Sequence[str]] = None,
+                    start: Optional[str] = None, end: Optional[str] = None, condition: Optional[str] = None,
+                    include_archive: bool = True, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[List[tuple]]:
+    """
+    Yields the matching logs as lists of at most chunk_rows tuples (database.LOG_COLUMNS
+    order), user by user, each user's rows oldest first.
+    """
+    database.flush_logs()
+    archived_types = [t for t in (log_types or ARCHIVED_LOG_TYPES) if t in ARCHIVED_LOG_TYPES]
+    type_at = database.LOG_COLUMNS.index("log_type")
+    sql, params = _logs_query(log_types, start, end)
+    conn = database._open_connection()
+    try:
+        conn.execute("BEGIN")   # one snapshot for every query below; a read transaction takes no write lock
+        chunk: List[tuple] = []
+        for user_id in _user_ids(conn, user_ids, condition):
+            if include_archive and archived_types:
+                # the segment catalogue is read in the same snapshot, so rows compacted
+                # meanwhile come either from logs or from a segment, never both or neither
+                for row in retention.iter_archived_rows(
+                        user_id, archived_types[0] if len(archived_types) == 1 else None, start, end, conn):
+                    if row[type_at] in archived_types:
+                        chunk.append(row)
+                        if len(chunk) >= chunk_rows:
+                            yield chunk
+                            chunk = []
+            cursor = conn.execute(sql, [user_id, *params])
+            while True:
+                rows = cursor.fetchmany(chunk_rows - len(chunk))
+                if not rows:
+                    break
+                chunk.extend(rows)
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+# --- Encoders: chunks of rows in, bytes out ---
+
+def encode_csv(chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+    """Gzip-compressed CSV, header first; NULLs are empty fields."""
+    compressor = zlib.compressobj(wbits=31)   # 31 = gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(database.LOG_COLUMNS)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield compressor.compress(buffer.getvalue().encode())
+        buffer.seek(0)
+        buffer.truncate()
+    yield compressor.compress(buffer.getvalue().encode()) + compressor.flush()
+
+
+def encode_ndjson(chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+    """One JSON object per log, keyed by database.LOG_COLUMNS."""
+    for chunk in chunks:
+        yield "".join(json.dumps(dict(zip(database.LOG_COLUMNS, row))) + "\n" for row in chunk).encode()
+
+
+class _ByteSink(io.RawIOBase):
+    """Write-only, unseekable stream that collects what ZipFile writes until drained."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _column_arrays(chunk: List[tuple]) -> Dict[str, np.ndarray]:
+    """A chunk of rows as typed column arrays: int64 IDs, float64 readings (NaN = NULL), text."""
+    arrays = {}
+    for column, values in zip(database.LOG_COLUMNS, zip(*chunk)):
+        if column in _INTEGER_COLUMNS:
+            arrays[column] = np.array(values, dtype=np.int64)
+        elif column in _FLOAT_COLUMNS:
+            arrays[column] = np.array(values, dtype=np.float64)   # None becomes NaN
+        else:
+            arrays[column] = np.array(["" if v is None else str(v) for v in values], dtype=str)
+    return arrays
+
+
+def encode_npz(chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+    """Deflated ZIP of <column>/<chunk>.npy arrays, written as a stream (no seeking back)."""
+    sink = _ByteSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for index, chunk in enumerate(chunks):
+            for column, values in _column_arrays(chunk).items():
+                with archive.open(f"{column}/{index:06d}.npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array(f, values, allow_pickle=False)
+            yield sink.drain()
+    yield sink.drain()
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson, "npz": encode_npz}
+
+
+def export_logs(format: str = "csv", **filters) -> Iterator[bytes]:
+    """The encoded export of iter_log_chunks(**filters), as a stream of byte chunks."""
+    if format not in ENCODERS:
+        raise ValueError(f"Unknown export format: {format!r}")
+    return ENCODERS[format](iter_log_chunks(**filters))
+
+
+def load_npz_export(path: str) -> Dict[str, np.ndarray]:
+    """Reads an npz export back into one array per column."""
+    parts: Dict[str, List[np.ndarray]] = {}
+    with np.load(path) as archive:
+        for name in sorted(archive.files):
+            column, _ = name.split("/", 1)
+            parts.setdefault(column, []).append(archive[name])
+    return {column: np.concatenate(arrays) for column, arrays in parts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export user logs as gzip CSV, NDJSON or columnar npz")
+    parser.add_argument("--db", help="database file (default: DB_PATH or agents/users.db)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--out", help="output file, - for stdout (default: logs<suffix>)")
+    parser.add_argument("--user-id", type=int, action="append", dest="user_ids", help="repeatable; default all users")
+    parser.add_argument("--log-type", action="append", dest="log_types", help="repeatable: cgm, mood, food")
+    parser.add_argument("--start", help="ISO-8601 start of the time range (inclusive)")
+    parser.add_argument("--end", help="ISO-8601 end of the time range (exclusive)")
+    parser.add_argument("--condition", help="only users with this medical condition (case-insensitive)")
+    parser.add_argument("--no-archive", action="store_true", help="skip rows compacted by retention.py")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    database.init_schema()
+    out = args.out or f"logs{FORMATS[args.format][1]}"
+    started = time.perf_counter()
+    size = 0
+    stream = export_logs(args.format, user_ids=args.user_ids, log_types=args.log_types, start=args.start,
+                         end=args.end, condition=args.condition, include_archive=not args.no_archive,
+                         chunk_rows=args.chunk_rows)
+    with (open(out, "wb") if out != "-" else open(sys.stdout.fileno(), "wb", closefd=False)) as f:
+        for data in stream:
+            f.write(data)
+            size += len(data)
+    if out != "-":
+        print(f"Exported {size:,} bytes to {out} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Table-driven meal plan engine.
+
+A plan is fully determined by a handful of small buckets (diet, CGM strategy,
+mood adjustment, glucose tips) plus a few echoed profile fields. The plan body
+for every bucket combination is rendered once at import, so producing a plan is
+one dict lookup plus a header format, and rendered plans are memoised.
+"""
+
+import itertools
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import database
+
+# --- Plan Tables ---
+
+STRATEGIES = {
+    "low": "LOW_GLUCOSE - Focus on balanced meals with complex carbs to raise blood sugar gradually",
+    "high": "HIGH_GLUCOSE - Focus on low-carb, high-protein meals to lower blood sugar",
+    "elevated": "ELEVATED_GLUCOSE - Focus on moderate-carb meals with fiber to stabilize blood sugar",
+    "normal": "NORMAL_GLUCOSE - Maintain balanced nutrition with regular meal timing",
+    "balanced": "BALANCED - Provide general healthy meal plan",
+}
+
+# (breakfast, lunch, dinner), each as (dish, macros)
+DIET_MEALS = {
+    "vegetarian": (
+        ("Oats with almond milk + berries + nuts", "Carbs: 35g | Protein: 12g | Fat: 8g"),
+        ("Brown rice + dal + mixed vegetables + yogurt", "Carbs: 45g | Protein: 18g | Fat: 6g"),
+        ("Ragi dosa + sambar + coconut chutney", "Carbs: 30g | Protein: 15g | Fat: 10g"),
+    ),
+    "vegan": (
+        ("Quinoa porridge with coconut milk + fruits", "Carbs: 40g | Protein: 10g | Fat: 12g"),
+        ("Buddha bowl with chickpeas + quinoa + vegetables", "Carbs: 50g | Protein: 20g | Fat: 8g"),
+        ("Lentil curry + brown rice + steamed vegetables", "Carbs: 35g | Protein: 18g | Fat: 6g"),
+    ),
+    "non-vegetarian": (
+        ("Scrambled eggs + whole grain toast + avocado", "Carbs: 25g | Protein: 20g | Fat: 15g"),
+        ("Grilled chicken + quinoa + roasted vegetables", "Carbs: 30g | Protein: 35g | Fat: 12g"),
+        ("Baked fish + sweet potato + green salad", "Carbs: 25g | Protein: 30g | Fat: 10g"),
+    ),
+}
+
+MEAL_SLOTS = ("🌅 BREAKFAST (7-8 AM):", "🌞 LUNCH (12-1 PM):", "🌙 DINNER (7-8 PM):")
+
+MOOD_ADJUSTMENTS = {
+    None: "",
+    "energize": " Include energizing foods rich in iron and B vitamins.",
+    "calm": " Include calming foods like magnesium-rich options and omega-3s.",
+    "maintain": " Maintain the positive energy with balanced, nutritious meals.",
+}
+
+GLUCOSE_TIPS = {
+    None: (),
+    "high": ("Focus on low-carb, high-fiber foods", "Include protein with every meal", "Stay hydrated with water"),
+    "low": ("Include complex carbohydrates", "Eat regular meals and snacks", "Monitor glucose levels closely"),
+}
+
+SNACKS = ("Nuts and seeds (10-15 pieces)", "Greek yogurt with berries", "Vegetable sticks with hummus")
+TIMING = ("Eat every 3-4 hours", "Don't skip meals", "Finish dinner 2-3 hours before bedtime")
+
+HEADER_TEMPLATE = (
+    "🍽️ PERSONALIZED MEAL PLAN for {first_name}\n\n"
+    "📊 Health Status: {strategy}\n"
+    "🥗 Diet: {diet}\n"
+    "🩺 Conditions: {conditions}\n"
+    "📈 Latest Glucose: {glucose} mg/dL\n"
+    "😊 Current Mood: {mood}\n\n"
+)
+
+
+# --- Buckets ---
+
+def diet_bucket(dietary_preference: str) -> str:
+    diet = dietary_preference.lower()
+    return diet if diet in ("vegetarian", "vegan") else "non-vegetarian"
+
+
+def strategy_bucket(latest_cgm: Optional[int]) -> str:
+    if not latest_cgm:
+        return "balanced"
+    if latest_cgm < 80:
+        return "low"
+    if latest_cgm > 200:
+        return "high"
+    if latest_cgm > 150:
+        return "elevated"
+    return "normal"
+
+
+def mood_bucket(latest_mood: Optional[str]) -> Optional[str]:
+    mood = (latest_mood or "").lower()
+    if "tired" in mood or "fatigue" in mood:
+        return "energize"
+    if "stressed" in mood or "anxious" in mood:
+        return "calm"
+    if "happy" in mood or "energetic" in mood:
+        return "maintain"
+    return None
+
+
+def tips_bucket(latest_cgm: Optional[int]) -> Optional[str]:
+    if latest_cgm and latest_cgm > 150:
+        return "high"
+    if latest_cgm and latest_cgm < 80:
+        return "low"
+    return None
+
+
+# --- Precompiled Bodies ---
+
+def _bullets(items: Iterable[str]) -> str:
+    return "".join(f"• {item}\n" for item in items)
+
+
+def _render_body(diet: str, mood: Optional[str], tips: Optional[str]) -> str:
+    parts = []
+    for slot, (dish, macros) in zip(MEAL_SLOTS, DIET_MEALS[diet]):
+        parts.append(f"{slot}\n{_bullets((dish, macros))}\n")
+    if MOOD_ADJUSTMENTS[mood]:
+        parts.append(f"💡 Mood-Based Adjustments:{MOOD_ADJUSTMENTS[mood]}\n\n")
+    if GLUCOSE_TIPS[tips]:
+        parts.append(f"Glucose Management Tips:\n{_bullets(GLUCOSE_TIPS[tips])}\n")
+    parts.append(f" SNACK SUGGESTIONS:\n{_bullets(SNACKS)}\n")
+    parts.append(f"⏰ TIMING RECOMMENDATIONS:\n{_bullets(TIMING)}".rstrip("\n"))
+    return "".join(parts)
+
+
+PLAN_BODIES: Dict[Tuple[str, Optional[str], Optional[str]], str] = {
+    key: _render_body(*key)
+    for key in itertools.product(DIET_MEALS, MOOD_ADJUSTMENTS, GLUCOSE_TIPS)
+}
+
+
+# --- Rendering ---
+
+@lru_cache(maxsize=4096)
+def render_meal_plan(first_name: str, dietary_preference: str, medical_conditions: str,
+                     latest_cgm: Optional[int] = None, latest_mood: Optional[str] = None) -> str:
+    """Renders the adaptive 3-meal plan for one user's current state."""
+    header = HEADER_TEMPLATE.format(
+        first_name=first_name,
+        strategy=STRATEGIES[strategy_bucket(latest_cgm)],
+        diet=dietary_preference,
+        conditions=medical_conditions,
+        glucose=latest_cgm if latest_cgm else "Not available",
+        mood=latest_mood if latest_mood else "Not available",
+    )
+    body = PLAN_BODIES[(diet_bucket(dietary_preference), mood_bucket(latest_mood), tips_bucket(latest_cgm))]
+    return header + body
+
+
+def iter_meal_plans(user_ids: Optional[List[int]] = None, chunk_size: int = 500) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (user_id, plan) for the given users, or for every user when user_ids is
+    None, using each user's profile and latest CGM/mood logs. Profiles and latest
+    readings are fetched a chunk at a time, so a whole-cohort run costs a few
+    queries per chunk_size users rather than several per user.
+    """
+    for chunk in database.iter_user_id_chunks(user_ids, chunk_size):
+        profiles = database.get_user_profiles(chunk)
+        latest = database.get_latest_readings(chunk)
+        for user_id in chunk:
+            profile = profiles.get(user_id)
+            if profile is None:
+                continue
+            latest_cgm, latest_mood = latest.get(user_id, (None, None))
+            yield user_id, render_meal_plan(
+                profile["first_name"], profile["dietary_preference"], profile["medical_conditions"],
+                int(latest_cgm) if latest_cgm is not None else None, latest_mood,
+            )
+
+
+def generate_meal_plans(user_ids: Optional[List[int]] = None) -> Dict[int, str]:
+    """Bulk API: returns {user_id: plan} for the given users (or all users)."""
+    return dict(iter_meal_plans(user_ids))
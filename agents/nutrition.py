@@ -0,0 +1,461 @@
+"""
+Local nutrient database and fuzzy food index for macro estimation.
+
+The foods table (seeded from FOODS by schema migration 5) holds carbs, protein,
+fat and kcal per 100 g, plus a typical serving. It is loaded once per process
+into FoodIndex, an in-memory index with two levels:
+- a token index: normalised word -> food names/aliases that contain it
+- a character-trigram index over that vocabulary, so misspelt words
+  ("brocoli", "chiken") still find their food
+
+A meal description is split into items ("2 eggs, toast and a cup of rice").
+Each item's portion is parsed (count, fraction or number word, plus a unit such
+as g, oz, cup, tbsp or slice). Its remaining words are then matched greedily
+against the index. Matching is pure Python over small dicts, so a description
+takes microseconds. Items that match nothing are returned as unmatched, and
+only those are left for the LLM to estimate.
+"""
+
+import re
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import database
+
+# (name, aliases, serving grams, serving unit, carbs, protein, fat per 100 g, kcal per 100 g)
+# Approximate values for cooked/ready-to-eat foods, after USDA FoodData Central and IFCT.
+FOODS: Sequence[Tuple[str, str, float, str, float, float, float, float]] = (
+    # Grains, breads and breakfast
+    ("oats", "oatmeal|porridge|rolled oats", 234, "bowl", 12.0, 2.5, 1.5, 71),
+    ("quinoa", "", 185, "cup", 21.3, 4.4, 1.9, 120),
+    ("quinoa porridge", "", 250, "bowl", 18.0, 4.0, 3.5, 120),
+    ("white rice", "rice|steamed rice|plain rice", 158, "cup", 28.2, 2.7, 0.3, 130),
+    ("brown rice", "", 195, "cup", 23.0, 2.6, 0.9, 112),
+    ("biryani", "chicken biryani|veg biryani", 250, "plate", 24.0, 7.0, 6.5, 185),
+    ("fried rice", "", 200, "cup", 31.0, 4.5, 5.0, 186),
+    ("pasta", "spaghetti|penne|macaroni|noodles", 140, "cup", 30.9, 5.8, 0.9, 158),
+    ("whole grain toast", "whole wheat toast|wholemeal toast|whole grain bread|whole wheat bread|brown bread", 32, "slice", 41.0, 13.0, 3.4, 247),
+    ("toast", "white bread|bread|white toast", 30, "slice", 49.0, 9.0, 3.2, 265),
+    ("bagel", "", 100, "piece", 53.0, 10.0, 1.7, 270),
+    ("tortilla", "wrap", 45, "piece", 50.0, 8.0, 7.0, 300),
+    ("chapati", "roti|phulka", 40, "piece", 46.0, 11.0, 7.5, 297),
+    ("naan", "", 90, "piece", 50.0, 9.0, 5.5, 290),
+    ("paratha", "", 80, "piece", 45.0, 6.5, 13.0, 320),
+    ("dosa", "plain dosa|masala dosa", 120, "piece", 29.0, 4.0, 5.5, 168),
+    ("ragi dosa", "finger millet dosa", 100, "piece", 27.0, 4.0, 4.5, 160),
+    ("idli", "idly", 40, "piece", 24.0, 3.9, 0.4, 116),
+    ("upma", "", 200, "bowl", 19.0, 3.0, 4.5, 130),
+    ("poha", "", 200, "bowl", 23.0, 2.8, 4.0, 140),
+    ("cereal", "corn flakes|cornflakes", 30, "cup", 84.0, 7.5, 0.9, 357),
+    ("granola", "muesli", 60, "cup", 64.0, 10.0, 20.0, 470),
+    ("pancake", "pancakes|hotcake", 75, "piece", 28.0, 6.0, 10.0, 227),
+    ("waffle", "", 75, "piece", 33.0, 7.9, 14.0, 291),
+    ("crackers", "cracker", 30, "serving", 70.0, 9.0, 13.0, 430),
+    # Eggs, meat, fish and plant proteins
+    ("egg", "eggs|boiled egg|hard boiled egg|poached egg", 50, "piece", 1.1, 12.6, 9.5, 143),
+    ("scrambled eggs", "scrambled egg", 100, "serving", 1.6, 10.0, 11.0, 149),
+    ("omelette", "omelet", 120, "piece", 0.6, 11.0, 12.0, 154),
+    ("egg white", "egg whites", 33, "piece", 0.7, 10.9, 0.2, 52),
+    ("grilled chicken", "chicken breast|chicken|roast chicken|baked chicken", 120, "serving", 0.0, 31.0, 3.6, 165),
+    ("fried chicken", "", 150, "serving", 9.0, 24.0, 16.0, 280),
+    ("chicken curry", "butter chicken", 250, "bowl", 5.0, 13.0, 9.0, 150),
+    ("beef", "steak|ground beef|beef steak", 120, "serving", 0.0, 26.0, 15.0, 250),
+    ("pork", "pork chop", 120, "serving", 0.0, 27.0, 14.0, 242),
+    ("bacon", "", 8, "slice", 1.4, 37.0, 42.0, 541),
+    ("sausage", "sausages", 50, "piece", 2.0, 13.0, 27.0, 301),
+    ("ham", "", 28, "slice", 1.5, 21.0, 6.0, 145),
+    ("baked fish", "fish|grilled fish|white fish|cod|tilapia", 150, "serving", 0.0, 22.0, 2.5, 120),
+    ("salmon", "grilled salmon|baked salmon", 150, "serving", 0.0, 25.0, 12.0, 208),
+    ("tuna", "canned tuna|tuna salad", 100, "serving", 0.0, 26.0, 1.0, 116),
+    ("shrimp", "prawns|prawn", 100, "serving", 0.2, 24.0, 0.3, 99),
+    ("tofu", "", 100, "serving", 1.9, 8.0, 4.8, 76),
+    ("paneer", "cottage cheese", 100, "serving", 3.6, 18.0, 20.0, 265),
+    ("dal", "daal|dhal|lentils|lentil soup", 200, "bowl", 14.0, 6.5, 2.0, 100),
+    ("lentil curry", "", 250, "bowl", 13.0, 6.0, 3.5, 105),
+    ("sambar", "sambhar", 200, "bowl", 9.0, 3.0, 2.0, 65),
+    ("chickpeas", "chickpea|chana|garbanzo beans", 164, "cup", 27.4, 8.9, 2.6, 164),
+    ("chana masala", "chole", 250, "bowl", 17.0, 6.0, 5.5, 140),
+    ("rajma", "kidney beans|beans|black beans", 177, "cup", 22.8, 8.7, 0.5, 127),
+    ("hummus", "", 30, "tbsp", 14.0, 7.9, 9.6, 166),
+    # Dairy and alternatives
+    ("milk", "whole milk|cow milk", 244, "cup", 4.8, 3.2, 3.3, 61),
+    ("almond milk", "", 240, "cup", 0.6, 0.4, 1.1, 15),
+    ("soy milk", "", 240, "cup", 2.5, 3.3, 1.8, 43),
+    ("coconut milk", "", 240, "cup", 2.7, 0.2, 2.1, 31),
+    ("yogurt", "curd|plain yogurt|dahi|raita", 170, "cup", 4.7, 3.5, 3.3, 61),
+    ("greek yogurt", "", 170, "cup", 3.6, 10.0, 0.4, 59),
+    ("cheese", "cheddar|cheese slice", 28, "slice", 1.3, 25.0, 33.0, 403),
+    ("butter", "ghee", 14, "tbsp", 0.1, 0.9, 81.0, 717),
+    ("ice cream", "", 66, "scoop", 24.0, 3.5, 11.0, 207),
+    # Vegetables
+    ("mixed vegetables", "vegetables|veggies|sabzi|vegetable curry|stir fry vegetables", 150, "cup", 9.0, 2.5, 2.0, 65),
+    ("steamed vegetables", "steamed veggies|boiled vegetables", 150, "cup", 8.0, 2.5, 0.3, 45),
+    ("roasted vegetables", "roasted veggies|grilled vegetables", 150, "cup", 10.0, 2.0, 4.5, 85),
+    ("vegetable sticks", "veggie sticks|carrot sticks|crudites", 100, "serving", 7.0, 1.0, 0.2, 33),
+    ("green salad", "salad|garden salad|side salad", 100, "bowl", 3.5, 1.3, 0.2, 17),
+    ("potato", "potatoes|boiled potato|baked potato", 173, "piece", 21.0, 2.5, 0.1, 93),
+    ("mashed potatoes", "mashed potato", 210, "cup", 17.0, 1.9, 4.2, 113),
+    ("french fries", "fries|chips", 117, "serving", 41.0, 3.4, 15.0, 312),
+    ("sweet potato", "sweet potatoes|yam", 150, "piece", 20.7, 2.0, 0.2, 90),
+    ("corn", "sweet corn|corn on the cob", 150, "cup", 21.0, 3.4, 1.5, 96),
+    ("broccoli", "", 91, "cup", 7.2, 2.4, 0.4, 35),
+    ("spinach", "palak", 180, "cup", 3.8, 3.0, 0.3, 23),
+    ("carrot", "carrots", 61, "piece", 8.2, 0.8, 0.2, 35),
+    ("tomato", "tomatoes", 123, "piece", 3.9, 0.9, 0.2, 18),
+    ("cucumber", "", 150, "piece", 3.6, 0.7, 0.1, 15),
+    ("mushrooms", "mushroom", 156, "cup", 5.3, 2.2, 0.5, 28),
+    ("avocado", "", 150, "piece", 8.5, 2.0, 14.7, 160),
+    ("vegetable soup", "soup|veg soup|tomato soup", 245, "bowl", 6.0, 1.3, 0.8, 35),
+    ("chicken soup", "chicken noodle soup", 245, "bowl", 3.5, 3.0, 1.2, 36),
+    # Fruit
+    ("apple", "apples", 182, "piece", 13.8, 0.3, 0.2, 52),
+    ("banana", "bananas", 118, "piece", 22.8, 1.1, 0.3, 89),
+    ("orange", "oranges", 131, "piece", 11.8, 0.9, 0.1, 47),
+    ("mango", "mangoes", 165, "cup", 15.0, 0.8, 0.4, 60),
+    ("grapes", "grape", 151, "cup", 18.1, 0.7, 0.2, 69),
+    ("pear", "pears", 178, "piece", 15.2, 0.4, 0.1, 57),
+    ("peach", "peaches", 150, "piece", 9.5, 0.9, 0.3, 39),
+    ("pineapple", "", 165, "cup", 13.1, 0.5, 0.1, 50),
+    ("watermelon", "", 280, "cup", 7.6, 0.6, 0.2, 30),
+    ("papaya", "", 145, "cup", 10.8, 0.5, 0.3, 43),
+    ("kiwi", "kiwis", 69, "piece", 14.7, 1.1, 0.5, 61),
+    ("berries", "mixed berries|berry", 148, "cup", 12.0, 0.8, 0.4, 50),
+    ("strawberries", "strawberry", 152, "cup", 7.7, 0.7, 0.3, 32),
+    ("blueberries", "blueberry", 148, "cup", 14.5, 0.7, 0.3, 57),
+    ("fruits", "fruit|fruit salad|mixed fruit", 150, "cup", 13.0, 0.6, 0.2, 55),
+    ("dates", "date", 24, "piece", 75.0, 2.5, 0.4, 282),
+    ("raisins", "", 40, "serving", 79.0, 3.1, 0.5, 299),
+    # Nuts, seeds and spreads
+    ("nuts", "mixed nuts", 30, "handful", 21.0, 20.0, 54.0, 607),
+    ("almonds", "almond", 28, "handful", 21.6, 21.2, 49.9, 579),
+    ("walnuts", "walnut", 28, "handful", 13.7, 15.2, 65.2, 654),
+    ("cashews", "cashew", 28, "handful", 30.2, 18.2, 43.9, 553),
+    ("peanuts", "peanut", 28, "handful", 16.1, 25.8, 49.2, 567),
+    ("seeds", "mixed seeds|chia seeds|flax seeds|pumpkin seeds|sunflower seeds", 15, "tbsp", 24.0, 21.0, 45.0, 560),
+    ("peanut butter", "", 16, "tbsp", 20.0, 25.0, 50.0, 588),
+    ("coconut chutney", "chutney", 30, "tbsp", 9.0, 2.5, 22.0, 240),
+    ("honey", "", 21, "tbsp", 82.0, 0.3, 0.0, 304),
+    ("jam", "jelly", 20, "tbsp", 69.0, 0.4, 0.1, 278),
+    ("sugar", "", 4, "tsp", 100.0, 0.0, 0.0, 387),
+    # Prepared dishes, snacks and drinks
+    ("buddha bowl", "grain bowl|power bowl", 400, "bowl", 16.0, 5.0, 4.0, 120),
+    ("sandwich", "sandwiches|sub", 150, "piece", 28.0, 11.0, 9.0, 240),
+    ("burger", "hamburger|cheeseburger", 200, "piece", 24.0, 14.0, 13.0, 265),
+    ("pizza", "pizza slice", 107, "slice", 33.0, 11.0, 10.0, 266),
+    ("burrito", "", 220, "piece", 26.0, 8.5, 7.0, 206),
+    ("samosa", "samosas", 60, "piece", 32.0, 5.0, 17.0, 308),
+    ("popcorn", "", 25, "cup", 78.0, 12.0, 4.5, 387),
+    ("potato chips", "crisps", 28, "serving", 53.0, 7.0, 34.0, 536),
+    ("cookie", "cookies|biscuit|biscuits", 15, "piece", 66.0, 5.0, 22.0, 488),
+    ("cake", "", 80, "slice", 53.0, 4.0, 15.0, 360),
+    ("chocolate", "dark chocolate|chocolate bar", 40, "piece", 46.0, 7.8, 43.0, 598),
+    ("protein bar", "", 60, "piece", 40.0, 33.0, 13.0, 380),
+    ("protein shake", "whey shake|whey protein", 300, "cup", 3.0, 8.0, 1.0, 55),
+    ("smoothie", "fruit smoothie", 300, "cup", 14.0, 1.5, 0.5, 65),
+    ("orange juice", "juice|apple juice", 248, "cup", 10.4, 0.7, 0.2, 45),
+    ("soda", "cola|soft drink|coke", 355, "can", 10.6, 0.0, 0.0, 41),
+    ("coffee", "black coffee|americano|espresso", 240, "cup", 0.0, 0.1, 0.0, 1),
+    ("latte", "cappuccino|coffee with milk", 240, "cup", 5.0, 3.4, 3.2, 60),
+    ("tea", "green tea|black tea", 240, "cup", 0.3, 0.0, 0.0, 1),
+    ("chai", "masala chai|milk tea|tea with milk", 240, "cup", 8.0, 1.8, 2.0, 56),
+)
+
+MATCH_THRESHOLD = 0.6          # minimum F1 between an item's words and a food name
+FUZZY_THRESHOLD = 0.4          # minimum trigram Jaccard similarity for a misspelt word
+
+# Mass/volume units in grams (millilitres taken as grams); count units use the food's serving
+UNIT_GRAMS = {
+    "g": 1, "gm": 1, "gram": 1, "kg": 1000, "kilogram": 1000, "oz": 28.35, "ounce": 28.35,
+    "lb": 453.6, "pound": 453.6, "ml": 1, "l": 1000, "liter": 1000, "litre": 1000,
+    "tbsp": 15, "tablespoon": 15, "tsp": 5, "teaspoon": 5, "cup": 240, "glass": 250, "can": 355, "scoop": 66,
+}
+COUNT_UNITS = {"slice", "piece", "bowl", "plate", "serving", "portion", "handful", "helping"}
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "dozen": 12, "couple": 2, "few": 3,
+    "half": 0.5, "quarter": 0.25, "some": 1, "single": 1, "double": 2,
+}
+SIZE_WORDS = {"small": 0.7, "medium": 1.0, "large": 1.4, "big": 1.4, "huge": 1.8}
+STOPWORDS = {
+    "i", "im", "ive", "had", "have", "ate", "eaten", "eat", "just", "my", "the", "of", "for", "some",
+    "breakfast", "lunch", "dinner", "snack", "meal", "today", "this", "morning", "tonight", "evening",
+    "at", "on", "in", "to", "was", "it", "also", "then", "fresh", "homemade", "little", "bit",
+}
+
+_ITEM_SPLIT = re.compile(r"\s*(?:,|;|\+|&|\band\b|\bwith\b|\bplus\b|\bthen\b)\s*", re.IGNORECASE)
+_PARENS = re.compile(r"\([^)]*\)")
+_TOKEN = re.compile(r"\d+(?:\.\d+)?(?:/\d+)?|[a-z]+")
+
+
+def normalize_token(word: str) -> str:
+    """Lower-case singular-ish form used for both the index and queries."""
+    word = word.lower()
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("oes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def _trigrams(word: str) -> frozenset:
+    padded = f" {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+@dataclass
+class Food:
+    food_id: int
+    name: str
+    serving_g: float
+    serving_unit: str
+    carbs: float          # per 100 g
+    protein: float
+    fat: float
+    kcal: float
+
+
+@dataclass
+class MatchedItem:
+    text: str
+    food: str
+    grams: float
+    carbs_g: float
+    protein_g: float
+    fat_g: float
+    kcal: float
+    score: float
+
+
+@dataclass
+class MacroEstimate:
+    items: List[MatchedItem] = field(default_factory=list)
+    unmatched: List[str] = field(default_factory=list)
+
+    def totals(self) -> Optional[Tuple[float, float, float, float]]:
+        """(carbs_g, protein_g, fat_g, kcal) over matched items, or None if nothing matched."""
+        if not self.items:
+            return None
+        return (
+            round(sum(i.carbs_g for i in self.items), 1),
+            round(sum(i.protein_g for i in self.items), 1),
+            round(sum(i.fat_g for i in self.items), 1),
+            round(sum(i.kcal for i in self.items)),
+        )
+
+    def to_dict(self) -> Dict:
+        totals = self.totals()
+        return {
+            "items": [vars(item) for item in self.items],
+            "unmatched": self.unmatched,
+            "totals": dict(zip(("carbs_g", "protein_g", "fat_g", "kcal"), totals)) if totals else None,
+        }
+
+
+class FoodIndex:
+    """Token and trigram index over food names and aliases."""
+
+    def __init__(self, foods: Iterable[Tuple[Food, List[str]]]):
+        self.foods: List[Food] = []
+        self.variants: List[Tuple[int, frozenset]] = []       # (food index, name tokens)
+        self.by_token: Dict[str, List[int]] = {}              # token -> variant indexes
+        self.by_trigram: Dict[str, set] = {}                  # trigram -> tokens
+        for food, names in foods:
+            self.foods.append(food)
+            for name in names:
+                tokens = frozenset(normalize_token(t) for t in _TOKEN.findall(name.lower()))
+                if not tokens:
+                    continue
+                self.variants.append((len(self.foods) - 1, tokens))
+                for token in tokens:
+                    self.by_token.setdefault(token, []).append(len(self.variants) - 1)
+        for token in self.by_token:
+            for gram in _trigrams(token):
+                self.by_trigram.setdefault(gram, set()).add(token)
+        self._fuzzy_cache: Dict[str, Optional[Tuple[str, float]]] = {}
+
+    def resolve(self, word: str) -> Optional[Tuple[str, float]]:
+        """The indexed token for a query word and its similarity (1.0 when exact)."""
+        if word in self.by_token:
+            return word, 1.0
+        if word in self._fuzzy_cache:
+            return self._fuzzy_cache[word]
+        grams = _trigrams(word)
+        counts: Dict[str, int] = {}
+        for gram in grams:
+            for token in self.by_trigram.get(gram, ()):
+                counts[token] = counts.get(token, 0) + 1
+        best = None
+        for token, shared in counts.items():
+            similarity = shared / (len(grams) + len(_trigrams(token)) - shared)
+            if similarity >= FUZZY_THRESHOLD and (best is None or similarity > best[1]):
+                best = (token, similarity)
+        self._fuzzy_cache[word] = best
+        return best
+
+    def best_match(self, words: List[str]) -> Optional[Tuple[int, float, set]]:
+        """(food index, score, matched query words) for the best food among `words`."""
+        resolved = {}
+        for word in words:
+            hit = self.resolve(word)
+            if hit is not None:
+                resolved[word] = hit
+        if not resolved:
+            return None
+        candidates = {v for token, _ in resolved.values() for v in self.by_token[token]}
+        best = None
+        for v in candidates:
+            food_index, tokens = self.variants[v]
+            matched = {w for w, (token, _) in resolved.items() if token in tokens}
+            weight = sum(resolved[w][1] for w in matched)
+            precision = weight / len(tokens)
+            recall = weight / len(words)
+            score = 2 * precision * recall / (precision + recall)
+            # prefer the higher score, then the more specific name ("greek yogurt" over "yogurt")
+            key = (round(score, 6), len(tokens))
+            if best is None or key > best[0]:
+                best = (key, food_index, score, matched)
+        _, food_index, score, matched = best
+        return food_index, score, matched
+
+
+def parse_portion(words: List[str]) -> Tuple[float, Optional[str], List[str]]:
+    """Splits an item's words into (quantity, unit, remaining words)."""
+    quantity, unit, rest = None, None, []
+    for word in words:
+        if re.fullmatch(r"\d+(?:\.\d+)?", word):
+            value = float(word)
+            quantity = value if quantity is None or quantity >= 1 else quantity + value
+        elif re.fullmatch(r"\d+/\d+", word):
+            num, den = word.split("/")
+            value = float(num) / float(den) if float(den) else 1.0
+            quantity = value if quantity is None else quantity + value
+        elif word in NUMBER_WORDS and unit is None and not rest:
+            value = NUMBER_WORDS[word]
+            quantity = value if quantity is None else quantity * value
+        elif word in SIZE_WORDS:
+            quantity = (quantity or 1) * SIZE_WORDS[word]
+        elif unit is None and (normalize_token(word) in UNIT_GRAMS or normalize_token(word) in COUNT_UNITS
+                               or word in UNIT_GRAMS):
+            unit = word if word in UNIT_GRAMS else normalize_token(word)
+        else:
+            rest.append(word)
+    return quantity if quantity is not None else 1.0, unit, rest
+
+
+def portion_grams(food: Food, quantity: float, unit: Optional[str]) -> float:
+    if unit is None or unit in COUNT_UNITS or unit == food.serving_unit:
+        return quantity * food.serving_g
+    return quantity * UNIT_GRAMS[unit]
+
+
+def split_items(description: str) -> List[str]:
+    text = _PARENS.sub(" ", description)
+    return [item for item in _ITEM_SPLIT.split(text) if item and item.strip()]
+
+
+def estimate(description: str, index: Optional["FoodIndex"] = None) -> MacroEstimate:
+    """Matches every item of a meal description against the food index."""
+    index = index or get_index()
+    result = MacroEstimate()
+    for item in split_items(description):
+        words = [w for w in _TOKEN.findall(item.lower()) if w not in STOPWORDS]
+        quantity, unit, rest = parse_portion(words)
+        rest = [normalize_token(w) for w in rest]
+        matched_any = False
+        # Greedy: an item such as "chicken rice" can name more than one food
+        while rest:
+            match = index.best_match(rest)
+            if match is None or match[1] < MATCH_THRESHOLD:
+                break
+            food_index, score, used = match
+            food = index.foods[food_index]
+            grams = portion_grams(food, quantity, unit)
+            result.items.append(MatchedItem(
+                text=item.strip(), food=food.name, grams=round(grams),
+                carbs_g=round(food.carbs * grams / 100, 1), protein_g=round(food.protein * grams / 100, 1),
+                fat_g=round(food.fat * grams / 100, 1), kcal=round(food.kcal * grams / 100),
+                score=round(score, 2),
+            ))
+            matched_any = True
+            rest = [w for w in rest if w not in used]
+        if not matched_any and rest:
+            result.unmatched.append(item.strip())
+    return result
+
+
+# --- Index lifecycle ---
+
+_index: Optional[FoodIndex] = None
+_index_lock = threading.Lock()
+
+
+def seed_foods(conn):
+    """Inserts the built-in FOODS rows that are not in the foods table yet."""
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO foods (name, aliases, serving_g, serving_unit, carbs_g, protein_g, fat_g, kcal)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        FOODS,
+    )
+
+
+def _index_entries(rows: Iterable[tuple]) -> Iterable[Tuple[Food, List[str]]]:
+    for food_id, name, aliases, serving_g, unit, carbs, protein, fat, kcal in rows:
+        names = [name, *filter(None, (aliases or "").split("|"))]
+        yield Food(food_id, name, serving_g, unit, carbs, protein, fat, kcal), names
+
+
+def load_index(conn=None) -> FoodIndex:
+    """Builds a FoodIndex from the foods table."""
+    conn = conn or database.get_connection()
+    rows = conn.execute(
+        "SELECT food_id, name, aliases, serving_g, serving_unit, carbs_g, protein_g, fat_g, kcal FROM foods"
+    ).fetchall()
+    return FoodIndex(_index_entries(rows))
+
+
+def builtin_index() -> FoodIndex:
+    """A FoodIndex over the built-in FOODS rows, without touching the database."""
+    return FoodIndex(_index_entries((food_id, *row) for food_id, row in enumerate(FOODS, 1)))
+
+
+def get_index() -> FoodIndex:
+    """The process-wide index, loaded from the database on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+    return _index
+
+
+def reload_index():
+    """Drops the cached index (and estimates) so edits to the foods table are picked up."""
+    global _index
+    with _index_lock:
+        _index = None
+    estimate_macros.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def estimate_macros(description: str) -> MacroEstimate:
+    """Cached estimate() against the process-wide index."""
+    return estimate(description)
+
+
+def format_estimate(result: MacroEstimate) -> str:
+    """Human-readable breakdown for the agent tool."""
+    lines = []
+    for item in result.items:
+        lines.append(f"• {item.food} (~{item.grams:g} g): Carbs {item.carbs_g}g | Protein {item.protein_g}g | "
+                     f"Fat {item.fat_g}g | {item.kcal:g} kcal")
+    totals = result.totals()
+    if totals:
+        lines.append(f"Total: Carbs {totals[0]}g | Protein {totals[1]}g | Fat {totals[2]}g | {totals[3]:g} kcal")
+    return "\n".join(lines)
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Tiered retention for the logs table.
+
+CGM and mood readings older than RETENTION_RAW_DAYS (counted back from midnight
+UTC, so buckets are always complete) are compacted out of the hot logs table
+into two forms:
+- hourly and daily rollups (log_rollups_hourly / log_rollups_daily): reading
+  count, min, max and mean per user and bucket, plus readings below, in and
+  above the target range for CGM. Long-range trends read these.
+- the raw rows themselves, in columnar archive segments under
+  RETENTION_ARCHIVE_DIR: one directory per log type and batch of users, one .npy
+  file per column in the narrowest dtype that holds it losslessly (uint32 user
+  IDs and epoch seconds, uint8/uint16 readings where they are whole numbers)
+  and the value text dictionary-coded. Rows are sorted by user and time, and
+  the files are not deflated, so they open with np.load(mmap_mode="r"): reading
+  one user's history back pages in only that user's slice.
+
+Each segment is written, fsynced and renamed into place before the transaction
+that catalogues it in archive_segments, folds its rows into the rollups and
+deletes them from logs. A segment directory with no catalogue row (a run that
+died before committing) is removed by the next run. Rows that arrive later with
+old timestamps are compacted by the next run and merged into existing buckets.
+Rows whose reading could not be parsed stay in logs.
+
+Runs from this CLI or the server's background scheduler
+(RETENTION_INTERVAL_SECONDS); a lock file next to the database keeps runs from
+several workers serial.
+
+    python retention.py                              # compact rows older than RETENTION_RAW_DAYS
+    python retention.py --raw-days 30 --vacuum       # ... and give the freed pages back to the OS
+    python retention.py --read 42 --log-type cgm     # a user's archived rows, as NDJSON
+"""
+
+import argparse
+import datetime
+import functools
+import heapq
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import database
+import instrumentation
+from cgm_analytics import TARGET_HIGH, TARGET_LOW
+
+RETENTION_RAW_DAYS = float(os.getenv("RETENTION_RAW_DAYS", "90"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "")   # default: <DB_PATH>.archive
+RETENTION_BATCH_USERS = int(os.getenv("RETENTION_BATCH_USERS", "100"))
+RETENTION_FETCH_ROWS = 50_000   # rows fetched per cursor step while a batch is compacted
+
+# Typed column each compacted log type is rolled up from
+VALUE_COLUMNS = {"cgm": "glucose_mg_dl", "mood": "mood_score"}
+ROLLUP_SECONDS = {"hourly": 3600, "daily": 86400}
+# Names _compact_batch gives segment directories (and their staging directories)
+_SEGMENT_ID = rf"(?:{'|'.join(VALUE_COLUMNS)})-\d+-\d+-\d{{4}}-\d{{2}}-\d{{2}}-[0-9a-f]{{8}}"
+_SEGMENT_NAME = re.compile(rf"{_SEGMENT_ID}|\.{_SEGMENT_ID}\.tmp")
+
+# Candidate dtypes per archive column, narrowest first; the first that holds every value exactly wins
+_ID_DTYPES = (np.uint32, np.int64)
+_READING_DTYPES = (np.uint8, np.uint16, np.float32, np.float64)
+_CODE_DTYPES = (np.uint8, np.uint16, np.uint32)
+
+ROWS_ARCHIVED = instrumentation.Counter(
+    "healthcare_retention_rows_archived_total", "Log rows compacted into rollups and archive segments", ("log_type",))
+
+_UPSERT_ROLLUP_SQL = """
+    INSERT INTO log_rollups_{resolution}
+        (user_id, log_type, bucket, readings, min_value, max_value, mean_value, below_range, in_range, above_range)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, log_type, bucket) DO UPDATE SET
+        readings = readings + excluded.readings,
+        min_value = min(min_value, excluded.min_value),
+        max_value = max(max_value, excluded.max_value),
+        mean_value = (mean_value * readings + excluded.mean_value * excluded.readings)
+                     / (readings + excluded.readings),
+        below_range = below_range + excluded.below_range,
+        in_range = in_range + excluded.in_range,
+        above_range = above_range + excluded.above_range
+"""
+
+_stop = threading.Event()
+
+
+def archive_dir() -> str:
+    """Root directory of the archive segments (next to the database unless configured)."""
+    return RETENTION_ARCHIVE_DIR or f"{database.DB_PATH}.archive"
+
+
+def cutoff_timestamp(raw_days: float, now: Optional[datetime.datetime] = None) -> str:
+    """Midnight UTC `raw_days` before now; rows older than this are compacted."""
+    now = now or datetime.datetime.utcnow()
+    day = (now - datetime.timedelta(days=raw_days)).date()
+    return f"{day.isoformat()} 00:00:00"
+
+
+def _epoch(timestamp: str) -> int:
+    """Epoch seconds for a stored or ISO-8601 timestamp (naive = UTC)."""
+    parsed = datetime.datetime.fromisoformat(timestamp.strip())
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _stored(epoch: int) -> str:
+    return datetime.datetime.utcfromtimestamp(int(epoch)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _narrow(values: np.ndarray, dtypes: Sequence[type]) -> np.ndarray:
+    """values in the first dtype that represents all of them exactly."""
+    for dtype in dtypes[:-1]:
+        info = np.iinfo(dtype) if np.issubdtype(dtype, np.integer) else None
+        if info is not None and len(values) and (values.min() < info.min or values.max() > info.max):
+            continue
+        converted = values.astype(dtype)
+        if np.array_equal(converted, values):
+            return converted
+    return values.astype(dtypes[-1])
+
+
+# --- Compaction ---
+
+def _user_batches(conn, batch_users: int) -> Iterator[Tuple[int, int]]:
+    """(first, last) user_id ranges of up to batch_users users with logs, seeking the index."""
+    last = None
+    while True:
+        first = conn.execute(
+            "SELECT MIN(user_id) FROM logs" + ("" if last is None else " WHERE user_id > ?"),
+            () if last is None else (last,),
+        ).fetchone()[0]
+        if first is None:
+            return
+        row = conn.execute(
+            "SELECT MAX(user_id) FROM (SELECT DISTINCT user_id FROM logs WHERE user_id >= ? ORDER BY user_id LIMIT ?)",
+            (first, batch_users),
+        ).fetchone()
+        last = row[0]
+        yield first, last
+
+
+def _rollups(log_type: str, users: np.ndarray, epochs: np.ndarray, readings: np.ndarray,
+             bucket_seconds: int) -> List[tuple]:
+    """Parameter rows for _UPSERT_ROLLUP_SQL from arrays sorted by user and time."""
+    buckets = epochs // bucket_seconds
+    starts = np.flatnonzero(np.r_[True, (users[1:] != users[:-1]) | (buckets[1:] != buckets[:-1])])
+    counts = np.diff(np.r_[starts, len(users)])
+    mean = np.add.reduceat(readings, starts) / counts
+    labels = np.datetime_as_string((buckets[starts] * bucket_seconds).astype("datetime64[s]"))
+    labels = [label[:10] if bucket_seconds == 86400 else label.replace("T", " ") for label in labels.tolist()]
+    if log_type == "cgm":
+        ranges = [np.add.reduceat(mask.astype(np.int64), starts).tolist() for mask in
+                  (readings < TARGET_LOW, (readings >= TARGET_LOW) & (readings <= TARGET_HIGH), readings > TARGET_HIGH)]
+    else:
+        ranges = [[None] * len(starts)] * 3
+    return list(zip(
+        users[starts].tolist(), [log_type] * len(starts), labels, counts.tolist(),
+        np.minimum.reduceat(readings, starts).tolist(), np.maximum.reduceat(readings, starts).tolist(),
+        mean.tolist(), *ranges,
+    ))
+
+
+def _save_column(directory: str, name: str, values: np.ndarray):
+    with open(os.path.join(directory, f"{name}.npy"), "wb") as f:
+        np.save(f, values)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_segment(segment_id: str, columns: Dict[str, np.ndarray], values: List[str]) -> str:
+    """Writes a segment to a temporary directory and renames it into place."""
+    root = archive_dir()
+    os.makedirs(root, exist_ok=True)
+    final = os.path.join(root, segment_id)
+    staging = os.path.join(root, f".{segment_id}.tmp")
+    os.makedirs(staging)
+    for name, column in columns.items():
+        _save_column(staging, name, column)
+    with open(os.path.join(staging, "values.json"), "w") as f:
+        json.dump(values, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(staging, final)
+    return final
+
+
+def _fetch_batch(conn, log_type: str, first_user: int, last_user: int,
+                 cutoff: str) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """
+    One user range's old rows of a log type as columns (log_id, user_id, epoch,
+    reading, value_code) plus the value dictionary. Rows are fetched
+    RETENTION_FETCH_ROWS at a time straight into arrays, so only one fetch's
+    tuples are alive at once.
+    """
+    column = VALUE_COLUMNS[log_type]
+    cursor = conn.execute(f"""
+        SELECT log_id, user_id, CAST(strftime('%s', timestamp) AS INTEGER), {column}, value
+        FROM logs
+        WHERE user_id BETWEEN ? AND ? AND log_type = ? AND timestamp < ? AND {column} IS NOT NULL
+        ORDER BY user_id, timestamp, log_id
+    """, (first_user, last_user, log_type, cutoff))
+    dictionary: Dict[str, int] = {}
+    parts: Dict[str, List[np.ndarray]] = {name: [] for name in ("log_id", "user_id", "epoch", "reading", "value_code")}
+    while True:
+        rows = cursor.fetchmany(RETENTION_FETCH_ROWS)
+        if not rows:
+            break
+        log_ids, users, epochs, readings, texts = zip(*rows)
+        parts["log_id"].append(np.array(log_ids, dtype=np.int64))
+        parts["user_id"].append(np.array(users, dtype=np.int64))
+        parts["epoch"].append(np.array(epochs, dtype=np.int64))
+        parts["reading"].append(np.array(readings, dtype=np.float64))
+        parts["value_code"].append(np.array([dictionary.setdefault(str(text), len(dictionary)) for text in texts],
+                                            dtype=np.int64))
+    if not parts["log_id"]:
+        return {}, []
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}, list(dictionary)
+
+
+def _compact_batch(conn, log_type: str, first_user: int, last_user: int, cutoff: str) -> int:
+    """Archives and rolls up one user range's rows of one log type; returns the rows moved."""
+    columns, values = _fetch_batch(conn, log_type, first_user, last_user, cutoff)
+    if not columns:
+        return 0
+    log_ids, users, epochs, readings = columns["log_id"], columns["user_id"], columns["epoch"], columns["reading"]
+    rows = len(log_ids)
+
+    segment_id = f"{log_type}-{first_user}-{last_user}-{cutoff[:10]}-{uuid.uuid4().hex[:8]}"
+    path = _write_segment(segment_id, {
+        "log_id": _narrow(log_ids, _ID_DTYPES),
+        "user_id": _narrow(users, _ID_DTYPES),
+        "epoch": _narrow(epochs, _ID_DTYPES),
+        "reading": _narrow(readings, _READING_DTYPES),
+        "value_code": _narrow(columns["value_code"], _CODE_DTYPES),
+    }, values)
+
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO archive_segments (segment_id, log_type, rows, user_min, user_max, ts_min, ts_max) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (segment_id, log_type, rows, int(users[0]), int(users[-1]),
+                 _stored(epochs.min()), _stored(epochs.max())),
+            )
+            for resolution, seconds in ROLLUP_SECONDS.items():
+                conn.executemany(_UPSERT_ROLLUP_SQL.format(resolution=resolution),
+                                 _rollups(log_type, users, epochs, readings, seconds))
+            conn.executemany("DELETE FROM logs WHERE log_id = ?", ((log_id,) for log_id in log_ids.tolist()))
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    ROWS_ARCHIVED.inc(rows, log_type=log_type)
+    return rows
+
+
+def remove_orphan_segments(conn) -> int:
+    """
+    Deletes segment directories no committed run catalogued; returns how many.
+    Entries not named like a segment are left alone.
+    """
+    root = archive_dir()
+    if not os.path.isdir(root):
+        return 0
+    catalogued = {row[0] for row in conn.execute("SELECT segment_id FROM archive_segments")}
+    removed = 0
+    for name in os.listdir(root):
+        if not _SEGMENT_NAME.fullmatch(name):
+            continue
+        if name.endswith(".tmp") or name not in catalogued:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def compact(raw_days: Optional[float] = None, batch_users: Optional[int] = None,
+            log_types: Sequence[str] = tuple(VALUE_COLUMNS)) -> Dict[str, Any]:
+    """
+    Moves CGM/mood rows older than `raw_days` from logs into the rollups and the
+    archive, one batch of users and log type per transaction. Returns a summary.
+    """
+    raw_days = RETENTION_RAW_DAYS if raw_days is None else raw_days
+    cutoff = cutoff_timestamp(raw_days)
+    started = time.perf_counter()
+    summary: Dict[str, Any] = {"cutoff": cutoff, "rows": {log_type: 0 for log_type in log_types}, "segments": 0}
+    _stop.clear()
+    with database.init_lock(f"{database.DB_PATH}.retention.lock"):
+        database.flush_logs()
+        conn = database.get_connection()
+        summary["orphans_removed"] = remove_orphan_segments(conn)
+        for first_user, last_user in _user_batches(conn, batch_users or RETENTION_BATCH_USERS):
+            if _stop.is_set():
+                summary["stopped"] = True
+                break
+            for log_type in log_types:
+                moved = _compact_batch(conn, log_type, first_user, last_user, cutoff)
+                if moved:
+                    summary["rows"][log_type] += moved
+                    summary["segments"] += 1
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def stop():
+    """Asks a running compact() to return after its current batch (server shutdown)."""
+    _stop.set()
+
+
+def vacuum():
+    """Rebuilds the database file so pages freed by compaction are returned to the OS."""
+    conn = database.get_connection()
+    conn.execute("VACUUM")
+
+
+# --- Reading archived rows ---
+
+@functools.lru_cache(maxsize=256)
+def open_segment(path: str) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """A segment's columns, memory-mapped, and its value dictionary. Segments never change once written."""
+    columns = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in ("log_id", "user_id", "epoch", "reading", "value_code")
+    }
+    with open(os.path.join(path, "values.json")) as f:
+        return columns, json.load(f)
+
+
+def _segment_slices(user_id: int, log_type: Optional[str], start: Optional[str], end: Optional[str],
+                    conn: Optional[sqlite3.Connection] = None,
+                    ) -> Iterator[Tuple[str, Dict[str, np.ndarray], List[str], slice]]:
+    """
+    (log_type, columns, values, row slice) for each segment holding the user's rows
+    in the range, as catalogued on conn (default: this thread's connection).
+    """
+    clauses = ["user_min <= ? AND user_max >= ?"]
+    params: list = [user_id, user_id]
+    if log_type:
+        clauses.append("log_type = ?")
+        params.append(log_type)
+    lo_epoch = hi_epoch = None
+    if start:
+        lo_epoch = _epoch(start)
+        clauses.append("ts_max >= ?")
+        params.append(_stored(lo_epoch))
+    if end:
+        hi_epoch = _epoch(end)
+        clauses.append("ts_min < ?")
+        params.append(_stored(hi_epoch))
+    segments = (conn or database.get_connection()).execute(
+        f"SELECT segment_id, log_type FROM archive_segments WHERE {' AND '.join(clauses)} ORDER BY ts_min",
+        params,
+    ).fetchall()
+    root = archive_dir()
+    for segment_id, segment_type in segments:
+        columns, values = open_segment(os.path.join(root, segment_id))
+        users = columns["user_id"]
+        lo, hi = int(np.searchsorted(users, user_id, side="left")), int(np.searchsorted(users, user_id, side="right"))
+        if lo_epoch is not None:
+            lo += int(np.searchsorted(columns["epoch"][lo:hi], lo_epoch, side="left"))
+        if hi_epoch is not None:
+            hi = lo + int(np.searchsorted(columns["epoch"][lo:hi], hi_epoch, side="left"))
+        if hi > lo:
+            yield segment_type, columns, values, slice(lo, hi)
+
+
+def archived_series(user_id: int, log_type: str, start: Optional[str] = None, end: Optional[str] = None,
+                    conn: Optional[sqlite3.Connection] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (epoch_seconds int64[], readings float64[]) of a user's archived rows, oldest first.
+    Pass the connection of an open read transaction to list the segments in its snapshot.
+    """
+    parts = [(columns["epoch"][rows], columns["reading"][rows])
+             for _, columns, _, rows in _segment_slices(user_id, log_type, start, end, conn)]
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    t = np.concatenate([p[0] for p in parts]).astype(np.int64)
+    g = np.concatenate([p[1] for p in parts]).astype(np.float64)
+    order = np.argsort(t, kind="stable")
+    return t[order], g[order]
+
+
+def _slice_rows(user_id: int, segment_type: str, columns: Dict[str, np.ndarray], values: List[str],
+                rows: slice, newest_first: bool = False) -> Iterator[tuple]:
+    """One segment slice's rows as database.LOG_COLUMNS tuples, in the segment's time order or reversed."""
+    position = {column: i for i, column in enumerate(database.LOG_COLUMNS)}
+    id_at, timestamp_at, value_at = position["log_id"], position["timestamp"], position["value"]
+    step = -1 if newest_first else 1
+    timestamps = np.datetime_as_string(columns["epoch"][rows][::step].astype("datetime64[s]")).tolist()
+    template = [None] * len(position)
+    template[position["user_id"]] = user_id
+    template[position["log_type"]] = segment_type
+    reading_at = position[VALUE_COLUMNS[segment_type]]
+    for log_id, timestamp, reading, code in zip(columns["log_id"][rows][::step].tolist(), timestamps,
+                                                columns["reading"][rows][::step].astype(np.float64).tolist(),
+                                                columns["value_code"][rows][::step].tolist()):
+        row = template.copy()
+        row[id_at], row[timestamp_at], row[value_at] = log_id, timestamp.replace("T", " "), values[code]
+        row[reading_at] = reading
+        yield tuple(row)
+
+
+def iter_archived_rows(user_id: int, log_type: Optional[str] = None, start: Optional[str] = None,
+                       end: Optional[str] = None, conn: Optional[sqlite3.Connection] = None) -> Iterator[tuple]:
+    """
+    A user's archived rows as database.LOG_COLUMNS tuples, oldest segment first.
+    Pass the connection of an open read transaction to list the segments in its snapshot.
+    """
+    for segment_type, columns, values, rows in _segment_slices(user_id, log_type, start, end, conn):
+        yield from _slice_rows(user_id, segment_type, columns, values, rows)
+
+
+def iter_archived_readings(log_type: str, start: Optional[str] = None, chunk_rows: int = 1_000_000,
+                           conn: Optional[sqlite3.Connection] = None,
+                           ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Every user's archived rows of a log type from `start` on, as (user_id int64[],
+    epoch int64[], reading float64[]) arrays of at most chunk_rows rows.
+    """
+    sql, params = "SELECT segment_id FROM archive_segments WHERE log_type = ?", [log_type]
+    lo_epoch = None
+    if start:
+        lo_epoch = _epoch(start)
+        sql += " AND ts_max >= ?"
+        params.append(_stored(lo_epoch))
+    root = archive_dir()
+    for (segment_id,) in (conn or database.get_connection()).execute(sql, params).fetchall():
+        columns, _ = open_segment(os.path.join(root, segment_id))
+        for offset in range(0, len(columns["user_id"]), chunk_rows):
+            rows = slice(offset, offset + chunk_rows)
+            users = columns["user_id"][rows].astype(np.int64)
+            epochs = columns["epoch"][rows].astype(np.int64)
+            readings = columns["reading"][rows].astype(np.float64)
+            if lo_epoch is not None:
+                keep = epochs >= lo_epoch
+                users, epochs, readings = users[keep], epochs[keep], readings[keep]
+            if len(users):
+                yield users, epochs, readings
+
+
+def read_archived_logs(user_id: int, log_type: Optional[str] = None, start: Optional[str] = None,
+                       end: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """A user's archived rows as log dicts, newest first."""
+    position = {column: i for i, column in enumerate(database.LOG_COLUMNS)}
+    timestamp_at, id_at = position["timestamp"], position["log_id"]
+    # Each segment slice is already ordered by time, so walk them backwards and merge
+    # the streams, stopping once `limit` rows are out instead of sorting them all
+    streams = [
+        _slice_rows(user_id, segment_type, columns, values, rows, newest_first=True)
+        for segment_type, columns, values, rows in _segment_slices(user_id, log_type, start, end)
+    ]
+    merged = heapq.merge(*streams, key=lambda row: (row[timestamp_at], row[id_at]), reverse=True)
+    return [dict(zip(database.LOG_COLUMNS, row)) for row in itertools.islice(merged, limit or None)]
+
+
+def get_rollups(user_id: int, log_type: str = "cgm", resolution: str = "daily", start: Optional[str] = None,
+                end: Optional[str] = None) -> List[Dict[str, Any]]:
+    """A user's rollup buckets, oldest first, with time in range as percentages for CGM."""
+    if resolution not in ROLLUP_SECONDS:
+        raise ValueError(f"Unknown rollup resolution: {resolution!r}")
+    clauses = ["user_id = ? AND log_type = ?"]
+    params: list = [user_id, log_type]
+    if start:
+        clauses.append("bucket >= ?")
+        params.append(_stored(_epoch(start))[:10 if resolution == "daily" else 19])
+    if end:
+        clauses.append("bucket < ?")
+        params.append(_stored(_epoch(end))[:10 if resolution == "daily" else 19])
+    cursor = database.get_connection().execute(f"""
+        SELECT bucket, readings, min_value, max_value, mean_value, below_range, in_range, above_range
+        FROM log_rollups_{resolution}
+        WHERE {" AND ".join(clauses)}
+        ORDER BY bucket
+    """, params)
+    rollups = []
+    for bucket, readings, low, high, mean, below, in_range, above in cursor:
+        rollup = {"bucket": bucket, "readings": readings, "min": low, "max": high, "mean": round(mean, 2)}
+        if log_type == "cgm":
+            rollup.update(
+                below_percent=round(100 * below / readings, 1),
+                in_range_percent=round(100 * in_range / readings, 1),
+                above_percent=round(100 * above / readings, 1),
+            )
+        rollups.append(rollup)
+    return rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact old CGM/mood logs into rollups and archive segments")
+    parser.add_argument("--db", help="database file (default: DB_PATH or agents/users.db)")
+    parser.add_argument("--raw-days", type=float, default=RETENTION_RAW_DAYS,
+                        help="days of raw readings kept in the logs table")
+    parser.add_argument("--batch-users", type=int, default=RETENTION_BATCH_USERS, help="users per transaction")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the database afterwards")
+    parser.add_argument("--read", type=int, metavar="USER_ID", help="print a user's archived rows instead")
+    parser.add_argument("--log-type", choices=sorted(VALUE_COLUMNS), help="with --read: only this log type")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    database.init_schema()
+    if args.read is not None:
+        for log in read_archived_logs(args.read, args.log_type):
+            print(json.dumps(log))
+        return
+
+    summary = compact(args.raw_days, args.batch_users)
+    print(json.dumps(summary, indent=2))
+    if args.vacuum:
+        started = time.perf_counter()
+        vacuum()
+        print(f"VACUUM done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,10 @@ This avoids the relative import issues.
 
 import sys
 import os
+import time
+
+_IMPORT_START = time.perf_counter()
+
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -14,16 +18,57 @@ load_dotenv()
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Now we can import our modules
+# Now we can import our modules. Agents, the model client and NumPy (CGM analytics)
+# are loaded on first use, so they are not part of a worker's cold start.
 import agents_config
 import database
+import async_database
+import fast_router
+import intent_router
+import meal_plans
+import nutrition
+import sessions
+import llm_scheduler
+import instrumentation
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from pydantic import BaseModel, field_validator
+from typing import Dict, Any, List, Literal, Optional
+import asyncio
+import datetime
+import inspect
 import json
+import shutil
+import tempfile
+
+instrumentation.record_startup("imports", time.perf_counter() - _IMPORT_START)
+
+# Build the coordinator in the background once the server is up (0 = on the first agent request)
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "1") != "0"
+
+# Compact CGM/mood logs older than RETENTION_RAW_DAYS every N seconds, first shortly after
+# startup (0 = off; retention.py also runs from the command line)
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "86400"))
+RETENTION_START_DELAY_SECONDS = 60
+
+# Server processes. SQLite is shared between workers (WAL, per-process connections);
+# in-memory caches, sessions and LLM budgets are per worker. 0 or "auto" = one per core.
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = os.getenv("SERVER_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))  # seconds to drain on shutdown
+
+
+def server_workers() -> int:
+    """Resolves SERVER_WORKERS / WEB_CONCURRENCY to a process count."""
+    if SERVER_WORKERS.strip().lower() in ("", "0", "auto"):
+        return os.cpu_count() or 1
+    return max(1, int(SERVER_WORKERS))
+
+instrumentation.configure_logging()
+logger = instrumentation.logger
 
 app = FastAPI(title="Healthcare Multi-Agent API", version="1.0.0")
 
@@ -34,7 +79,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Root span, latency and status counts for every request (see instrumentation.py)
+app.add_middleware(instrumentation.MetricsMiddleware)
 
 # Request/Response models
 class AgentRequest(BaseModel):
@@ -47,13 +95,151 @@ class AgentResponse(BaseModel):
     status: str
     data: Optional[Dict[str, Any]] = None
 
+class LogEntry(BaseModel):
+    user_id: int
+    log_type: Literal["cgm", "mood", "food"]
+    value: str
+    timestamp: Optional[str] = None       # when the reading was taken (defaults to now)
+    meal_timestamp: Optional[str] = None
+
+    @field_validator("timestamp")
+    @classmethod
+    def _utc_timestamp(cls, value: Optional[str]) -> Optional[str]:
+        """ISO-8601 in, stored UTC format out (offsets are converted, naive times taken as UTC)."""
+        if value is None:
+            return None
+        parsed = datetime.datetime.fromisoformat(value.strip())
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+    @field_validator("meal_timestamp")
+    @classmethod
+    def _iso_meal_timestamp(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            datetime.datetime.fromisoformat(value.strip())
+        return value
+
+MAX_LOG_BATCH = 10000
+
+class MealPlanBatchRequest(BaseModel):
+    user_ids: Optional[List[int]] = None  # None = every user
+
 # Run database setup on server startup
 @app.on_event("startup")
 def on_startup():
-    """Initializes the database and populates synthetic data."""
+    """Initializes the database and populates synthetic data (once, across all workers)."""
+    start = time.perf_counter()
     print("Initializing Synthetic Healthcare Database...")
     database.create_and_populate_db()
+    database.delete_expired_sessions(sessions.SESSION_TTL_SECONDS)
     print("Database initialization complete.")
+    instrumentation.record_startup("database", time.perf_counter() - start)
+
+@app.on_event("startup")
+async def warm_up_agents():
+    """Reports time to ready, then builds the coordinator agent without delaying startup."""
+    instrumentation.record_startup("ready", time.perf_counter() - _IMPORT_START)
+    logger.info("Worker ready in %.2fs (imports %.2fs, database %.2fs)", instrumentation.STARTUP["ready"],
+                instrumentation.STARTUP["imports"], instrumentation.STARTUP["database"])
+    if AGENT_WARMUP:
+        app.state.agent_warmup = asyncio.ensure_future(agents_config.aget_agent(intent_router.COORDINATOR))
+
+@app.on_event("startup")
+async def start_metrics_snapshots():
+    """In multi-worker mode, publishes this worker's metrics for /metrics scrapes served by other workers."""
+    if instrumentation.METRICS_MULTIPROC_DIR:
+        async def publish():
+            while True:
+                await asyncio.sleep(instrumentation.METRICS_SNAPSHOT_SECONDS)
+                instrumentation.write_snapshot()
+        app.state.metrics_snapshots = asyncio.create_task(publish())
+
+@app.on_event("startup")
+async def start_retention_scheduler():
+    """Runs the log compaction (retention.py) in the background; workers' runs serialise on a lock file."""
+    if RETENTION_INTERVAL_SECONDS > 0:
+        async def compact_periodically():
+            await asyncio.sleep(RETENTION_START_DELAY_SECONDS)
+            import retention
+            while True:
+                try:
+                    summary = await asyncio.to_thread(retention.compact)
+                    logger.info("Log compaction: %s rows archived in %.1fs (cutoff %s)",
+                                summary["rows"], summary["seconds"], summary["cutoff"])
+                except Exception:
+                    logger.exception("Log compaction failed")
+                await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+        app.state.retention = asyncio.create_task(compact_periodically())
+
+@app.on_event("shutdown")
+def stop_retention_scheduler():
+    """Cancels the compaction loop; a run in progress stops after its current batch."""
+    task = getattr(app.state, "retention", None)
+    if task is not None:
+        task.cancel()
+        import retention
+        retention.stop()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    """Drains the DB executor, flushes queued logs and closes this worker's connections."""
+    async_database.shutdown()
+    instrumentation.write_snapshot()
+
+def runtime_metrics():
+    """Existing runtime counters, exported through /metrics."""
+    cache = database.profile_cache_stats()
+    scheduler = llm_scheduler.scheduler.stats()
+    session_stats = sessions.session_manager.stats()
+    metrics = [
+        ("healthcare_profile_cache_hits_total", "counter", "User profile cache hits", {}, cache["hits"]),
+        ("healthcare_profile_cache_misses_total", "counter", "User profile cache misses", {}, cache["misses"]),
+        ("healthcare_llm_queue_depth", "gauge", "Agent runs waiting for an LLM slot", {}, scheduler["queue_depth"]),
+        ("healthcare_llm_running", "gauge", "Agent runs holding an LLM slot", {}, scheduler["running"]),
+        ("healthcare_sessions_active", "gauge", "Conversation sessions held in memory", {}, session_stats["active"]),
+    ]
+    for outcome in ("completed", "failed", "rejected", "retries", "rate_limited", "coalesced"):
+        metrics.append(("healthcare_llm_scheduler_events_total", "counter", "LLM scheduler outcomes",
+                        {"event": outcome}, scheduler[outcome]))
+    for route, count in fast_router.ROUTE_COUNTS.items():
+        metrics.append(("healthcare_agent_routes_total", "counter", "Agent messages by route",
+                        {"route": route}, count))
+    for path, stats in intent_router.PATH_STATS.items():
+        metrics.append(("healthcare_llm_path_runs_total", "counter", "Agent runs by routing path",
+                        {"path": path}, stats["runs"]))
+        metrics.append(("healthcare_llm_path_seconds_total", "counter", "Agent run time by routing path",
+                        {"path": path}, stats["seconds"]))
+        for kind in ("input", "output"):
+            metrics.append(("healthcare_llm_path_tokens_total", "counter", "Model tokens by routing path",
+                            {"path": path, "type": kind}, stats[f"{kind}_tokens"]))
+    return metrics
+
+instrumentation.register_collector(runtime_metrics)
+
+async def run_agent(agent, prompt: str, path: str = "coordinator", **run_kwargs):
+    """One traced agent.arun() call; records the model tokens it reports, per agent and routing path."""
+    start = time.perf_counter()
+    with instrumentation.agent_run_span(agent.name, path=path):
+        response = await agent.arun(prompt, **run_kwargs)
+        tokens = llm_scheduler.usage_tokens(response)
+        instrumentation.record_tokens(agent.name, *tokens)
+        intent_router.record_run(path, *tokens, time.perf_counter() - start)
+        return response
+
+async def scheduled_run(agent, prompt: str, path: str, session: sessions.Session):
+    """
+    run_agent() through the LLM scheduler (concurrency, rate budgets, coalescing).
+    The key leaves out the session: requests of one session run one at a time under
+    its lock and can never overlap. Identical prompts for the same user from different
+    sessions (e.g. a message sent from two tabs) share a run; the prompt carries each
+    session's conversation context, so they only match when that context does too.
+    """
+    run_kwargs = sessions.agent_run_kwargs(agent, session)
+    return await llm_scheduler.scheduler.run(
+        lambda: run_agent(agent, prompt, path, **run_kwargs), prompt,
+        key=(agent.name, session.user_id, prompt),
+    )
 
 # Health check endpoint
 @app.get("/health")
@@ -67,85 +253,398 @@ async def handle_agent_request(request: AgentRequest):
     Receives requests and processes them through the multi-agent system.
     """
     try:
-        # Create a message with user context
-        message_with_context = request.message
-        
-        # If user_id is provided, add it to the message context
-        if request.user_id:
-            message_with_context = f"[User ID: {request.user_id}] {request.message}"
-        
-        # Process the request through the main router agent
-        response = await agents_config.main_router_agent.arun(message_with_context)
-        
-        # Extract clean response content from RunResponse object
-        if hasattr(response, 'content'):
-            clean_content = response.content
-        else:
-            clean_content = str(response)
-        
-        return AgentResponse(
-            response=clean_content,
-            status="success",
-            data={"user_id": request.user_id, "session_id": request.session_id}
-        )
+        async with sessions.session_manager.session(request.session_id) as session:
+            user_id = request.user_id or session.user_id
+
+            # Structured messages ("my glucose is 140") are served without the LLM
+            fast = await fast_router.try_fast_path(request.message, user_id)
+            if fast is not None:
+                fast_router.ROUTE_COUNTS["fast_path"] += 1
+                session.record(request.message, fast.response, fast.user_id)
+                return AgentResponse(
+                    response=fast.response,
+                    status="success",
+                    data={"user_id": fast.user_id, "session_id": request.session_id,
+                          "route": "fast_path", "intent": fast.intent}
+                )
+            fast_router.ROUTE_COUNTS["llm"] += 1
+
+            # Process the request through the coordinator, or one specialist agent
+            # (ROUTING_MODE=specialist), with this session's context
+            agent, path, intent = await intent_router.route_agent(request.message)
+            prompt = session.prompt(request.message, user_id)
+            response = await scheduled_run(agent, prompt, path, session)
+
+            # Extract clean response content from RunResponse object
+            if hasattr(response, 'content'):
+                clean_content = response.content
+            else:
+                clean_content = str(response)
+            if intent == intent_router.GENERAL_INTENT and intent_router.is_handoff(clean_content):
+                agent, path, intent = await intent_router.coordinator_route()
+                response = await scheduled_run(agent, prompt, path, session)
+                clean_content = getattr(response, "content", None) or str(response)
+            session.record(request.message, clean_content, user_id)
+
+            return AgentResponse(
+                response=clean_content,
+                status="success",
+                data={"user_id": user_id, "session_id": request.session_id, "route": "llm",
+                      "path": path, "intent": intent, "agent": agent.name}
+            )
+    except llm_scheduler.LLMOverloadedError as e:
+        logger.warning(f"Agent Overloaded: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
-        print(f"Agent Execution Error: {e}")
+        logger.exception(f"Agent Execution Error: {e}")
         raise HTTPException(status_code=500, detail=f"Agent execution failed: {str(e)}")
 
+# --- Streaming agent endpoint (Server-Sent Events) ---
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def tool_call_info(chunk) -> Dict[str, Any]:
+    """Extracts the tool name/args/result from an agno tool-call event."""
+    tool = getattr(chunk, "tool", None)
+    if tool is None:
+        tools = getattr(chunk, "tools", None) or [{}]
+        tool = tools[-1]
+    if isinstance(tool, dict):
+        get = tool.get
+    else:
+        get = lambda key: getattr(tool, key, None)
+    return {"tool_name": get("tool_name"), "tool_args": get("tool_args"), "result": get("result")}
+
+async def agent_run_events(agent, message: str, path: str = "coordinator", **run_kwargs):
+    """
+    Runs the agent in streaming mode and yields (event, data) pairs for model tokens
+    and tool calls. Token usage is recorded per agent and routing path. Handles the agno 1.x API (arun must be awaited to get the stream,
+    content events named RunResponse*) as well as 2.x/3.x (arun returns the stream,
+    content events named RunContent, tool events enabled by stream_events).
+    """
+    start = time.perf_counter()
+    if "stream_events" in inspect.signature(agent.arun).parameters:
+        run_kwargs["stream_events"] = True
+    else:
+        run_kwargs["stream_intermediate_steps"] = True
+    stream = agent.arun(message, stream=True, **run_kwargs)
+    if inspect.isawaitable(stream):
+        stream = await stream
+
+    async for chunk in stream:
+        event = str(getattr(chunk, "event", ""))
+        if event == "ToolCallStarted":
+            info = tool_call_info(chunk)
+            yield "tool_call_start", {"tool_name": info["tool_name"], "tool_args": info["tool_args"]}
+        elif event == "ToolCallCompleted":
+            yield "tool_call_end", tool_call_info(chunk)
+        elif event in ("RunResponse", "RunResponseContent", "RunContent"):
+            if getattr(chunk, "content", None):
+                yield "token", {"content": chunk.content}
+        elif event == "RunCompleted":
+            tokens = llm_scheduler.usage_tokens(chunk)
+            instrumentation.record_tokens(agent.name, *tokens)
+            intent_router.record_run(path, *tokens, time.perf_counter() - start)
+
+async def stream_run(agent, path: str, prompt: str, session: sessions.Session, content: List[str]):
+    """Streams one scheduled agent run as SSE strings, collecting the reply text into `content`."""
+    async with llm_scheduler.scheduler.slot(prompt):
+        with instrumentation.agent_run_span(agent.name, stream=True, path=path):
+            async for event, payload in agent_run_events(
+                agent, prompt, path, **sessions.agent_run_kwargs(agent, session)
+            ):
+                if event == "token":
+                    content.append(payload["content"])
+                yield sse_event(event, payload)
+
+@app.post("/ag-ui-agent/stream")
+async def handle_agent_request_stream(request: AgentRequest):
+    """
+    Streaming variant of /ag-ui-agent using Server-Sent Events. Emits `token` events
+    as the model generates, `tool_call_start` / `tool_call_end` around each tool
+    call, then a `final` event with the full response (or an `error` event).
+    """
+    async def events():
+        data = {"user_id": request.user_id, "session_id": request.session_id}
+        try:
+            async with sessions.session_manager.session(request.session_id) as session:
+                user_id = request.user_id or session.user_id
+                fast = await fast_router.try_fast_path(request.message, user_id)
+                if fast is not None:
+                    fast_router.ROUTE_COUNTS["fast_path"] += 1
+                    session.record(request.message, fast.response, fast.user_id)
+                    data.update(user_id=fast.user_id, route="fast_path", intent=fast.intent)
+                    yield sse_event("final", {"response": fast.response, "status": "success", "data": data})
+                    return
+                fast_router.ROUTE_COUNTS["llm"] += 1
+
+                agent, path, intent = await intent_router.route_agent(request.message)
+                prompt = session.prompt(request.message, user_id)
+                content: List[str] = []
+                handed_off = False
+                if intent == intent_router.GENERAL_INTENT:
+                    # interrupt_agent may hand the message back, so its short reply is held until complete
+                    held = [event async for event in stream_run(agent, path, prompt, session, content)]
+                    handed_off = intent_router.is_handoff("".join(content))
+                    if handed_off:
+                        agent, path, intent = await intent_router.coordinator_route()
+                        content.clear()
+                    else:
+                        for event in held:
+                            yield event
+                if intent != intent_router.GENERAL_INTENT:
+                    async for event in stream_run(agent, path, prompt, session, content):
+                        yield event
+                session.record(request.message, "".join(content), user_id)
+                data.update(user_id=user_id, route="llm", path=path, intent=intent, agent=agent.name)
+                yield sse_event("final", {"response": "".join(content), "status": "success", "data": data})
+        except Exception as e:
+            logger.exception(f"Agent Streaming Error: {e}")
+            yield sse_event("error", {"detail": f"Agent execution failed: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # User profile endpoint
 @app.get("/users/{user_id}")
 async def get_user_profile(user_id: int):
     """Get user profile by ID."""
-    profile = database.get_user_profile(user_id)
+    profile = await async_database.get_user_profile(user_id)
     if not profile:
         raise HTTPException(status_code=404, detail="User not found")
     return profile
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: requests, spans, agent runs, tool calls, DB queries, tokens (all workers)."""
+    return PlainTextResponse(instrumentation.render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def get_stats():
+    """Runtime counters of the worker that serves the request: profile cache, routes, sessions, LLM queue."""
+    return {
+        "worker_pid": os.getpid(),  # counters are per worker process
+        "profile_cache": database.profile_cache_stats(),
+        "routes": dict(fast_router.ROUTE_COUNTS),
+        "sessions": sessions.session_manager.stats(),
+        "llm_scheduler": llm_scheduler.scheduler.stats(),
+        "routing": {"mode": intent_router.ROUTING_MODE, "paths": intent_router.path_stats()},
+        "startup_seconds": instrumentation.STARTUP,
+    }
+
 # Log data endpoint
 @app.post("/logs")
-async def log_user_data(user_id: int, log_type: str, value: str):
+async def log_user_data(user_id: int, value: str, log_type: str = Query(..., pattern="^(cgm|mood|food)$")):
     """Log user data (CGM, mood, food)."""
-    database.log_data(user_id, log_type, value)
+    if not await async_database.get_user_profile(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    await async_database.log_data(user_id, log_type, value)
     return {"status": "success", "message": f"{log_type} logged for user {user_id}"}
 
+@app.post("/logs/batch")
+async def log_user_data_batch(entries: List[LogEntry]):
+    """Log many readings (CGM, mood, food) in a single transaction."""
+    if len(entries) > MAX_LOG_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_LOG_BATCH} logs")
+    user_ids = {entry.user_id for entry in entries}
+    missing = user_ids - await async_database.run_in_db_thread(database.get_existing_user_ids, list(user_ids))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown user_id(s): {sorted(missing)[:20]}")
+    count = await async_database.log_data_batch([entry.model_dump() for entry in entries])
+    return {"status": "success", "message": f"{count} logs recorded"}
+
+@app.post("/meal-plans/batch")
+async def generate_meal_plans_batch(request: MealPlanBatchRequest):
+    """
+    Generate meal plans for many users (or the whole cohort) from their profiles and
+    latest CGM/mood logs. Streamed as NDJSON: {"user_id": ..., "meal_plan": ...} per line.
+    """
+    def ndjson_lines():
+        for user_id, plan in meal_plans.iter_meal_plans(request.user_ids):
+            yield json.dumps({"user_id": user_id, "meal_plan": plan}) + "\n"
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
 @app.get("/users/{user_id}/logs")
-async def get_user_logs(user_id: int):
-    """Get all logs for a specific user"""
-    import sqlite3
-    import os
-    
-    db_path = os.path.join(os.path.dirname(__file__), "users.db")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT log_id, user_id, timestamp, log_type, value 
-        FROM logs 
-        WHERE user_id = ? 
-        ORDER BY timestamp DESC
-    """, (user_id,))
-    
-    logs = cursor.fetchall()
-    conn.close()
-    
-    # Convert to list of dictionaries
-    log_list = []
-    for log in logs:
-        log_list.append({
-            "log_id": log[0],
-            "user_id": log[1],
-            "timestamp": log[2],
-            "log_type": log[3],
-            "value": log[4]
-        })
-    
-    return log_list
+async def get_user_logs(
+    user_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=5000),
+    before: Optional[str] = None,
+    log_type: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """
+    Get logs for a specific user, newest first.
+
+    - json (default): one page of at most `limit` logs (default 500). The cursor for
+      the next page is returned in the X-Next-Cursor header; pass it back as `before`.
+    - ndjson: streams every matching log (up to `limit`, if given), one JSON object per line.
+    Filter with `log_type` and an ISO `start`/`end` time range.
+    """
+    filters = {"before": before, "log_type": log_type, "start": start, "end": end}
+    if before:
+        try:
+            database.decode_log_cursor(before)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        async def ndjson_lines():
+            async for log in async_database.stream_user_logs(user_id, limit=limit, **filters):
+                yield json.dumps(log) + "\n"
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    logs, next_cursor = await async_database.get_user_logs(
+        user_id, limit=limit or database.DEFAULT_LOG_PAGE_SIZE, **filters
+    )
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(logs, headers=headers)
+
+@app.get("/export/logs")
+async def export_logs(
+    format: str = Query("csv", pattern="^(csv|ndjson|npz)$"),
+    user_id: Optional[List[int]] = Query(None),
+    log_type: Optional[List[str]] = Query(None),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    condition: Optional[str] = None,
+    include_archive: bool = True,
+):
+    """
+    Bulk export of logs for all users, or those given by repeated `user_id` or with a
+    medical `condition`; filter with repeated `log_type` and an ISO `start`/`end` range.
+    Streamed as gzip CSV, NDJSON or columnar npz in fixed-size chunks (see log_export.py).
+    """
+    for value in (start, end):
+        if value:
+            try:
+                datetime.datetime.fromisoformat(value.strip())
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+    import log_export
+    media_type, suffix = log_export.FORMATS[format]
+    stream = log_export.export_logs(format, user_ids=user_id, log_types=log_type, start=start, end=end,
+                                    condition=condition, include_archive=include_archive)
+    return StreamingResponse(stream, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="logs{suffix}"'})
+
+@app.get("/nutrition/estimate")
+async def estimate_meal_macros(meal: str = Query(..., min_length=1, max_length=500)):
+    """Per-item and total carbs/protein/fat/kcal for a meal description, from the local nutrient database."""
+    estimate = await async_database.run_in_db_thread(nutrition.estimate_macros, meal)
+    return {"meal": meal, **estimate.to_dict()}
+
+@app.get("/users/{user_id}/mood/summary")
+async def get_user_mood_summary(user_id: int):
+    """Precomputed mood averages (all-time, rolling 7/30 days), EMAs, trend and latest mood."""
+    if not await async_database.get_user_profile(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return await async_database.get_mood_summary(user_id)
+
+@app.get("/users/{user_id}/cgm/analytics")
+async def get_user_cgm_analytics(user_id: int, days: Optional[float] = Query(14, gt=0)):
+    """
+    CGM summary for one user over the last `days` days: time below/in/above range,
+    mean, SD, CV, GMI, rate of change and rolling 1h/24h/7d means.
+    """
+    import cgm_analytics
+    return await async_database.run_in_db_thread(cgm_analytics.user_cgm_metrics, user_id, days)
+
+@app.get("/cohorts/cgm/analytics")
+async def get_cohort_cgm_analytics(days: Optional[float] = Query(14, gt=0)):
+    """Distribution (mean, p10/median/p90) of per-user CGM metrics across all users."""
+    import cgm_analytics
+    return await async_database.run_in_db_thread(cgm_analytics.cohort_cgm_metrics, days)
+
+@app.get("/users/{user_id}/logs/archive")
+async def get_user_archived_logs(
+    user_id: int,
+    log_type: Optional[str] = Query(None, pattern="^(cgm|mood)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """Raw CGM/mood logs compacted out of the logs table by retention.py, newest first."""
+    import retention
+    try:
+        return await async_database.run_in_db_thread(retention.read_archived_logs, user_id, log_type, start, end, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/users/{user_id}/rollups")
+async def get_user_rollups(
+    user_id: int,
+    log_type: str = Query("cgm", pattern="^(cgm|mood)$"),
+    resolution: str = Query("daily", pattern="^(hourly|daily)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+):
+    """
+    Hourly or daily count/min/max/mean (and CGM time in range) of a user's compacted
+    readings. Only covers data older than the retention window; recent data is in /logs.
+    """
+    import retention
+    try:
+        return await async_database.run_in_db_thread(retention.get_rollups, user_id, log_type, resolution, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/cohorts/stats")
+async def get_cohort_stats(
+    city: Optional[str] = None,
+    diet: Optional[str] = None,
+    condition: Optional[str] = None,
+    log_type: str = Query("cgm", pattern="^(cgm|mood|food)$"),
+    days: Optional[int] = Query(30, ge=1),
+    group_by: Optional[str] = Query(None, pattern="^(city|diet|condition)$"),
+):
+    """
+    Population stats (users, readings, mean, SD, min/max, CGM time in range) for the
+    users matching city/diet/condition over the last `days` days, overall or per
+    `group_by` value. Read from the precomputed cohort aggregate tables.
+    """
+    return await async_database.run_in_db_thread(database.get_cohort_stats, city, diet, condition,
+                                                 log_type, days, group_by)
+
+async def startup_report() -> Dict[str, Any]:
+    """Runs the app's startup (including the agent warm-up) and shutdown once, returning cold-start timings."""
+    async with app.router.lifespan_context(app):
+        if AGENT_WARMUP:
+            await app.state.agent_warmup
+    return {"worker_pid": os.getpid(), "startup_seconds": instrumentation.STARTUP}
 
 if __name__ == "__main__":
+    if "--startup-report" in sys.argv:
+        # Cold-start timings as JSON, for tracking over time (python -X importtime has per-module detail)
+        print(json.dumps(asyncio.run(startup_report()), indent=2))
+        sys.exit(0)
     print("Starting Healthcare Multi-Agent Server...")
     print("Frontend will be available at: http://localhost:3000")
     print("Backend API will be available at: http://localhost:8000")
     print("API Documentation: http://localhost:8000/docs")
     print("Make sure to add your GROQ_API_KEY to the .env file!")
+    workers = server_workers()
+    print(f"Workers: {workers}")
     print()
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if workers > 1:
+        # Worker processes import the app themselves, so it is passed by import string;
+        # the resolved count is exported so per-worker settings (sessions) can see it,
+        # and workers share a fresh metrics directory so /metrics covers all of them
+        os.environ["SERVER_WORKERS"] = str(workers)
+        metrics_dir = None
+        if "METRICS_MULTIPROC_DIR" not in os.environ:
+            metrics_dir = os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="healthcare-metrics-")
+        try:
+            uvicorn.run("run_server:app", host=SERVER_HOST, port=SERVER_PORT, workers=workers,
+                        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT)
+        finally:
+            if metrics_dir:   # only a directory this process created
+                shutil.rmtree(metrics_dir, ignore_errors=True)
+    else:
+        uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT, timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT)
@@ -0,0 +1,221 @@
+"""
+Per-session conversation state for the agent endpoints.
+
+All sessions share the single main_router_agent, so conversation context is kept
+here and passed to the agent explicitly with each message instead of living in
+the agent. Each session holds its known user ID, the last few turns verbatim and
+a rolling summary of older turns. Both are capped, so prompt size and memory per
+session stay constant. Sessions are kept in an LRU map with an idle TTL,
+optionally persisted to SQLite so they survive a restart, and guarded by a
+per-session lock so concurrent requests on one session run one at a time.
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import database
+from async_database import run_in_db_thread
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))          # turns kept verbatim
+SESSION_TURN_CHARS = int(os.getenv("SESSION_TURN_CHARS", "400"))      # per message, verbatim turns
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "800"))
+SESSION_PERSIST = os.getenv("SESSION_PERSIST", "1") != "0"
+# With several server workers a session's requests can land on different
+# processes, so the cached copy is checked against SQLite before each use.
+# Defaults to on whenever more than one worker is configured.
+_SERVER_WORKERS = os.getenv("SERVER_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))
+SESSION_REVALIDATE = os.getenv("SESSION_REVALIDATE", "1" if _SERVER_WORKERS not in ("", "1") else "0") != "0"
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+@dataclass
+class Session:
+    session_id: Optional[str]
+    user_id: Optional[int] = None
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    summary: str = ""
+    last_used: float = field(default_factory=time.monotonic)
+    updated_at: float = 0.0  # agent_sessions.updated_at of the state held here
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    dirty: bool = False
+
+    def record(self, message: str, reply: str, user_id: Optional[int] = None):
+        """Appends a turn, folding the oldest turns into the summary once over the cap."""
+        if user_id is not None:
+            self.user_id = user_id
+        self.turns.append((_clip(message, SESSION_TURN_CHARS), _clip(reply, SESSION_TURN_CHARS)))
+        while len(self.turns) > SESSION_MAX_TURNS:
+            user_text, reply_text = self.turns.pop(0)
+            folded = f"User: {_clip(user_text, 100)} / Assistant: {_clip(reply_text, 100)}"
+            summary = f"{self.summary} | {folded}" if self.summary else folded
+            # Keep the most recent part of the summary within budget
+            self.summary = summary[-SESSION_SUMMARY_CHARS:]
+        self.dirty = True
+
+    def prompt(self, message: str, user_id: Optional[int] = None) -> str:
+        """Builds the agent input: user context, prior conversation, then the new message."""
+        user_id = user_id or self.user_id
+        prefix = f"[User ID: {user_id}] " if user_id else ""
+        if not self.turns and not self.summary:
+            return f"{prefix}{message}"
+
+        lines = []
+        if self.summary:
+            lines.append(f"Earlier in this conversation: {self.summary}")
+        if self.turns:
+            lines.append("Recent conversation:")
+            for user_text, reply_text in self.turns:
+                lines.append(f"User: {user_text}")
+                lines.append(f"Assistant: {reply_text}")
+        history = "\n".join(lines)
+        return f"[Conversation context]\n{history}\n[New message]\n{prefix}{message}"
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "summary": self.summary,
+            "turns": json.dumps(self.turns),
+        }
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "Session":
+        return cls(
+            session_id=row["session_id"],
+            user_id=row["user_id"],
+            summary=row["summary"] or "",
+            turns=[tuple(turn) for turn in json.loads(row["turns"] or "[]")],
+            updated_at=row.get("updated_at") or 0.0,
+        )
+
+
+class SessionManager:
+    """LRU/TTL store of Sessions keyed by session_id."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl: float = SESSION_TTL_SECONDS,
+                 persist: bool = SESSION_PERSIST, revalidate: bool = SESSION_REVALIDATE):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.persist = persist
+        self.revalidate = persist and revalidate
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.created = self.restored = self.evicted = self.expired = self.refreshed = 0
+
+    @asynccontextmanager
+    async def session(self, session_id: Optional[str]):
+        """
+        Yields the Session for session_id, holding its lock for the duration of the
+        request and persisting it afterwards. Requests without a session_id get a
+        throwaway session, so callers can treat both cases the same way.
+        """
+        if not session_id:
+            yield Session(session_id=None)
+            return
+
+        session = await self._get_or_load(session_id)
+        async with session.lock:
+            if self.revalidate:
+                await self._refresh(session)
+            try:
+                yield session
+            finally:
+                session.last_used = time.monotonic()
+                if session.dirty and self.persist:
+                    session.dirty = False
+                    session.updated_at = await run_in_db_thread(database.save_session, **session.to_row())
+
+    async def _refresh(self, session: Session):
+        """Reloads a cached session if another worker process has saved a newer version."""
+        updated_at = await run_in_db_thread(database.session_updated_at, session.session_id)
+        if updated_at is None or updated_at <= session.updated_at:
+            return
+        row = await run_in_db_thread(database.load_session, session.session_id, self.ttl)
+        if row:
+            fresh = Session.from_row(row)
+            session.user_id, session.turns, session.summary = fresh.user_id, fresh.turns, fresh.summary
+            session.updated_at = fresh.updated_at
+            self.refreshed += 1
+
+    async def _get_or_load(self, session_id: str) -> Session:
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is not None and now - session.last_used > self.ttl and not session.lock.locked():
+            del self._sessions[session_id]
+            self.expired += 1
+            session = None
+
+        if session is None:
+            row = await run_in_db_thread(database.load_session, session_id, self.ttl) if self.persist else None
+            # Another request may have created the session while we were loading
+            session = self._sessions.get(session_id)
+            if session is None:
+                if row:
+                    session = Session.from_row(row)
+                    self.restored += 1
+                else:
+                    session = Session(session_id=session_id)
+                    self.created += 1
+                self._sessions[session_id] = session
+
+        self._sessions.move_to_end(session_id)
+        self._evict(now)
+        return session
+
+    def _evict(self, now: float):
+        """Drops expired sessions from the LRU end, then trims to max_sessions."""
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_used <= self.ttl:
+                break
+            if not session.lock.locked():
+                del self._sessions[session_id]
+                self.expired += 1
+        while len(self._sessions) > self.max_sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.lock.locked():
+                break
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl,
+            "persist": self.persist,
+            "revalidate": self.revalidate,
+            "created": self.created,
+            "restored": self.restored,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "refreshed": self.refreshed,
+        }
+
+
+session_manager = SessionManager()
+
+
+def agent_run_kwargs(agent, session: Session) -> Dict[str, Any]:
+    """
+    Passes session_id/user_id to agent.arun() when the installed agno version
+    accepts them (2.x), so the framework also keeps per-session run state apart.
+    """
+    params = inspect.signature(agent.arun).parameters
+    kwargs = {}
+    if session.session_id and "session_id" in params:
+        kwargs["session_id"] = session.session_id
+    if session.user_id and "user_id" in params:
+        kwargs["user_id"] = str(session.user_id)
+    return kwargs
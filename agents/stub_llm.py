@@ -0,0 +1,151 @@
+"""
+Offline, deterministic stand-in for the Groq model.
+
+Selected with LLM_BACKEND=stub (see agents_config.py). It answers without any
+network access, following a fixed script. The first turn maps the user message to
+a tool call with the same rules as fast_router, plus food and meal-plan
+keywords. Once tool results come back, it replies with a short summary of them.
+This exercises the full agno run loop (tool dispatch, DB writes, streaming), so
+the server's own overhead can be measured and tested without Groq.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from agno.models.base import Model
+from agno.models.response import ModelResponse
+
+try:
+    from agno.metrics import MessageMetrics
+except ImportError:  # older agno releases do not report usage through this class
+    MessageMetrics = None
+
+import database
+import fast_router
+
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "0"))
+
+USER_ID_PREFIX = re.compile(r"^\[User ID: (\d+)\]\s*")
+FOOD_PATTERN = re.compile(r"\b(?:i\s+(?:ate|had)|for\s+(?:breakfast|lunch|dinner)|snack(?:ed)?)\b", re.IGNORECASE)
+MEAL_PLAN_PATTERN = re.compile(r"\bmeal\s*plan\b", re.IGNORECASE)
+
+
+def _text(message) -> str:
+    content = message.get_content_string() if hasattr(message, "get_content_string") else message.content
+    return content or ""
+
+
+def _latest_request(messages: List[Any]) -> str:
+    """The newest user message, without the session context block around it."""
+    for message in reversed(messages):
+        if message.role == "user":
+            text = _text(message)
+            return text.split("[New message]\n")[-1].strip()
+    return ""
+
+
+@dataclass
+class StubModel(Model):
+    id: str = "stub-llm"
+    name: str = "StubModel"
+    provider: str = "Stub"
+    latency_ms: float = STUB_LLM_LATENCY_MS
+
+    def _plan(self, messages: List[Any], tools: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Decides the scripted reply: {"content": ...} or {"tool_call": (name, args)}."""
+        if messages and messages[-1].role == "tool":
+            results = []
+            for message in reversed(messages):
+                if message.role != "tool":
+                    break
+                results.append(_text(message))
+            return {"content": "\n\n".join(reversed(results))}
+
+        request = _latest_request(messages)
+        match = USER_ID_PREFIX.match(request)
+        user_id = int(match.group(1)) if match else None
+        message = USER_ID_PREFIX.sub("", request)
+        available = {t.get("function", {}).get("name") for t in tools or []}
+
+        call = None
+        classified = fast_router.classify(message, user_id)
+        if classified is not None:
+            _, tool, kwargs = classified
+            call = (getattr(tool, "name", None) or tool.__name__, kwargs)
+        elif user_id is not None and MEAL_PLAN_PATTERN.search(message):
+            profile = database.get_user_profile(user_id) or {}
+            call = ("generate_adaptive_meal_plan", {
+                "user_id": user_id,
+                "dietary_preference": profile.get("dietary_preference", "vegetarian"),
+                "medical_conditions": profile.get("medical_conditions", "Not specified"),
+            })
+        elif user_id is not None and FOOD_PATTERN.search(message):
+            call = ("record_food_and_estimate_macros", {"user_id": user_id, "meal_description": message})
+
+        if call is not None and call[0] in available:
+            return {"tool_call": call}
+        if user_id is None:
+            return {"content": "Hello! Please share your user ID (1-100) so I can help you."}
+        return {"content": f"Thanks for your message. (stub reply to: {message[:80]})"}
+
+    def _response(self, messages: List[Any], tools) -> ModelResponse:
+        plan = self._plan(messages, tools)
+        response = ModelResponse(role="assistant")
+        if "tool_call" in plan:
+            name, args = plan["tool_call"]
+            response.tool_calls = [{
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(args)},
+            }]
+        else:
+            response.content = plan["content"]
+
+        if MessageMetrics is not None:
+            usage = MessageMetrics()
+            usage.input_tokens = sum(len(_text(m)) for m in messages) // 4
+            usage.output_tokens = len(response.content or "") // 4 + (8 if response.tool_calls else 0)
+            usage.total_tokens = usage.input_tokens + usage.output_tokens
+            response.response_usage = usage
+        return response
+
+    def _chunks(self, response: ModelResponse) -> Iterator[ModelResponse]:
+        """Splits a scripted reply into word-sized streaming deltas."""
+        if response.tool_calls or not response.content:
+            yield response
+            return
+        words = re.findall(r"\S+\s*", response.content)
+        for i, word in enumerate(words):
+            delta = ModelResponse(role="assistant", content=word)
+            if i == len(words) - 1:
+                delta.response_usage = response.response_usage
+            yield delta
+
+    def invoke(self, messages: List[Any], *args, tools=None, **kwargs) -> ModelResponse:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._response(messages, tools)
+
+    async def ainvoke(self, messages: List[Any], *args, tools=None, **kwargs) -> ModelResponse:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self._response(messages, tools)
+
+    def invoke_stream(self, messages: List[Any], *args, tools=None, **kwargs) -> Iterator[ModelResponse]:
+        yield from self._chunks(self.invoke(messages, tools=tools))
+
+    async def ainvoke_stream(self, messages: List[Any], *args, tools=None, **kwargs) -> AsyncIterator[ModelResponse]:
+        for delta in self._chunks(await self.ainvoke(messages, tools=tools)):
+            yield delta
+
+    def _parse_provider_response(self, response: Any, **kwargs) -> ModelResponse:
+        return response
+
+    def _parse_provider_response_delta(self, response: Any) -> ModelResponse:
+        return response
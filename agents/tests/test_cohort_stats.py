@@ -0,0 +1,65 @@
+"""Batch ingestion keeps the cohort aggregates consistent: rejected batches change nothing."""
+
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ["RETENTION_INTERVAL_SECONDS"] = "0"
+os.environ["AGENT_WARMUP"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import run_server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # one app lifecycle for the module: shutdown stops the database thread pool
+    database.close_connections()
+    saved_path, database.DB_PATH = database.DB_PATH, str(tmp_path_factory.mktemp("db") / "users.db")
+    database.invalidate_user_profile()
+    with TestClient(run_server.app) as client:
+        yield client
+    database.close_connections()
+    database.DB_PATH = saved_path
+
+
+def _cohort_daily():
+    database.flush_logs()
+    return database.get_connection().execute("SELECT * FROM cohort_daily ORDER BY 1, 2, 3, 4, 5").fetchall()
+
+
+@pytest.mark.parametrize("bad_entry", [
+    {"user_id": 1, "log_type": "cgm", "value": "120", "timestamp": "yesterday"},
+    {"user_id": 1, "log_type": "mood", "value": "happy", "timestamp": "2024-13-01T10:00:00"},
+    {"user_id": 1, "log_type": "bogus", "value": "120"},
+])
+def test_batch_with_invalid_entry_is_rejected(client, bad_entry):
+    good = {"user_id": 2, "log_type": "cgm", "value": "150", "timestamp": "2024-01-01T10:00:00Z"}
+    before = _cohort_daily()
+    response = client.post("/logs/batch", json=[good, bad_entry])
+    assert response.status_code == 422
+    assert _cohort_daily() == before
+
+
+def test_batch_for_unknown_user_is_rejected(client):
+    before = _cohort_daily()
+    response = client.post("/logs/batch", json=[{"user_id": 10 ** 9, "log_type": "cgm", "value": "120"}])
+    assert response.status_code == 404
+    assert _cohort_daily() == before
+
+
+def test_valid_batch_updates_cohort_daily(client):
+    response = client.post("/logs/batch", json=[
+        {"user_id": 1, "log_type": "cgm", "value": "120", "timestamp": "2024-01-01T10:00:00Z"},
+        {"user_id": 1, "log_type": "cgm", "value": "200", "timestamp": "2024-01-01T23:30:00-02:00"},
+    ])
+    assert response.status_code == 200
+    rows = database.get_connection().execute(
+        "SELECT day, readings, value_sum FROM cohort_daily WHERE log_type = 'cgm' AND condition = ''"
+    ).fetchall()
+    # the second reading is 01:30 UTC the next day
+    assert sorted(rows) == [("2024-01-01", 1, 120.0), ("2024-01-02", 1, 200.0)]
@@ -22,6 +22,8 @@ interface ChatMessage {
 
 export default function HomePage() {
   const [currentUserId, setCurrentUserId] = useState<number | null>(null);
+  // One conversation session per browser tab, so the backend keeps each chat's context separate
+  const [sessionId] = useState(() => `session-${Date.now()}-${Math.random().toString(36).slice(2)}`);
   const [message, setMessage] = useState('');
   const [chatMessages, setChatMessages] = useState<ChatMessage[]>([]);
   const [isLoading, setIsLoading] = useState(false);
@@ -36,17 +38,29 @@ export default function HomePage() {
   const [realFoodData, setRealFoodData] = useState<{ timestamp: string; meal: string }[]>([]);
   const [currentMealPlan, setCurrentMealPlan] = useState<string | null>(null);
 
+  // Follows the X-Next-Cursor header until every log of the given type has been read
+  const fetchAllLogs = async (userId: number, logType: string): Promise<any[]> => {
+    const logs: any[] = [];
+    let before: string | undefined;
+    do {
+      const response = await axios.get(`${process.env.NEXT_PUBLIC_AGENT_URL}/users/${userId}/logs`, {
+        params: { log_type: logType, limit: 5000, before }
+      });
+      logs.push(...response.data);
+      before = response.headers['x-next-cursor'];
+    } while (before);
+    return logs;
+  };
+
   // Function to fetch user's real data
   const fetchUserData = async (userId: number) => {
     try {
-      // Fetch user logs from backend
-      const response = await axios.get(`${process.env.NEXT_PUBLIC_AGENT_URL}/users/${userId}/logs`);
-      const logs = response.data;
-      
-      // Separate CGM, mood, and food data
-      const cgmLogs = logs.filter((log: any) => log.log_type === 'cgm');
-      const moodLogs = logs.filter((log: any) => log.log_type === 'mood');
-      const foodLogs = logs.filter((log: any) => log.log_type === 'food');
+      // Fetch each log type separately, so dense CGM readings can't crowd mood and food out of a page
+      const [cgmLogs, moodLogs, foodLogs] = await Promise.all([
+        fetchAllLogs(userId, 'cgm'),
+        fetchAllLogs(userId, 'mood'),
+        fetchAllLogs(userId, 'food')
+      ]);
       
       // Convert to chart format
       const cgmData = cgmLogs.map((log: any) => ({
@@ -106,7 +120,7 @@ export default function HomePage() {
       const response = await axios.post(`${process.env.NEXT_PUBLIC_AGENT_URL}/ag-ui-agent`, {
         message: currentMessage,
         user_id: currentUserId || null, // Always send user_id, even if null
-        session_id: 'demo-session'
+        session_id: sessionId
       });
       
       // Extract clean response content from RunResponse object